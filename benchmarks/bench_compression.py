@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Benchmark of the frame compression wdb instances may negotiate.
+
+Builds payloads shaped like the File, Dump and Trace messages a debugging
+session exchanges, then measures for each zlib level the CPU cost of
+compressing and decompressing them against the bytes saved, and the time
+it takes to get each payload across a link of the given bandwidth.
+
+    python benchmarks/bench_compression.py [--repeat 200] [--mbps 10]
+"""
+
+# Stdlib:
+import argparse
+import asyncio.base_events
+import json
+import os
+import time
+import zlib
+from typing import Callable, Dict
+
+
+def file_payload() -> str:
+    filename = asyncio.base_events.__file__
+    with open(filename, encoding="utf-8") as source:
+        return "File|" + json.dumps({"name": filename, "file": source.read()})
+
+
+def dump_payload() -> str:
+    return "Dump|" + json.dumps(
+        {
+            "for": "os",
+            "val": {
+                key: {"val": repr(getattr(os, key)), "type": "attribute"}
+                for key in dir(os)
+            },
+            "doc": os.__doc__,
+            "source": "",
+        }
+    )
+
+
+def trace_payload() -> str:
+    return "Trace|" + json.dumps(
+        {
+            "trace": [
+                {
+                    "file": f"/srv/app/module_{i}.py",
+                    "function": f"handler_{i}",
+                    "lno": 10 * i + 3,
+                    "flno": 10 * i,
+                    "llno": 10 * i + 9,
+                    "code": f"result = handler_{i + 1}(request, **options)",
+                    "current": i == 29,
+                }
+                for i in range(30)
+            ],
+            "cwd": "/srv/app",
+        }
+    )
+
+
+PAYLOADS: Dict[str, Callable[[], str]] = {
+    "File": file_payload,
+    "Dump": dump_payload,
+    "Trace": trace_payload,
+}
+
+
+def timed(function: Callable[[], bytes], repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument(
+        "--mbps", type=float, default=10, help="Link bandwidth in Mbit/s"
+    )
+    args = parser.parse_args()
+    bandwidth = args.mbps * 1e6 / 8
+
+    print(
+        f"{'payload':>8} {'level':>5} {'bytes':>9} {'ratio':>6} "
+        f"{'compress':>10} {'inflate':>10} {'transfer':>10}"
+    )
+    for name, build in PAYLOADS.items():
+        data = build().encode("utf-8")
+        print(
+            f"{name:>8} {'-':>5} {len(data):9,} {1:6.2f} {'-':>10} "
+            f"{'-':>10} {len(data) / bandwidth * 1e3:8.2f}ms"
+        )
+        for level in (1, 6, 9):
+            compressed = zlib.compress(data, level)
+            compress = timed(lambda: zlib.compress(data, level), args.repeat)
+            inflate = timed(lambda: zlib.decompress(compressed), args.repeat)
+            transfer = compress + inflate + len(compressed) / bandwidth
+            print(
+                f"{name:>8} {level:>5} {len(compressed):9,} "
+                f"{len(data) / len(compressed):6.2f} "
+                f"{compress * 1e6:8.0f}us {inflate * 1e6:8.0f}us "
+                f"{transfer * 1e3:8.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
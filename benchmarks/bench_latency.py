@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Round-trip latency of wdb instances over TCP loopback and Unix socket.
+
+Serves handle_tcp_connection on both a loopback TCP port and a Unix domain
+socket, then times ServerBreaks requests answered by the server from a
+client connected to each of them.
+
+Run from the repository root, so that wdb_server is importable:
+
+    python -m benchmarks.bench_latency [--requests 20000]
+"""
+
+# Stdlib:
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from struct import pack, unpack
+from typing import List
+
+# Firstparty:
+from wdb_server.utils.streams import handle_tcp_connection
+
+REQUEST = pack("!i", len(b"ServerBreaks")) + b"ServerBreaks"
+
+
+async def round_trips(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, requests: int
+) -> List[float]:
+    session = str(uuid.uuid4()).encode("utf-8")
+    writer.write(pack("!i", len(session)) + session)
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        writer.write(REQUEST)
+        (length,) = unpack("!i", await reader.readexactly(4))
+        await reader.readexactly(length)
+        timings.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+    return timings
+
+
+async def run(requests: int) -> None:
+    closed: "asyncio.Queue[None]" = asyncio.Queue()
+
+    async def handler(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        await handle_tcp_connection(reader, writer)
+        closed.put_nowait(None)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "wdb.sock")
+        tcp = await asyncio.start_server(handler, "127.0.0.1", 0)
+        unix = await asyncio.start_unix_server(handler, path)
+        port = tcp.sockets[0].getsockname()[1]
+
+        for name, connect in (
+            (
+                "tcp loopback",
+                lambda: asyncio.open_connection("127.0.0.1", port),
+            ),
+            ("unix socket", lambda: asyncio.open_unix_connection(path)),
+        ):
+            timings = await round_trips(*await connect(), requests)
+            await closed.get()
+            quantiles = statistics.quantiles(timings, n=100)
+            print(
+                f"{name:>12}: p50 {quantiles[49] * 1e6:7.1f}us "
+                f"p99 {quantiles[98] * 1e6:7.1f}us "
+                f"{requests / sum(timings):10,.0f} round trips/s"
+            )
+
+        for server in (tcp, unix):
+            server.close()
+            await server.wait_closed()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests))
+
+
+if __name__ == "__main__":
+    main()
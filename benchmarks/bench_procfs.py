@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark of the python process scanners against a synthetic /proc.
+
+Builds a /proc-like tree of processes, a few of them running python, then
+times the psutil scanner (technical.scan_processes, with psutil pointed at
+the synthetic tree) and the ProcfsScanner reading it directly.
+
+Run from the repository root, so that wdb_server is importable:
+
+    python -m benchmarks.bench_procfs [--processes 10000] [--python 200]
+"""
+
+# Stdlib:
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Thirdparty:
+import psutil
+
+# Firstparty:
+from wdb_server.utils.procfs import ProcfsScanner
+from wdb_server.utils.technical import scan_processes
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+UID = os.getuid()
+
+
+def make_process(root: Path, pid: int, python: bool) -> None:
+    path = root / str(pid)
+    path.mkdir()
+    binary = b"/usr/bin/python3.9" if python else b"/usr/sbin/daemon"
+    (path / "cmdline").write_bytes(binary + b"\0--worker\0" + b"x" * 64)
+    stat = ["S"] + ["0"] * 49
+    stat[11], stat[12], stat[17] = "120", "30", "4"
+    stat[19], stat[21] = str(100 * CLOCK_TICKS + pid), "2048"
+    (path / "stat").write_text(f"{pid} (worker) " + " ".join(stat) + "\n")
+    (path / "statm").write_text("8192 2048 512 16 0 1024 0\n")
+    (path / "status").write_text(
+        f"Name:\tworker\nState:\tS (sleeping)\nPid:\t{pid}\n"
+        f"Uid:\t{UID}\t{UID}\t{UID}\t{UID}\n"
+        f"Gid:\t{UID}\t{UID}\t{UID}\t{UID}\nThreads:\t4\n"
+    )
+
+
+def make_procfs(root: Path, processes: int, python: int) -> None:
+    (root / "stat").write_text("cpu  1 2 3 4 5 6 7 8\nbtime 1700000000\n")
+    (root / "meminfo").write_text(
+        "MemTotal:       16000000 kB\nMemFree:         8000000 kB\n"
+        "MemAvailable:   12000000 kB\nBuffers:          100000 kB\n"
+        "Cached:          2000000 kB\nSlab:             100000 kB\n"
+        "SReclaimable:     50000 kB\nShmem:             10000 kB\n"
+        "Active:          4000000 kB\nInactive:        2000000 kB\n"
+    )
+    step = max(processes // max(python, 1), 1)
+    for pid in range(1, processes + 1):
+        make_process(root, pid, python > 0 and pid % step == 0)
+
+
+def timed(scan: Callable[[], List[Dict[str, Any]]], repeat: int) -> float:
+    scan()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        found = scan()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"  found {len(found)} python processes")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=10_000)
+    parser.add_argument("--python", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = Path(directory)
+        make_procfs(root, args.processes, args.python)
+
+        psutil.PROCFS_PATH = directory
+        print("psutil")
+        legacy = timed(scan_processes, args.repeat)
+        print("procfs")
+        procfs = timed(ProcfsScanner(directory).scan, args.repeat)
+
+    print(
+        f"{'psutil':>8}: {legacy * 1e3:9.1f}ms per scan\n"
+        f"{'procfs':>8}: {procfs * 1e3:9.1f}ms per scan "
+        f"({legacy / procfs:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# pylint: disable=protected-access
+"""
+Micro-benchmark of the server -> wdb instance send path.
+
+Compares the former send path (header and payload written separately,
+each followed by a drain) with the one of Sockets._send, which queues
+single-buffer messages for the stream sender task, over a loopback
+connection to a sink which discards what it receives.
+
+Run from the repository root, so that wdb_server is importable:
+
+    python -m benchmarks.bench_send [--messages 200000] [--size 128]
+"""
+
+# Stdlib:
+import argparse
+import asyncio
+import time
+from struct import pack
+
+# Firstparty:
+from wdb_server.utils.state import Message, Sockets
+from wdb_server.utils.streams import IOStream
+
+
+async def legacy_send(stream: IOStream, data: str) -> None:
+    stream._writer.write(pack("!i", len(data)))
+    await stream._writer.drain()
+    stream._writer.write(data.encode("utf-8"))
+    await stream._writer.drain()
+
+
+SOCKETS = Sockets()
+
+
+async def queued_send(stream: IOStream, data: str) -> None:
+    await SOCKETS._send(stream, Message(data))
+
+
+async def run(messages: int, size: int) -> None:
+    drained: "asyncio.Queue[None]" = asyncio.Queue()
+
+    async def sink(
+        reader: asyncio.StreamReader, _: asyncio.StreamWriter
+    ) -> None:
+        while await reader.read(2**16):
+            pass
+        drained.put_nowait(None)
+
+    server = await asyncio.start_server(sink, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    data = "Eval|" + "x" * (size - 5)
+
+    for name, send in (
+        ("two writes + drain", legacy_send),
+        ("queued, coalesced", queued_send),
+    ):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        stream = IOStream(reader, writer)
+        start = time.perf_counter()
+        for _ in range(messages):
+            await send(stream, data)
+        while stream.queue_size:
+            await asyncio.sleep(0)
+        await writer.drain()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20}: {messages / elapsed:12,.0f} messages/s")
+        await stream.close()
+        await drained.get()
+
+    server.close()
+    await server.wait_closed()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--size", type=int, default=128)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.size))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,9 @@ async def client(aiohttp_client):
     """
     The fixture for the initialize client.
     """
-    app = await init_app({})
+    # Status pages poll rather than following the processes of the host,
+    # and PyPI is never checked
+    app = await init_app({"process_monitor": "poll", "offline": True})
 
     return await aiohttp_client(app)
 
@@ -28,6 +30,8 @@ class DummySocket:
     Test class for represent any real socket
     """
 
+    compression = False
+
     async def close(self):
         ...
 
@@ -4,6 +4,7 @@ class Websocket extends Log {
     public wdb: any;
     public url: string;
     public ws: WebSocket;
+    public chunks: string[] = [];
 
     constructor(wdb: any, uuid: string) {
         super();
@@ -39,6 +40,16 @@ class Websocket extends Log {
         // Open a websocket in case of request break
         let cmd, data;
         const message = m.data;
+        // Large frames are relayed in chunks ended by ChunkEnd
+        if (message.startsWith("Chunk|")) {
+            this.chunks.push(message.substr(6));
+            return;
+        }
+        if (message === "ChunkEnd") {
+            const frame = this.chunks.join("");
+            this.chunks = [];
+            return this.message({ data: frame });
+        }
         const pipe = message.indexOf("|");
         if (pipe > -1) {
             cmd = message.substr(0, pipe);
@@ -154,9 +154,14 @@ const make_process_line = function (proc: any) {
         return (() => {
             const result = [];
             for (let elt of ["pid", "user", "cmd", "time", "mem", "cpu"]) {
-                result.push(
-                    $tr.find(`.${elt}`).html(get_proc_thread_val(proc, elt))
-                );
+                // Updates only carry the fields which changed
+                if (elt in proc) {
+                    result.push(
+                        $tr
+                            .find(`.${elt}`)
+                            .html(get_proc_thread_val(proc, elt))
+                    );
+                }
             }
             return result;
         })();
@@ -221,6 +226,38 @@ mdl-button--colored\" title=\"Pause\">
 // $proc.find('.rowspan').attr('rowspan',
 //   (+$proc.find('.rowspan').attr('rowspan') or 1) + 1)
 
+const update_processes = function (data: any) {
+    if (data.full) {
+        $(".processes tbody tr").remove();
+    }
+    for (let pid of data.removed) {
+        $(`.processes [data-of=${pid}]`).remove();
+        $(`.processes tbody tr[data-pid=${pid}]`).remove();
+    }
+    for (let proc of data.processes) {
+        make_process_line(proc);
+        // Threads are only listed for the expanded processes
+        const $tr = $(`.processes tbody tr[data-pid=${proc.pid}]`);
+        if ("threads" in proc && $tr.find(".minus").length) {
+            ws.send(`ListThreads|${proc.pid}`);
+        }
+    }
+};
+
+const update_threads = function (data: any) {
+    $(`.processes [data-of=${data.pid}]`)
+        .filter((i, tr) => !data.threads.includes(+$(tr).attr("data-tid")))
+        .remove();
+    for (let id of data.threads) {
+        make_thread_line({ id: id, of: data.pid });
+    }
+    const $tr = $(`.processes tbody tr[data-pid=${data.pid}]`);
+    if ($tr.find(".minus").length) {
+        const rowspan = $(`[data-of=${data.pid}]`).show().length;
+        $tr.find(".rowspan").attr("rowspan", rowspan + 1);
+    }
+};
+
 const ws_message = function (event: any) {
     let cmd, data;
     wait = 25;
@@ -235,6 +272,27 @@ const ws_message = function (event: any) {
     }
 
     switch (cmd) {
+        case "Batch":
+            // Status changes gathered by the server, in order
+            for (let part of data) {
+                ws_message({ data: part, target: event.target });
+            }
+            return;
+        case "Snapshot":
+            for (let socket of data.sockets) {
+                make_uuid_line(socket.uuid, "socket", socket.filename);
+            }
+            for (let websocket of data.websockets) {
+                make_uuid_line(websocket, "websocket");
+            }
+            for (let brk of data.breaks) {
+                make_brk_line(brk);
+            }
+            return update_processes({
+                full: true,
+                processes: data.processes,
+                removed: [],
+            });
         case "AddWebSocket":
             return make_uuid_line(data, "websocket");
         case "AddSocket":
@@ -247,54 +305,25 @@ const ws_message = function (event: any) {
             return make_brk_line(data);
         case "RemoveBreak":
             return rm_brk_line(data);
-        case "AddProcess":
-            return make_process_line(data);
-        case "AddThread":
-            return make_thread_line(data);
-        case "KeepProcess":
-            return (() => {
-                const result = [];
-                for (let tr of Array.from($(".processes tbody tr[data-pid]"))) {
-                    var needle;
-                    const $tr = $(tr);
-                    if (
-                        ((needle = parseInt($tr.attr("data-pid"))),
-                        !Array.from(data).includes(needle))
-                    ) {
-                        $(
-                            `.processes [data-of=${$tr.attr("data-pid")}]`
-                        ).remove();
-                        result.push($tr.remove());
-                    } else {
-                        result.push(undefined);
-                    }
-                }
-                return result;
-            })();
+        case "Processes":
+            return update_processes(data);
+        case "Threads":
+            return update_threads(data);
 
-        case "KeepProcess":
-            return (() => {
-                const result1 = [];
-                for (let tr of Array.from($(".processes tbody tr[data-tid]"))) {
-                    var needle1;
-                    const $tr = $(tr);
-                    if (
-                        ((needle1 = parseInt($tr.attr("data-tid"))),
-                        !Array.from(data).includes(needle1))
-                    ) {
-                        $tr.remove();
-                        const $proc = $(
-                            `.processes [data-pid=${$tr.attr("data-of")}]`
-                        );
-                        result1.push(
-                            $proc.attr("rowspan", +$proc.attr("rowspan") - 1)
-                        );
-                    } else {
-                        result1.push(undefined);
-                    }
+        case "QueueSizes": {
+            for (let uuid in data) {
+                $(`.sessions tr[data-uuid=${uuid}] .socket`).text(
+                    data[uuid] ? `Yes (${data[uuid]} queued)` : "Yes"
+                );
+            }
+            // Poll queue sizes for as long as this socket stays open
+            const socket = event.target;
+            return setTimeout(() => {
+                if (socket.readyState === WebSocket.OPEN) {
+                    socket.send("ListQueues");
                 }
-                return result1;
-            })();
+            }, 2000);
+        }
 
         case "StartLoop":
             // In case inotify is not available
@@ -307,10 +336,8 @@ var create_socket = function () {
     ws = new WebSocket(`${proto}//${location.host}/status`);
     ws.onopen = function () {
         $("tbody tr").remove();
-        ws.send("ListSockets");
-        ws.send("ListWebSockets");
-        ws.send("ListBreaks");
-        return ws.send("ListProcesses");
+        ws.send("Snapshot");
+        return ws.send("ListQueues");
     };
 
     ws.onerror = function () {};
@@ -365,7 +392,7 @@ $(function () {
         .on("click", ".minus", function (e) {
             const $button = $(this);
             const $tr = $button.closest("tr");
-            $(`[data-of=${$tr.attr("data-pid")}]`).hide();
+            $(`[data-of=${$tr.attr("data-pid")}]`).remove();
             $tr.find(".rowspan").attr("rowspan", 1);
             $button.removeClass("minus").addClass("plus").find("i").text("add");
             return false;
@@ -373,9 +400,7 @@ $(function () {
         .on("click", ".plus", function (e) {
             const $button = $(this);
             const $tr = $button.closest("tr");
-            const rowspan = $(`[data-of=${$tr.attr("data-pid")}]`).show()
-                .length;
-            $tr.find(".rowspan").attr("rowspan", rowspan + 1);
+            ws.send("ListThreads|" + $tr.attr("data-pid"));
             $button
                 .removeClass("plus")
                 .addClass("minus")
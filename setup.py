@@ -6,6 +6,7 @@ from typing import List
 
 # Thirdparty:
 from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py
 
 __version__ = "1.1.0-dev1"
 PARENT = pathlib.Path(__file__).parent
@@ -22,6 +23,20 @@ def read_requirements(path: str) -> List[str]:
     return requires
 
 
+class BuildPy(build_py):
+    """
+    Build the package along with the precompressed variants of its static
+    assets, which the server never writes into an installed package.
+    """
+
+    def run(self) -> None:
+        super().run()
+        static = pathlib.Path(self.build_lib, "wdb_server", "static")
+        self.spawn(
+            [sys.executable, "-m", "wdb_server.utils.assets", str(static)]
+        )
+
+
 options = dict(
     name="wdb.server.aiohttp",
     version=__version__,
@@ -54,6 +69,7 @@ options = dict(
     ],
     include_package_data=True,
     zip_safe=False,
+    cmdclass={"build_py": BuildPy},
 )
 
 setup(**options)
@@ -1,7 +1,10 @@
 # pylint: disable=missing-function-docstring,redefined-outer-name
 # pylint: disable=protected-access,no-member,missing-class-docstring
 # Stdlib:
+import asyncio
 import json
+import sys
+import time
 
 # Aiohttp:
 from aiohttp import ServerTimeoutError, web
@@ -9,18 +12,26 @@ from aiohttp import ServerTimeoutError, web
 # Thirdparty:
 import aiohttp_jinja2
 import jinja2
+import pytest
 
 # Firstparty:
 import wdb_server
+import wdb_server.app
 from wdb_server.app import (
     get_mdl_themes,
+    hash_assets,
     init_app,
     init_jinja2,
     init_themes,
     init_versions,
+    load_versions,
+    precompress_static,
     request_processor,
+    set_versions,
+    version_check,
 )
-from wdb_server.constants import MDL_THEMES_DIR
+from wdb_server.constants import MDL_THEMES_DIR, PROJECT_DIR
+from wdb_server.utils.assets import Manifest, content_hash, hashed_name
 from wdb_server.utils.state import settings as settings_store
 
 
@@ -102,7 +113,13 @@ def test_init_themes():
     }
 
 
-async def test_init_versions(mocker):
+@pytest.fixture(autouse=True)
+def cache_dir(mocker, tmp_path):
+    mocker.patch.object(settings_store, "cache_dir", str(tmp_path))
+    return tmp_path
+
+
+async def test_init_versions(mocker, cache_dir):
     app = web.Application()
     remote_version = "future_version"
     resp = MockResponse(json.dumps({"info": {"version": remote_version}}), 200)
@@ -111,6 +128,8 @@ async def test_init_versions(mocker):
     assert app["new_version"] == remote_version
     assert app["pypi_version"] == remote_version
     assert app["version"] == wdb_server.__version__
+    cached = json.loads((cache_dir / "pypi.json").read_text())
+    assert cached["version"] == remote_version
 
     resp = MockResponse(
         json.dumps({"info": {"version": wdb_server.__version__}}), 200
@@ -121,26 +140,86 @@ async def test_init_versions(mocker):
     assert app["pypi_version"] == wdb_server.__version__
     assert app["version"] == wdb_server.__version__
 
-    resp = MockResponse(ServerTimeoutError())
-    mocker.patch("aiohttp.ClientSession.get", return_value=resp)
-    await init_versions(app)
-    assert app["new_version"] is False
-    assert app["pypi_version"] == "pypi_error"
-    assert app["version"] == wdb_server.__version__
+    # Failed checks keep the last version found, and are not cached
+    for error, pypi_version in (
+        (ServerTimeoutError(), "pypi_error"),
+        ("badvalue", "parsing_error"),
+        (Exception(), "unknown_error"),
+    ):
+        mocker.patch(
+            "aiohttp.ClientSession.get", return_value=MockResponse(error)
+        )
+        await init_versions(app)
+        assert app["new_version"] is False
+        assert app["pypi_version"] == wdb_server.__version__
+        assert app["version"] == wdb_server.__version__
 
-    resp = MockResponse("badvalue")
-    mocker.patch("aiohttp.ClientSession.get", return_value=resp)
-    await init_versions(app)
+        # Unless there is none
+        del app["pypi_version"]
+        await init_versions(app)
+        assert app["new_version"] is False
+        assert app["pypi_version"] == pypi_version
+        assert app["version"] == wdb_server.__version__
+        set_versions(app, wdb_server.__version__)
+    cached = json.loads((cache_dir / "pypi.json").read_text())
+    assert cached["version"] == wdb_server.__version__
+
+
+def test_load_versions(cache_dir):
+    app = web.Application()
+    assert load_versions(app) is None
+    assert app["pypi_version"] is None
     assert app["new_version"] is False
-    assert app["pypi_version"] == "parsing_error"
     assert app["version"] == wdb_server.__version__
 
-    resp = MockResponse(Exception())
-    mocker.patch("aiohttp.ClientSession.get", return_value=resp)
-    await init_versions(app)
+    (cache_dir / "pypi.json").write_text(
+        json.dumps({"version": "future_version", "checked": 42.0})
+    )
+    assert load_versions(app) == 42.0
+    assert app["pypi_version"] == "future_version"
+    assert app["new_version"] == "future_version"
+
+
+async def test_version_check(mocker, monkeypatch, cache_dir):
+    init_versions_mock = mocker.patch("wdb_server.app.init_versions")
+    mocker.patch.object(settings_store, "offline", False)
+    monkeypatch.delenv("WDB_SERVER_OFFLINE", raising=False)
+
+    async def run(app):
+        async for _ in version_check(app):
+            await asyncio.sleep(0)
+
+    # Never checked
+    app = web.Application()
+    await run(app)
+    init_versions_mock.assert_called_once_with(app)
     assert app["new_version"] is False
-    assert app["pypi_version"] == "unknown_error"
-    assert app["version"] == wdb_server.__version__
+
+    # Checked recently
+    init_versions_mock.reset_mock()
+    (cache_dir / "pypi.json").write_text(
+        json.dumps({"version": "future_version", "checked": time.time()})
+    )
+    await run(app)
+    init_versions_mock.assert_not_called()
+    assert app["new_version"] == "future_version"
+
+    # Checked too long ago
+    (cache_dir / "pypi.json").write_text(
+        json.dumps({"version": "future_version", "checked": 42})
+    )
+    await run(app)
+    init_versions_mock.assert_called_once_with(app)
+    assert app["new_version"] == "future_version"
+
+    # Offline
+    init_versions_mock.reset_mock()
+    monkeypatch.setenv("WDB_SERVER_OFFLINE", "1")
+    await run(app)
+    mocker.patch.object(settings_store, "offline", True)
+    monkeypatch.delenv("WDB_SERVER_OFFLINE")
+    await run(app)
+    init_versions_mock.assert_not_called()
 
 
 def test_init_jinja2():
@@ -151,6 +230,24 @@ def test_init_jinja2():
     env = aiohttp_jinja2.get_env(app)
     assert env.globals["themes"] == get_mdl_themes().keys()
     assert env.globals["themes"] == app["themes"].keys()
+    assert app["assets"].root == PROJECT_DIR / "static"
+    # Tests run from a checkout, whose assets are rebuilt
+    assert not app["assets"].packaged
+
+
+async def test_asset(client, tmp_path):
+    client.app["assets"] = Manifest(tmp_path)
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "favicon.ico").write_bytes(b"icon")
+    client.app["assets"].refresh()
+    favicon = hashed_name(
+        "images/favicon.ico", content_hash(tmp_path / "images" / "favicon.ico")
+    )
+    resp = await client.get("/")
+    text = await resp.text()
+    assert f'href="/static/{favicon}"' in text
+    # Missing assets are left as they are
+    assert 'src="/static/javascripts/dist/home.js"' in text
 
 
 async def test_init_app():
@@ -159,8 +256,91 @@ async def test_init_app():
         "extra_search_path": True,
         "more": True,
         "show_filename": True,
+        "process_monitor": "poll",
     }
     app = await init_app(test_setings)
     assert app["settings"] == settings_store
     for key in test_setings:
         assert test_setings[key] == getattr(app["settings"], key)
+
+
+async def test_process_monitor(mocker):
+    monitor = mocker.Mock()
+    mocker.patch("wdb_server.app.start_process_monitor", return_value=monitor)
+    refresher = []
+
+    async def refresh_metrics():
+        refresher.append("started")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            refresher.append("stopped")
+
+    mocker.patch("wdb_server.app.refresh_metrics", refresh_metrics)
+    app = await init_app({"process_monitor": "netlink"})
+    app.freeze()
+    await app.startup()
+    wdb_server.app.start_process_monitor.assert_called_once_with(
+        "netlink",
+        sys.base_prefix if settings_store.extra_search_path else None,
+    )
+    assert app["process_monitor"] is monitor
+    # The table is refreshed in the background until the cleanup
+    await asyncio.sleep(0)
+    assert refresher == ["started"]
+    await app.cleanup()
+    monitor.close.assert_called_once_with()
+    await asyncio.sleep(0)
+    assert refresher == ["started", "stopped"]
+
+
+async def test_precompress_static(mocker):
+    precompress_mock = mocker.patch(
+        "wdb_server.app.precompress", return_value=3
+    )
+    app = web.Application()
+    app["settings"] = settings_store
+    app["assets"] = Manifest(PROJECT_DIR / "static")
+
+    mocker.patch.object(settings_store, "precompress", False)
+    async for _ in precompress_static(app):
+        await asyncio.sleep(0.1)
+    precompress_mock.assert_not_called()
+
+    mocker.patch.object(settings_store, "precompress", True)
+    async for _ in precompress_static(app):
+        await asyncio.sleep(0.1)
+    precompress_mock.assert_called_once_with(PROJECT_DIR / "static")
+
+    # A read-only installation only is logged
+    precompress_mock.side_effect = PermissionError
+    async for _ in precompress_static(app):
+        await asyncio.sleep(0.1)
+
+
+async def test_hash_assets(mocker, tmp_path):
+    mocker.patch("wdb_server.app.ASSETS_REFRESH", 0.01)
+    app = web.Application()
+    app["assets"] = Manifest(tmp_path, packaged=False)
+    refresh = mocker.patch.object(Manifest, "refresh", return_value=1)
+    async for _ in hash_assets(app):
+        await asyncio.sleep(0.1)
+    assert refresh.call_count > 1
+    calls = refresh.call_count
+    await asyncio.sleep(0.05)
+    assert refresh.call_count == calls
+
+    # A failure is retried
+    refresh.reset_mock()
+    refresh.side_effect = PermissionError
+    async for _ in hash_assets(app):
+        await asyncio.sleep(0.1)
+    assert refresh.call_count > 1
+
+    # Packaged
+    refresh.reset_mock()
+    (tmp_path / "manifest.json").write_text("{}")
+    app["assets"] = Manifest(tmp_path)
+    async for _ in hash_assets(app):
+        await asyncio.sleep(0.1)
+    refresh.assert_not_called()
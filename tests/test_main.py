@@ -0,0 +1,25 @@
+# pylint: disable=missing-function-docstring
+# Stdlib:
+import socket
+
+# Thirdparty:
+import pytest
+
+# Firstparty:
+from wdb_server.__main__ import bind_unix_socket
+
+
+def test_bind_unix_socket(tmp_path):
+    path = str(tmp_path / "wdb.sock")
+    options = ((socket.SOL_SOCKET, socket.SO_RCVBUF, 32768),)
+
+    with bind_unix_socket(path, options) as sock:
+        assert sock.family == socket.AF_UNIX
+        assert sock.getsockname() == path
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 32768
+    # A stale socket file is replaced
+    with bind_unix_socket(path) as sock:
+        sock.listen()
+        # A socket still in use is not
+        with pytest.raises(RuntimeError):
+            bind_unix_socket(path)
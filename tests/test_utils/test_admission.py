@@ -0,0 +1,131 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=protected-access
+# Stdlib:
+import asyncio
+from struct import unpack
+
+# Thirdparty:
+import pytest
+
+# Firstparty:
+from wdb_server.utils.admission import Admission, AdmissionError
+from wdb_server.utils.state import settings
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setattr(settings, "max_sessions", 2)
+    monkeypatch.setattr(settings, "accept_rate", 0)
+    monkeypatch.setattr(settings, "admission_queue_size", 2)
+    monkeypatch.setattr(settings, "admission_timeout", 5)
+    return Admission()
+
+
+async def test_max_sessions(admission):
+    admitted = []
+
+    async def session(name):
+        await admission.acquire()
+        admitted.append(name)
+
+    await session(0)
+    await session(1)
+    waiting = [asyncio.create_task(session(name)) for name in (2, 3)]
+    await asyncio.sleep(0)
+    assert admission.active == 2
+    assert admission.waiting == 2
+
+    # Sessions are admitted in order as others end
+    admission.release()
+    await asyncio.wait(waiting[:1])
+    assert admitted == [0, 1, 2]
+    assert admission.waiting == 1
+    admission.release()
+    await asyncio.wait(waiting)
+    assert admitted == [0, 1, 2, 3]
+    assert admission.active == 2
+    assert admission.waiting == 0
+
+
+async def test_queue_full(admission):
+    for _ in range(2):
+        await admission.acquire()
+    waiting = [asyncio.create_task(admission.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionError, match="admission queue full"):
+        await admission.acquire()
+    for task in waiting:
+        task.cancel()
+    await asyncio.wait(waiting)
+    assert admission.waiting == 0
+    assert admission.active == 2
+
+
+async def test_timeout(monkeypatch, admission):
+    monkeypatch.setattr(settings, "admission_timeout", 0.01)
+    for _ in range(2):
+        await admission.acquire()
+
+    with pytest.raises(AdmissionError, match="not admitted within"):
+        await admission.acquire()
+    assert admission.waiting == 0
+    assert admission.active == 2
+
+
+async def test_accept_rate(mocker, monkeypatch, admission):
+    monkeypatch.setattr(settings, "max_sessions", 0)
+    monkeypatch.setattr(settings, "accept_rate", 100)
+    monkeypatch.setattr(settings, "admission_queue_size", 10)
+    clock = mocker.patch("wdb_server.utils.admission.time").monotonic
+    clock.return_value = 0
+
+    # The burst is admitted at once
+    for _ in range(100):
+        await admission.acquire()
+    assert admission.active == 100
+
+    # The next ones at the accept rate
+    waiting = asyncio.create_task(admission.acquire())
+    clock.return_value = 0.005
+    await asyncio.sleep(0.02)
+    assert not waiting.done()
+    assert admission.waiting == 1
+    clock.return_value = 0.015
+    await asyncio.wait_for(waiting, 1)
+    assert admission.active == 101
+    assert admission.waiting == 0
+
+
+async def test_admit(monkeypatch, admission):
+    lost = asyncio.Event()
+    assert await admission.admit(lost.wait)
+    assert await admission.admit(lost.wait)
+    waiting = [
+        asyncio.create_task(admission.admit(lost.wait)) for _ in range(2)
+    ]
+    await asyncio.sleep(0.01)
+    assert admission.waiting == 2
+
+    # A connection lost gives its place in the queue up at once
+    lost.set()
+    assert await asyncio.wait_for(asyncio.gather(*waiting), 1) == [
+        False,
+        False,
+    ]
+    assert admission.waiting == 0
+    assert admission.active == 2
+
+    monkeypatch.setattr(settings, "admission_queue_size", 0)
+    with pytest.raises(AdmissionError, match="admission queue full"):
+        await admission.admit(lost.wait)
+    assert admission.active == 2
+
+
+def test_admission_error_frame():
+    frame = AdmissionError("admission queue full").frame()
+    (length,) = unpack("!i", frame[:4])
+    assert frame[4:].decode("utf-8") == (
+        'Die|{"reason": "wdb server busy: admission queue full"}'
+    )
+    assert length == len(frame) - 4
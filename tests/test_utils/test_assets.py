@@ -0,0 +1,195 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# Stdlib:
+import gzip
+import json
+import os
+
+# Thirdparty:
+import pytest
+
+# Firstparty:
+from wdb_server.utils.assets import (
+    MANIFEST,
+    Manifest,
+    accepted_encodings,
+    build_manifest,
+    content_hash,
+    hashed_name,
+    negotiate,
+    precompress,
+)
+
+CSS = b".mdl-button { color: red; }\n" * 64
+
+
+@pytest.fixture
+def static(tmp_path):
+    (tmp_path / "libs").mkdir()
+    (tmp_path / "libs" / "theme.css").write_bytes(CSS)
+    (tmp_path / "libs" / "tiny.js").write_bytes(b"f()")
+    (tmp_path / "image.png").write_bytes(os.urandom(1024))
+    return tmp_path
+
+
+def test_precompress(static, mocker):
+    mocker.patch("wdb_server.utils.assets.brotli", None)
+    assert precompress(static) == 1
+    variant = static / "libs" / "theme.css.gz"
+    assert gzip.decompress(variant.read_bytes()) == CSS
+    assert (
+        variant.stat().st_mode
+        == (static / "libs" / "theme.css").stat().st_mode
+    )
+    # Too small or binary
+    assert not (static / "libs" / "tiny.js.gz").exists()
+    assert not (static / "image.png.gz").exists()
+
+    # Up to date
+    assert precompress(static) == 0
+
+    # Outdated
+    stat = variant.stat()
+    os.utime(variant, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    (static / "libs" / "theme.css").write_bytes(CSS * 2)
+    assert precompress(static) == 1
+    assert gzip.decompress(variant.read_bytes()) == CSS * 2
+
+
+def test_precompress_incompressible(static, mocker):
+    mocker.patch("wdb_server.utils.assets.brotli", None)
+    (static / "random.js").write_bytes(os.urandom(1024))
+    assert precompress(static) == 1
+    assert not (static / "random.js.gz").exists()
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("") == {""}
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("GZIP;q=0.5, br;q=0") == {"gzip"}
+    assert accepted_encodings("br;q=bad, *") == {"*"}
+
+
+def test_negotiate(static):
+    path = static / "libs" / "theme.css"
+    assert negotiate(path, "gzip, br") == (path, None)
+
+    (static / "libs" / "theme.css.gz").write_bytes(b"gz")
+    assert negotiate(path, "gzip, br") == (
+        static / "libs" / "theme.css.gz",
+        "gzip",
+    )
+    assert negotiate(path, "deflate") == (path, None)
+
+    (static / "libs" / "theme.css.br").write_bytes(b"br")
+    assert negotiate(path, "gzip, br") == (
+        static / "libs" / "theme.css.br",
+        "br",
+    )
+    assert negotiate(path, "gzip, br;q=0") == (
+        static / "libs" / "theme.css.gz",
+        "gzip",
+    )
+    assert negotiate(path, "*") == (static / "libs" / "theme.css.br", "br")
+
+
+def test_hashed_name():
+    assert hashed_name("libs/theme.min.css", "f00") == "libs/theme.min.f00.css"
+    assert hashed_name("favicon.ico", "f00") == "favicon.f00.ico"
+    assert hashed_name("libs/LICENSE", "f00") == "libs/LICENSE.f00"
+    assert hashed_name(".hidden", "f00") == ".hidden.f00"
+
+
+def test_build_manifest(static):
+    precompress(static)
+    manifest = build_manifest(static)
+    assert manifest == {
+        "libs/theme.css": content_hash(static / "libs" / "theme.css"),
+        "libs/tiny.js": content_hash(static / "libs" / "tiny.js"),
+        "image.png": content_hash(static / "image.png"),
+    }
+    assert len(manifest["image.png"]) == 16
+
+
+def test_manifest_packaged(static):
+    (static / MANIFEST).write_text(json.dumps({"libs/theme.css": "f" * 16}))
+    manifest = Manifest(static)
+    assert manifest.packaged
+    assert manifest.refresh() == 0
+    assert manifest.hashed("libs/theme.css") == f"libs/theme.{'f' * 16}.css"
+    assert manifest.resolve(f"libs/theme.{'f' * 16}.css") == (
+        "libs/theme.css",
+        True,
+    )
+    assert manifest.resolve(f"libs/theme.{'0' * 16}.css") == (
+        "libs/theme.css",
+        False,
+    )
+    assert manifest.resolve("libs/theme.css") == ("libs/theme.css", False)
+
+    # Not in the manifest
+    assert manifest.hashed("libs/tiny.js") == "libs/tiny.js"
+    assert manifest.hashed("missing.css") == "missing.css"
+    assert manifest.resolve(f"missing.{'f' * 16}.css") == (
+        "missing.css",
+        False,
+    )
+
+    # Assets named like hashed ones
+    (static / f"real.{'f' * 16}.css").write_bytes(CSS)
+    assert manifest.resolve(f"real.{'f' * 16}.css") == (
+        f"real.{'f' * 16}.css",
+        False,
+    )
+
+
+def test_manifest_checkout(static, mocker):
+    # Outdated manifest, left from an earlier build
+    (static / MANIFEST).write_text(json.dumps({"libs/tiny.js": "f" * 16}))
+    manifest = Manifest(static, packaged=False)
+    assert not manifest.packaged
+    # Not hashed yet
+    assert manifest.hashed("libs/tiny.js") == "libs/tiny.js"
+    assert manifest.resolve(f"libs/tiny.{'f' * 16}.js") == (
+        "libs/tiny.js",
+        False,
+    )
+
+    assert manifest.refresh() == 3
+    tiny = hashed_name(
+        "libs/tiny.js", content_hash(static / "libs" / "tiny.js")
+    )
+    assert manifest.hashed("libs/tiny.js") == tiny
+    assert manifest.resolve(tiny) == ("libs/tiny.js", True)
+
+    # Only hashed when requests are served
+    content_hash_mock = mocker.patch(
+        "wdb_server.utils.assets.content_hash", side_effect=content_hash
+    )
+    assert manifest.hashed("libs/tiny.js") == tiny
+    assert manifest.resolve(tiny) == ("libs/tiny.js", True)
+    content_hash_mock.assert_not_called()
+
+    # Rebuilt, not refreshed yet
+    (static / "libs" / "tiny.js").write_bytes(b"g()")
+    assert manifest.hashed("libs/tiny.js") == tiny
+    assert manifest.resolve(tiny) == ("libs/tiny.js", False)
+
+    # Only the rebuilt asset is hashed again
+    assert manifest.refresh() == 1
+    content_hash_mock.assert_called_once_with(static / "libs" / "tiny.js")
+    assert manifest.hashed("libs/tiny.js") != tiny
+    assert manifest.resolve(tiny) == ("libs/tiny.js", False)
+
+    (static / "image.png").unlink()
+    assert manifest.refresh() == 0
+    assert manifest.hashed("image.png") == "image.png"
+
+
+def test_manifest_corrupted(static):
+    (static / MANIFEST).write_text("[")
+    manifest = Manifest(static)
+    assert not manifest.packaged
+    manifest.refresh()
+    assert manifest.hashed("image.png") == hashed_name(
+        "image.png", content_hash(static / "image.png")
+    )
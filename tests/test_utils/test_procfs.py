@@ -0,0 +1,194 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=protected-access
+# Stdlib:
+import asyncio
+import errno
+import os
+import pwd
+import sys
+
+# Thirdparty:
+import psutil
+import pytest
+
+# Firstparty:
+from wdb_server.utils.procfs import (
+    CN_IDX_PROC,
+    CN_MSG,
+    CN_VAL_PROC,
+    NLMSG_DONE,
+    NLMSGHDR,
+    PROC_EVENT,
+    PROC_EVENT_EXEC,
+    PROC_EVENT_EXIT,
+    PROC_EVENT_FORK,
+    ProcConnector,
+    ProcfsScanner,
+    parse_proc_events,
+)
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+UID = os.getuid()
+
+
+def make_process(root, pid, cmdline, state="S", cpu=0, uid=UID):
+    path = root / str(pid)
+    path.mkdir()
+    (path / "cmdline").write_bytes(b"\0".join(cmdline) + b"\0")
+    # Fields after the command name: state ... utime stime ... num_threads
+    # ... starttime ... rss
+    stat = [state] + ["0"] * 49
+    stat[11], stat[12] = str(cpu), "0"
+    stat[17], stat[19], stat[21] = "3", str(100 * CLOCK_TICKS), "1024"
+    (path / "stat").write_text(f"{pid} (a (b) c) " + " ".join(stat))
+    (path / "status").write_text(f"Name:\tx\nUid:\t{uid}\t{uid}\t0\t0\n")
+
+
+@pytest.fixture()
+def procfs(tmp_path):
+    (tmp_path / "stat").write_text("cpu  1 2 3\nbtime 1000\n")
+    (tmp_path / "meminfo").write_text(f"MemTotal: {4096 * PAGE_SIZE} kB\n")
+    (tmp_path / "self").mkdir()
+    make_process(tmp_path, 1, [b"/sbin/init"])
+    make_process(tmp_path, 2, [b""])
+    make_process(tmp_path, 3, [b"/usr/bin/python3.9", b"app.py"])
+    make_process(tmp_path, 4, [b"pypy", b"-m", b"app"], uid=2**31)
+    make_process(tmp_path, 5, [b"/usr/bin/python3"], state="Z")
+    (tmp_path / "6").mkdir()
+    return tmp_path
+
+
+def test_scan(procfs, mocker):
+    scanner = ProcfsScanner(str(procfs))
+    processes = sorted(scanner.scan(), key=lambda process: process["pid"])
+    assert processes == [
+        {
+            "pid": 3,
+            "user": pwd.getpwuid(UID).pw_name,
+            "cmd": "/usr/bin/python3.9 app.py",
+            "threads": 3,
+            "time": 1100.0,
+            "mem": 1024 / 4096 / 1024 * 100,
+            "cpu": 0.0,
+        },
+        {
+            "pid": 4,
+            "user": str(2**31),
+            "cmd": "pypy -m app",
+            "threads": 3,
+            "time": 1100.0,
+            "mem": 1024 / 4096 / 1024 * 100,
+            "cpu": 0.0,
+        },
+    ]
+
+    # Usage since the previous scan
+    monotonic = mocker.patch("time.monotonic", return_value=1000)
+    scanner.scan()
+    (procfs / "3").rename(procfs / "gone")
+    make_process(procfs, 3, [b"python"], cpu=CLOCK_TICKS // 2)
+    monotonic.return_value = 1001
+    processes = sorted(scanner.scan(), key=lambda process: process["pid"])
+    assert [process["cpu"] for process in processes] == [50.0, 0.0]
+
+
+def test_scan_skips_unreadable_processes(procfs, mocker):
+    scanner = ProcfsScanner(str(procfs))
+    mocker.patch("pwd.getpwuid", side_effect=KeyError)
+    (procfs / "3" / "status").unlink()
+    assert [process["pid"] for process in scanner.scan()] == [4]
+
+
+@pytest.mark.skipif(
+    not ProcfsScanner.available(), reason="Needs a linux /proc"
+)
+def test_scan_matches_psutil():
+    (process,) = [
+        process
+        for process in ProcfsScanner().scan()
+        if process["pid"] == os.getpid()
+    ]
+    proc = psutil.Process()
+    assert process["user"] == proc.username()
+    assert process["cmd"] == " ".join(proc.cmdline())
+    assert process["time"] == pytest.approx(proc.create_time(), abs=1)
+    assert process["mem"] == pytest.approx(proc.memory_percent(), rel=0.5)
+
+
+def test_scan_pids(procfs):
+    scanner = ProcfsScanner(str(procfs))
+    scanner.scan()
+    assert [process["pid"] for process in scanner.scan([1, 4, 42])] == [4]
+    # Samples of the processes which were not scanned are kept
+    assert len(scanner._samples) == 2
+
+
+def proc_event(what, *pids):
+    event = PROC_EVENT.pack(what, 0, 0) + b"".join(
+        pid.to_bytes(4, sys.byteorder) for pid in pids
+    )
+    message = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(event), 0)
+    message += event
+    # Padded to the netlink alignment
+    return (
+        NLMSGHDR.pack(NLMSGHDR.size + len(message), NLMSG_DONE, 0, 0, 0)
+        + message
+        + b"\0" * (-len(message) % 4)
+    )
+
+
+def test_parse_proc_events():
+    data = b"".join(
+        [
+            proc_event(0, 0),
+            proc_event(PROC_EVENT_FORK, 1, 1, 10, 10),
+            proc_event(PROC_EVENT_FORK, 10, 10, 11, 10),
+            proc_event(PROC_EVENT_EXEC, 10, 10),
+            proc_event(PROC_EVENT_EXIT, 11, 10, 0, 0, 1, 1),
+            proc_event(PROC_EVENT_EXIT, 10, 10, 0, 0, 1, 1),
+        ]
+    )
+    assert list(parse_proc_events(data)) == [
+        (10, True),
+        (10, True),
+        (10, False),
+    ]
+    assert not list(parse_proc_events(b"\0" * 8))
+
+
+async def test_proc_connector():
+    events = []
+    try:
+        connector = ProcConnector(
+            lambda *event: events.append(event), lambda: None
+        )
+    except OSError:
+        pytest.skip("Needs CAP_NET_ADMIN")
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "")
+    await process.wait()
+    for _ in range(100):
+        if (process.pid, False) in events:
+            break
+        await asyncio.sleep(0.01)
+    connector.close()
+    assert (process.pid, True) in events
+    assert (process.pid, False) in events
+
+
+def test_proc_connector_overrun(mocker):
+    events = []
+    overrun = mocker.Mock()
+    connector = ProcConnector.__new__(ProcConnector)
+    connector._callback = lambda *event: events.append(event)
+    connector._overrun = overrun
+    connector._socket = mocker.Mock()
+    connector._socket.recv.side_effect = [
+        OSError(errno.ENOBUFS, "No buffer space available"),
+        proc_event(PROC_EVENT_EXEC, 10, 10),
+        BlockingIOError,
+    ]
+    connector._read()
+    # Lost events are recovered by a rescan, later events still received
+    overrun.assert_called_once_with()
+    assert events == [(10, True)]
@@ -0,0 +1,245 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=protected-access,no-member,missing-class-docstring
+# Stdlib:
+import asyncio
+import zlib
+from struct import pack
+
+# Thirdparty:
+import pytest
+from mock import call
+
+# Firstparty:
+from wdb_server.constants import COMPRESSED_FLAG
+from wdb_server.utils import streams
+from wdb_server.utils.admission import Admission, AdmissionError
+from wdb_server.utils.protocol import WDBProtocol
+from wdb_server.utils.state import settings
+from wdb_server.utils.streams import IOStream
+
+TEST_UUID = "a8d1b5a6-5b7a-4f5e-9c1d-2b3f4a5b6c7d"
+
+
+def make_frame(data: bytes) -> bytes:
+    return pack("!i", len(data)) + data
+
+
+@pytest.fixture
+def frames(mocker):
+    received = []
+
+    async def read_frame(_stream, uuid, frame):
+        assert isinstance(frame, memoryview)
+        received.append((uuid, bytes(frame)))
+
+    mocker.patch("wdb_server.utils.protocol.assign_stream")
+    mocker.patch("wdb_server.utils.protocol.read_frame", read_frame)
+    mocker.patch("wdb_server.utils.streams.IOStream.close")
+    return received
+
+
+async def serve(buffer_size, payload):
+    loop = asyncio.get_running_loop()
+    protocols = []
+
+    def factory():
+        protocols.append(WDBProtocol(buffer_size))
+        return protocols[-1]
+
+    server = await loop.create_server(factory, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(payload)
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+    await asyncio.wait([protocols[0]._task], timeout=5)
+    server.close()
+    await server.wait_closed()
+    return protocols[0]
+
+
+async def test_frames(frames):
+    data = [b"PING", "Dump|é".encode("utf-8"), b"x" * 100, b"", b"end"]
+    payload = make_frame(TEST_UUID.encode("utf-8"))
+    payload += b"".join(make_frame(frame) for frame in data)
+
+    protocol = await serve(16, payload)
+    assert frames == [(TEST_UUID, frame) for frame in data]
+    # The buffer grown for the 100 bytes frame is released afterwards
+    assert len(protocol._buffer) == 16
+
+
+async def test_many_frames(frames):
+    count = 10_000
+    payload = make_frame(TEST_UUID.encode("utf-8"))
+    payload += b"".join(make_frame(b"%d" % i) for i in range(count))
+
+    await serve(4096, payload)
+    assert frames == [(TEST_UUID, b"%d" % i) for i in range(count)]
+
+
+async def test_wrong_uuid(frames):
+    payload = make_frame(b"bad_uuid") + make_frame(b"PING")
+
+    protocol = await serve(16, payload)
+    assert protocol._task.exception() is None
+    IOStream.close.assert_awaited_once()
+    assert frames == []
+
+
+async def test_invalid_length(frames):
+    payload = make_frame(TEST_UUID.encode("utf-8")) + make_frame(b"PING")
+    payload += pack("!i", -1) + make_frame(b"ignored")
+
+    protocol = await serve(16, payload)
+    assert protocol._task.exception() is None
+    IOStream.close.assert_awaited_once()
+    assert frames == [(TEST_UUID, b"PING")]
+
+
+async def test_invalid_length_received(mocker):
+    transport = mocker.Mock()
+    protocol = WDBProtocol(16)
+    protocol.connection_made(transport)
+    transport.pause_reading.reset_mock()
+    protocol.get_buffer(-1)[:4] = pack("!i", -1)
+
+    # Handled, rather than left to the fatal error path of the transport
+    protocol.buffer_updated(4)
+    transport.close.assert_called_once_with()
+    transport.pause_reading.assert_not_called()
+    assert (protocol._start, protocol._end) == (0, 0)
+    protocol._task.cancel()
+
+
+async def test_oversized_uuid_received(mocker):
+    transport = mocker.Mock()
+    protocol = WDBProtocol(16)
+    protocol.connection_made(transport)
+    protocol.get_buffer(-1)[:4] = pack("!i", 0x3FFFFFFF)
+
+    # Refused from its header, before anything is buffered for it
+    protocol.buffer_updated(4)
+    transport.close.assert_called_once_with()
+    assert len(protocol._buffer) == 16
+    protocol._task.cancel()
+
+
+async def test_grow_limit(mocker, monkeypatch):
+    monkeypatch.setattr(settings, "stream_threshold", 100)
+    protocol = WDBProtocol(64)
+    protocol.connection_made(mocker.Mock())
+    protocol._uuid = TEST_UUID
+    protocol.get_buffer(-1)[:4] = pack("!i", 1000)
+    protocol.buffer_updated(64)
+
+    # Relayed, never buffered whole
+    protocol._grow()
+    assert len(protocol._buffer) == 104
+    protocol._task.cancel()
+
+
+async def test_rejected(mocker, frames):
+    error = AdmissionError("admission queue full")
+    mocker.patch(
+        "wdb_server.utils.admission.Admission.admit", side_effect=error
+    )
+    release = mocker.patch("wdb_server.utils.admission.Admission.release")
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: WDBProtocol(16), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(make_frame(TEST_UUID.encode("utf-8")))
+
+    # Told why before being disconnected
+    assert await asyncio.wait_for(reader.read(), 5) == error.frame()
+    writer.close()
+    await writer.wait_closed()
+    server.close()
+    await server.wait_closed()
+    assert frames == []
+    release.assert_not_called()
+
+
+async def test_lost_waiting(mocker, monkeypatch, frames):
+    monkeypatch.setattr(settings, "max_sessions", 1)
+    monkeypatch.setattr(settings, "admission_timeout", 30)
+    admission = mocker.patch(
+        "wdb_server.utils.protocol.admission", Admission()
+    )
+    await admission.acquire()
+    payload = make_frame(TEST_UUID.encode("utf-8")) + make_frame(b"PING")
+
+    # Its place in the queue is given up as soon as the peer leaves
+    protocol = await serve(4096, payload)
+    assert protocol._task.done()
+    assert admission.waiting == 0
+    assert admission.active == 1
+    assert frames == []
+    IOStream.close.assert_not_awaited()
+
+
+async def test_large_frames(mocker, monkeypatch, frames):
+    send = mocker.patch("wdb_server.utils.state.WebSockets.send")
+    monkeypatch.setattr(settings, "stream_threshold", 32)
+    monkeypatch.setattr(settings, "max_frame_size", 1000)
+    large = ("Dump|" + "é" * 100).encode("utf-8")
+    payload = make_frame(TEST_UUID.encode("utf-8"))
+    payload += make_frame(large) + make_frame(b"x" * 1001)
+    payload += make_frame(b"end")
+
+    protocol = await serve(64, payload)
+    assert frames == [(TEST_UUID, b"end")]
+    chunks = [c.args[1] for c in send.mock_calls[:-2]]
+    assert all(chunk.startswith("Chunk|") for chunk in chunks)
+    assert "".join(chunk[6:] for chunk in chunks) == large.decode("utf-8")
+    assert send.mock_calls[-2] == call(TEST_UUID, "ChunkEnd")
+    assert send.mock_calls[-1].args[1] == "Echo"
+    # Large frames never grow the buffer
+    assert len(protocol._buffer) == 64
+
+
+async def test_compressed_frames(mocker, monkeypatch):
+    received = []
+
+    async def read_frame(stream, uuid, frame):
+        if frame == b"ENABLE_COMPRESSION|zlib":
+            stream.compression = True
+        received.append((uuid, bytes(frame)))
+
+    mocker.patch("wdb_server.utils.protocol.assign_stream")
+    mocker.patch("wdb_server.utils.protocol.read_frame", read_frame)
+    mocker.patch("wdb_server.utils.streams.IOStream.close")
+    send = mocker.patch("wdb_server.utils.state.WebSockets.send")
+    monkeypatch.setattr(settings, "stream_threshold", 32)
+    monkeypatch.setattr(streams, "STREAM_CHUNK_SIZE", 16)
+    dump = ("Dump|" + "é" * 10).encode("utf-8")
+    large = ("Dump|" + "".join(map(str, range(100)))).encode("utf-8")
+    # Small on the wire, but over the stream threshold once inflated
+    inflating = ("Dump|" + "é" * 500).encode("utf-8")
+    payload = make_frame(TEST_UUID.encode("utf-8"))
+    payload += make_frame(b"ENABLE_COMPRESSION|zlib")
+    for frame in (dump, large, inflating):
+        frame = zlib.compress(frame)
+        payload += pack("!i", len(frame) | COMPRESSED_FLAG) + frame
+    payload += make_frame(b"end")
+
+    protocol = await serve(64, payload)
+    assert [frame for _, frame in received] == [
+        b"ENABLE_COMPRESSION|zlib",
+        dump,
+        b"end",
+    ]
+    messages = [c.args[1] for c in send.mock_calls]
+    end = messages.index("ChunkEnd")
+    for relayed, chunks in (
+        (large, messages[:end]),
+        (inflating, messages[end + 1 : -1]),
+    ):
+        assert all(len(chunk[6:].encode("utf-8")) <= 16 for chunk in chunks)
+        assert "".join(chunk[6:] for chunk in chunks) == relayed.decode(
+            "utf-8"
+        )
+    assert messages[-1] == "ChunkEnd"
+    assert len(protocol._buffer) == 64
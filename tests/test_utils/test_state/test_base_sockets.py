@@ -1,6 +1,7 @@
 # pylint: disable=missing-function-docstring,redefined-outer-name
 # pylint: disable=protected-access,no-member
 # Stdlib:
+import asyncio
 import json
 
 # Thirdparty:
@@ -9,7 +10,7 @@ from mock import call
 
 # Firstparty:
 from conftest import DummySocket
-from wdb_server.utils.state import BaseSockets, SyncWebSockets
+from wdb_server.utils.state import BaseSockets, Message, StatusBus, settings
 
 
 @pytest.fixture
@@ -27,12 +28,15 @@ async def test_send(mocker, dummy_socket, base_sockets):
     BaseSockets._send.assert_not_called()
 
     await base_sockets.send("dummy_socket", data)
-    BaseSockets._send.assert_called_once_with(dummy_socket, data)
+    BaseSockets._send.assert_called_once_with(dummy_socket, Message(data))
 
     BaseSockets._send.reset_mock()
     await base_sockets.send("dummy_socket", data, message)
     BaseSockets._send.assert_called_once_with(
-        dummy_socket, f"{data}|{json.dumps(message)}"
+        dummy_socket, Message(data, message)
+    )
+    assert BaseSockets._send.call_args.args[1].text == (
+        f"{data}|{json.dumps(message)}"
     )
 
 
@@ -53,15 +57,15 @@ async def test_add(mocker, dummy_socket, base_sockets):
 
 
 async def test_remove(mocker, dummy_socket, base_sockets):
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
     assert "dummy_socket" not in base_sockets._sockets
     await base_sockets.remove("dummy_socket")
-    SyncWebSockets.broadcast.assert_not_called()
+    StatusBus.publish.assert_not_called()
 
     base_sockets._sockets = {"dummy_socket": dummy_socket}
     assert "dummy_socket" in base_sockets._sockets
     await base_sockets.remove("dummy_socket")
-    SyncWebSockets.broadcast.assert_called_once_with(
+    StatusBus.publish.assert_called_once_with(
         "RemoveBaseSocket", "dummy_socket"
     )
 
@@ -106,7 +110,9 @@ async def test_broadcast(mocker, dummy_socket, base_sockets):
     cmd = "cmd"
     message = "message"
     await base_sockets.broadcast(cmd, message)
-    BaseSockets.send.assert_called_once_with("dummy_socket", cmd, message)
+    BaseSockets.send.assert_called_once_with(
+        "dummy_socket", Message(cmd, message)
+    )
     BaseSockets.close.assert_not_called()
     BaseSockets.remove.assert_not_called()
 
@@ -118,8 +124,8 @@ async def test_broadcast(mocker, dummy_socket, base_sockets):
     await base_sockets.broadcast(cmd, message)
     assert BaseSockets.send.call_count == 2
     assert BaseSockets.send.mock_calls == [
-        call("dummy_socket", cmd, message),
-        call("another_dummy_socket", cmd, message),
+        call("dummy_socket", Message(cmd, message)),
+        call("another_dummy_socket", Message(cmd, message)),
     ]
     BaseSockets.close.assert_not_called()
     BaseSockets.remove.assert_not_called()
@@ -129,8 +135,38 @@ async def test_broadcast(mocker, dummy_socket, base_sockets):
     await base_sockets.broadcast(cmd, message)
     assert BaseSockets.send.call_count == 2
     assert BaseSockets.send.mock_calls == [
-        call("dummy_socket", cmd, message),
-        call("another_dummy_socket", cmd, message),
+        call("dummy_socket", Message(cmd, message)),
+        call("another_dummy_socket", Message(cmd, message)),
     ]
     BaseSockets.close.assert_called_once_with("another_dummy_socket")
     BaseSockets.remove.assert_called_once_with("another_dummy_socket")
+
+
+async def test_broadcast_concurrent(mocker, monkeypatch, base_sockets):
+    monkeypatch.setattr(settings, "broadcast_concurrency", 2)
+    monkeypatch.setattr(settings, "broadcast_timeout", 0.2)
+    mocker.patch("wdb_server.utils.state.BaseSockets.close")
+    mocker.patch("wdb_server.utils.state.BaseSockets.remove")
+    running = 0
+    concurrency = 0
+
+    async def send(uuid, _message):
+        nonlocal running, concurrency
+        running += 1
+        concurrency = max(concurrency, running)
+        await asyncio.sleep(1 if uuid == "slow" else 0.05)
+        running -= 1
+
+    mocker.patch("wdb_server.utils.state.BaseSockets.send", side_effect=send)
+    base_sockets._sockets = {
+        uuid: DummySocket() for uuid in ("slow", "fast1", "fast2", "fast3")
+    }
+
+    elapsed = await base_sockets.broadcast("cmd")
+    # The slow socket holds one slot until it times out, the fast ones
+    # go through the other
+    assert concurrency == 2
+    assert 0.15 <= elapsed < 0.5
+    assert BaseSockets.send.call_count == 4
+    BaseSockets.close.assert_called_once_with("slow")
+    BaseSockets.remove.assert_called_once_with("slow")
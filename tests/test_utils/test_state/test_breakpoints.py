@@ -1,10 +1,14 @@
 # pylint: disable=missing-function-docstring,redefined-outer-name
 # pylint: disable=protected-access,no-member, missing-class-docstring
+# Stdlib:
+import json
+
 # Thirdparty:
 import pytest
 
 # Firstparty:
-from wdb_server.utils.state import Breakpoints, SyncWebSockets
+from wdb_server.utils import state
+from wdb_server.utils.state import Breakpoints, StatusBus, breakpoint_key
 
 
 @pytest.fixture
@@ -13,51 +17,122 @@ def breakpoints():
 
 
 async def test_add(mocker, breakpoints):
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
     dummy_breakpoint = "dummy_breakpoint"
-    assert breakpoints._breakpoints == []
+    assert breakpoints.get() == []
     await breakpoints.add(dummy_breakpoint)
-    assert breakpoints._breakpoints == [dummy_breakpoint]
+    assert breakpoints.get() == [dummy_breakpoint]
 
-    SyncWebSockets.broadcast.assert_called_once_with(
-        f'AddBreak|"{dummy_breakpoint}"'
-    )
+    StatusBus.publish.assert_called_once_with("AddBreak", dummy_breakpoint)
 
-    assert breakpoints._breakpoints == [dummy_breakpoint]
+    assert breakpoints.get() == [dummy_breakpoint]
     await breakpoints.add(dummy_breakpoint)
-    assert breakpoints._breakpoints == [dummy_breakpoint]
+    assert breakpoints.get() == [dummy_breakpoint]
 
 
 async def test_remove(mocker, breakpoints):
     dummy_breakpoint = "dummy_breakpoint"
     await breakpoints.add(dummy_breakpoint)
-    assert breakpoints._breakpoints == [dummy_breakpoint]
+    assert breakpoints.get() == [dummy_breakpoint]
 
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
 
     await breakpoints.remove(dummy_breakpoint)
-    assert breakpoints._breakpoints == []
+    assert breakpoints.get() == []
 
-    SyncWebSockets.broadcast.assert_called_once_with(
-        f'RemoveBreak|"{dummy_breakpoint}"'
-    )
+    StatusBus.publish.assert_called_once_with("RemoveBreak", dummy_breakpoint)
 
-    SyncWebSockets.broadcast.reset_mock()
+    StatusBus.publish.reset_mock()
     await breakpoints.remove(dummy_breakpoint)
-    assert breakpoints._breakpoints == []
-    SyncWebSockets.broadcast.assert_not_called()
+    assert breakpoints.get() == []
+    StatusBus.publish.assert_not_called()
 
 
 async def test_get(breakpoints):
     await breakpoints.add("dummy_breakpoint1")
     await breakpoints.add("dummy_breakpoint2")
-    assert breakpoints._breakpoints == [
-        "dummy_breakpoint1",
-        "dummy_breakpoint2",
-    ]
+    assert breakpoints.get() == ["dummy_breakpoint1", "dummy_breakpoint2"]
+
 
-    assert (
-        breakpoints.get()
-        == ["dummy_breakpoint1", "dummy_breakpoint2"]
-        == breakpoints._breakpoints
+def test_breakpoint_key():
+    brk = {"fn": "/a.py", "lno": 3, "cond": None, "fun": None}
+    assert breakpoint_key(brk) == ("/a.py", 3, None, None)
+    # Only the identity fields count, whatever their order
+    assert breakpoint_key(brk | {"temporary": False}) == breakpoint_key(
+        dict(reversed(brk.items()))
     )
+    assert breakpoint_key(brk | {"lno": 4}) != breakpoint_key(brk)
+    assert breakpoint_key({"b": 1, "a": 2}) == breakpoint_key({"a": 2, "b": 1})
+    assert breakpoint_key("dummy_breakpoint") == '"dummy_breakpoint"'
+
+
+async def test_get_file(breakpoints):
+    brks = [
+        {"fn": fn, "lno": lno, "cond": None, "fun": None}
+        for fn in ("/a.py", "/b.py")
+        for lno in range(1000)
+    ]
+    for brk in brks:
+        await breakpoints.add(brk)
+    await breakpoints.add(brks[0] | {"temporary": False})
+    assert breakpoints.get() == brks
+    assert breakpoints.get_file("/a.py") == brks[:1000]
+    assert breakpoints.get_file("/c.py") == []
+
+    for brk in brks[1000:]:
+        await breakpoints.remove(brk)
+    await breakpoints.remove(brks[0] | {"temporary": False})
+    assert breakpoints.get() == brks[1:1000]
+    assert breakpoints.get_file("/a.py") == brks[1:1000]
+    assert breakpoints.get_file("/b.py") == []
+    assert "/b.py" not in breakpoints._files
+
+
+async def test_encoded(mocker, breakpoints):
+    dumps = mocker.spy(json, "dumps")
+    version = breakpoints.version
+    await breakpoints.add("dummy_breakpoint")
+    assert breakpoints.version == version + 1
+
+    dumps.reset_mock()
+    assert breakpoints.encoded().text == '["dummy_breakpoint"]'
+    assert breakpoints.encoded().text == '["dummy_breakpoint"]'
+    dumps.assert_called_once()
+
+    await breakpoints.remove("dummy_breakpoint")
+    assert breakpoints.version == version + 2
+    assert breakpoints.encoded().text == "[]"
+
+
+async def test_encoded_since(monkeypatch, breakpoints):
+    monkeypatch.setattr(state, "BREAKPOINTS_HISTORY", 4)
+    brks = [
+        {"fn": "/a.py", "lno": lno, "cond": None, "fun": None}
+        for lno in range(4)
+    ]
+    start = breakpoints.version
+    for brk in brks:
+        await breakpoints.add(brk)
+    await breakpoints.remove(brks[0])
+    version = breakpoints.version
+    assert version == start + 5
+
+    assert json.loads(breakpoints.encoded_since(start + 2).text) == {
+        "version": version,
+        "since": start + 2,
+        "added": brks[2:],
+        "removed": [brks[0]],
+    }
+    assert json.loads(breakpoints.encoded_since(version).text) == {
+        "version": version,
+        "since": version,
+        "added": [],
+        "removed": [],
+    }
+    # Changes older than the history, or versions of another server,
+    # are answered with all the breakpoints
+    for since in (start, start - 1000, version + 1, -1):
+        assert json.loads(breakpoints.encoded_since(since).text) == {
+            "version": version,
+            "breakpoints": brks[1:],
+        }
@@ -0,0 +1,52 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=protected-access,no-member
+# Stdlib:
+import json
+import zlib
+from struct import pack
+
+# Firstparty:
+from conftest import DummySocket
+from wdb_server.constants import COMPRESSED_FLAG
+from wdb_server.utils.state import Message, Sockets, settings
+
+
+def test_text():
+    assert Message("Die").text == "Die"
+    assert Message("Echo", {"for": "é"}).text == 'Echo|{"for": "\\u00e9"}'
+    assert Message("Echo", {}).text == "Echo"
+    assert Message("Echo", {"a": 1}) == Message('Echo|{"a": 1}')
+    assert Message("Echo", {"a": 1}) != Message("Echo", {"a": 2})
+
+
+def test_frame(monkeypatch):
+    monkeypatch.setattr(settings, "compression_threshold", 16)
+    message = Message("File|" + "é" * 100)
+    frame = message.frame()
+    assert frame == pack("!i", 205) + message.text.encode("utf-8")
+    assert message.frame() is frame
+
+    compressed = message.frame(compression=True)
+    assert message.frame(compression=True) is compressed
+    header = int.from_bytes(compressed[:4], "big")
+    assert header == (len(compressed) - 4) | COMPRESSED_FLAG
+    assert zlib.decompress(compressed[4:]) == frame[4:]
+    # Small messages are not compressed
+    small = Message("PING")
+    assert small.frame(compression=True) is small.frame()
+
+
+async def test_broadcast_encodes_once(mocker):
+    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    write = mocker.patch.object(DummySocket, "write")
+    dumps = mocker.spy(json, "dumps")
+    sockets = Sockets()
+    for i in range(100):
+        await sockets.add(f"socket{i}", DummySocket())
+
+    dumps.reset_mock()
+    await sockets.broadcast("Echo", {"for": "all"})
+    dumps.assert_called_once()
+    assert write.call_count == 100
+    frames = {id(c.args[0]) for c in write.mock_calls}
+    assert len(frames) == 1
@@ -1,12 +1,17 @@
 # pylint: disable=missing-function-docstring,redefined-outer-name
 # pylint: disable=protected-access,no-member
+# Stdlib:
+import zlib
+from struct import pack, unpack
+
 # Thirdparty:
 import pytest
 from mock import call
 
 # Firstparty:
 from conftest import DummySocket
-from wdb_server.utils.state import Sockets, SyncWebSockets, settings
+from wdb_server.constants import COMPRESSED_FLAG
+from wdb_server.utils.state import Sockets, StatusBus, settings
 
 
 @pytest.fixture
@@ -15,12 +20,12 @@ def sockets():
 
 
 async def test_add(mocker, dummy_socket, sockets):
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
 
     assert "dummy_socket" not in sockets._sockets
     await sockets.add("dummy_socket", dummy_socket)
     assert sockets._sockets == {"dummy_socket": dummy_socket}
-    SyncWebSockets.broadcast.assert_called_once_with(
+    StatusBus.publish.assert_called_once_with(
         "AddSocket", {"uuid": "dummy_socket"}
     )
 
@@ -51,25 +56,25 @@ def test_get_filename(sockets):
 
 
 async def test_set_filename(mocker, sockets):
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
     assert "dummy_socket" not in sockets._filenames
 
     assert settings.show_filename
     await sockets.set_filename("dummy_socket", "dummy_socket.file")
     assert "dummy_socket" in sockets._filenames
     assert sockets._filenames == {"dummy_socket": "dummy_socket.file"}
-    SyncWebSockets.broadcast.assert_called_once_with(
+    StatusBus.publish.assert_called_once_with(
         "AddSocket", {"filename": "dummy_socket.file", "uuid": "dummy_socket"}
     )
 
     settings.show_filename = False
     assert not settings.show_filename
-    SyncWebSockets.broadcast.reset_mock()
+    StatusBus.publish.reset_mock()
     sockets._filenames = {}
     await sockets.set_filename("dummy_socket", "dummy_socket.file")
     assert "dummy_socket" in sockets._filenames
     assert sockets._filenames == {"dummy_socket": "dummy_socket.file"}
-    SyncWebSockets.broadcast.assert_called_once_with(
+    StatusBus.publish.assert_called_once_with(
         "AddSocket", {"filename": "", "uuid": "dummy_socket"}
     )
 
@@ -81,13 +86,40 @@ async def test_send(mocker, dummy_socket, sockets):
     message = "message"
     await sockets.send("dummy_socket", data)
     assert DummySocket.write.mock_calls == [
-        call(b"\x00\x00\x00\x04"),
-        call(data.encode("utf-8")),
+        call(b"\x00\x00\x00\x04" + data.encode("utf-8")),
     ]
 
     DummySocket.write.reset_mock()
     await sockets.send("dummy_socket", data, message)
     assert DummySocket.write.mock_calls == [
-        call(b"\x00\x00\x00\x0e"),
-        call(f'{data}|"{message}"'.encode("utf-8")),
+        call(b"\x00\x00\x00\x0e" + f'{data}|"{message}"'.encode("utf-8")),
+    ]
+
+    # The header holds the length in bytes, not in characters
+    DummySocket.write.reset_mock()
+    await sockets.send("dummy_socket", "é")
+    assert DummySocket.write.mock_calls == [
+        call(b"\x00\x00\x00\x02" + "é".encode("utf-8")),
     ]
+
+
+async def test_send_compressed(mocker, monkeypatch, dummy_socket, sockets):
+    mocker.patch.object(DummySocket, "write")
+    monkeypatch.setattr(settings, "compression_threshold", 16)
+    monkeypatch.setattr(dummy_socket, "compression", True, raising=False)
+    await sockets.add("dummy_socket", dummy_socket)
+    data = "File|" + "x" * 100
+
+    await sockets.send("dummy_socket", data)
+    ((frame,), _) = DummySocket.write.call_args
+    (header,) = unpack("!i", frame[:4])
+    assert header & COMPRESSED_FLAG
+    assert header & ~COMPRESSED_FLAG == len(frame) - 4
+    assert zlib.decompress(frame[4:]) == data.encode("utf-8")
+
+    # Short or incompressible data is sent as is
+    for data in ("File|short", "File|abcdefghijklmnopqrst"):
+        await sockets.send("dummy_socket", data)
+        assert DummySocket.write.call_args == call(
+            pack("!i", len(data)) + data.encode("utf-8")
+        )
@@ -0,0 +1,136 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=protected-access,no-member
+# Stdlib:
+import asyncio
+import json
+
+# Thirdparty:
+import pytest
+from mock import call
+
+# Firstparty:
+from conftest import DummySocket
+from wdb_server.utils.state import (
+    StatusBus,
+    SyncWebSockets,
+    breakpoints,
+    settings,
+    sockets,
+    websockets,
+)
+
+BREAK = {"fn": "/a.py", "lno": 1, "cond": None, "fun": None}
+
+
+@pytest.fixture
+def status_bus(mocker, monkeypatch):
+    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    monkeypatch.setattr(settings, "status_window", 0.01)
+    return StatusBus()
+
+
+async def flush(status_bus):
+    await asyncio.wait([status_bus._flusher])
+
+
+async def test_batch(status_bus):
+    for i in range(200):
+        status_bus.publish("AddSocket", {"uuid": f"socket{i}"})
+    status_bus.publish("AddBreak", BREAK)
+    await flush(status_bus)
+
+    SyncWebSockets.broadcast.assert_called_once()
+    cmd, messages = SyncWebSockets.broadcast.call_args.args
+    assert cmd == "Batch"
+    assert len(messages) == 201
+    assert messages[0] == 'AddSocket|{"uuid": "socket0"}'
+    assert messages[-1].startswith('AddBreak|{"fn": "/a.py"')
+
+    # A lone change is sent as is
+    SyncWebSockets.broadcast.reset_mock()
+    status_bus.publish("RemoveSocket", "socket0")
+    await flush(status_bus)
+    SyncWebSockets.broadcast.assert_called_once_with('RemoveSocket|"socket0"')
+
+
+async def test_coalesce(status_bus):
+    status_bus.publish("AddSocket", {"uuid": "known"})
+    await flush(status_bus)
+    SyncWebSockets.broadcast.reset_mock()
+
+    # Added then removed within the window: never notified
+    status_bus.publish("AddSocket", {"uuid": "new"})
+    status_bus.publish("AddBreak", BREAK)
+    status_bus.publish("RemoveSocket", "new")
+    status_bus.publish("RemoveBreak", BREAK | {"temporary": False})
+    # Only the last change of an item is notified
+    status_bus.publish("AddSocket", {"uuid": "known", "filename": "a.py"})
+    status_bus.publish("AddWebSocket", "known")
+    status_bus.publish("RemoveSocket", "known")
+    await flush(status_bus)
+
+    assert SyncWebSockets.broadcast.mock_calls == [
+        call("Batch", ['AddWebSocket|"known"', 'RemoveSocket|"known"'])
+    ]
+    assert status_bus._announced == {("WebSocket", "known")}
+
+
+async def test_snapshot(mocker, monkeypatch, status_bus):
+    monkeypatch.setattr(settings, "show_filename", True)
+    mocker.patch.object(sockets, "_sockets", {"socket1": DummySocket()})
+    mocker.patch.object(sockets, "_filenames", {"socket1": "a.py"})
+    mocker.patch.object(websockets, "_sockets", {"socket1": DummySocket()})
+    mocker.patch.object(breakpoints, "_breakpoints", {"break": BREAK})
+
+    processes = [{"pid": 42}]
+
+    snapshot = status_bus.snapshot(processes)
+    assert json.loads(snapshot.text.split("|", 1)[1]) == {
+        "sockets": [{"uuid": "socket1", "filename": "a.py"}],
+        "websockets": ["socket1"],
+        "breaks": [BREAK],
+        "processes": [{"pid": 42}],
+    }
+    assert status_bus.snapshot(processes) is snapshot
+
+    # Any change makes a new snapshot
+    status_bus.publish("RemoveWebSocket", "socket1")
+    websockets._sockets.clear()
+    snapshot = status_bus.snapshot(processes)
+    assert json.loads(snapshot.text.split("|", 1)[1])["websockets"] == []
+
+    # And so does a new process table
+    processes = [{"pid": 43}]
+    assert status_bus.snapshot(processes) is not snapshot
+    snapshot = status_bus.snapshot(processes)
+    assert json.loads(snapshot.text.split("|", 1)[1])["processes"] == [
+        {"pid": 43}
+    ]
+
+
+async def test_delivered(mocker, status_bus):
+    mocker.patch.object(sockets, "_sockets", {})
+    mocker.patch.object(websockets, "_sockets", {})
+    mocker.patch.object(breakpoints, "_breakpoints", {})
+
+    # Added, then served to a page loading within the window
+    status_bus.publish("AddSocket", {"uuid": "new"})
+    status_bus.publish("AddBreak", BREAK)
+    sockets._sockets["new"] = DummySocket()
+    breakpoints._breakpoints["break"] = BREAK
+    status_bus.snapshot([])
+    status_bus.delivered("AddWebSocket", "listed")
+
+    # Removed within the same window
+    status_bus.publish("RemoveSocket", "new")
+    status_bus.publish("RemoveBreak", BREAK | {"temporary": False})
+    status_bus.publish("RemoveWebSocket", "listed")
+    await flush(status_bus)
+
+    # The page is told, rather than keeping ghost rows
+    cmd, messages = SyncWebSockets.broadcast.call_args.args
+    assert cmd == "Batch"
+    assert messages[0] == 'RemoveSocket|"new"'
+    assert messages[1].startswith('RemoveBreak|{"fn": "/a.py"')
+    assert messages[2] == 'RemoveWebSocket|"listed"'
+    assert status_bus._announced == set()
@@ -6,7 +6,7 @@ from mock import call
 
 # Firstparty:
 from conftest import DummyWebSocket
-from wdb_server.utils.state import SyncWebSockets, WebSockets
+from wdb_server.utils.state import StatusBus, WebSockets
 
 
 @pytest.fixture
@@ -15,12 +15,12 @@ def websockets():
 
 
 async def test_add(mocker, dummy_websocket, websockets):
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
 
     assert "dummy_websocket" not in websockets._sockets
     await websockets.add("dummy_websocket", dummy_websocket)
     assert websockets._sockets == {"dummy_websocket": dummy_websocket}
-    SyncWebSockets.broadcast.assert_called_once_with(
+    StatusBus.publish.assert_called_once_with(
         "AddWebSocket", "dummy_websocket"
     )
 
@@ -0,0 +1,420 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=protected-access,no-member,missing-class-docstring
+# Stdlib:
+import asyncio
+import sys
+import zlib
+from struct import pack
+
+# Thirdparty:
+import pytest
+from mock import call
+
+# Firstparty:
+from wdb_server.constants import COMPRESSED_FLAG
+from wdb_server.utils import streams
+from wdb_server.utils.admission import Admission
+from wdb_server.utils.state import settings
+from wdb_server.utils.streams import FrameReader, IOStream
+
+TEST_UUID = "a8d1b5a6-5b7a-4f5e-9c1d-2b3f4a5b6c7d"
+
+
+class DummyTransport:
+    def __init__(self):
+        self.buffered = 0
+
+    def set_write_buffer_limits(self, high=None):
+        ...
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+
+class DummyWriter:
+    def __init__(self):
+        self.transport = DummyTransport()
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+        self.transport.buffered += len(data)
+
+    def writelines(self, data):
+        for item in data:
+            self.write(item)
+
+    async def drain(self):
+        ...
+
+    def can_write_eof(self):
+        return False
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        ...
+
+
+def make_frame(data: bytes) -> bytes:
+    return pack("!i", len(data)) + data
+
+
+def stack_depth() -> int:
+    frame, depth = sys._getframe(), 0
+    while frame is not None:
+        frame, depth = frame.f_back, depth + 1
+    return depth
+
+
+@pytest.fixture
+def reader():
+    return asyncio.StreamReader(limit=2**24)
+
+
+@pytest.fixture
+def stream(reader):
+    return IOStream(reader, DummyWriter())
+
+
+async def test_run(mocker, reader, stream):
+    assign_stream = mocker.patch("wdb_server.utils.streams.assign_stream")
+    read_frame = mocker.patch("wdb_server.utils.streams.read_frame")
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_data(make_frame(b"PING"))
+    reader.feed_data(make_frame("Dump|é".encode("utf-8")))
+    reader.feed_eof()
+
+    await FrameReader(stream).run()
+    assign_stream.assert_called_once_with(stream, TEST_UUID)
+    assert [c.args for c in read_frame.mock_calls] == [
+        (stream, TEST_UUID, b"PING"),
+        (stream, TEST_UUID, "Dump|é".encode("utf-8")),
+    ]
+
+
+async def test_run_closed_before_uuid(mocker, reader, stream):
+    assign_stream = mocker.patch("wdb_server.utils.streams.assign_stream")
+    reader.feed_data(b"\x00\x00")
+    reader.feed_eof()
+
+    await FrameReader(stream).run()
+    assign_stream.assert_not_called()
+
+
+async def test_run_million_frames(mocker, reader, stream):
+    mocker.patch("wdb_server.utils.streams.assign_stream")
+    count = 1_000_000
+    frames = 0
+    depths = set()
+
+    async def read_frame(_stream, _uuid, _frame):
+        nonlocal frames
+        frames += 1
+        if frames % 1000 == 1:
+            depths.add(stack_depth())
+
+    mocker.patch("wdb_server.utils.streams.read_frame", read_frame)
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_data(make_frame(b"PING") * count)
+    reader.feed_eof()
+
+    await FrameReader(stream).run()
+    assert frames == count
+    assert len(depths) == 1
+
+
+async def test_write(mocker, reader):
+    writer = DummyWriter()
+    mocker.patch.object(DummyWriter, "drain")
+    stream = IOStream(reader, writer, high_water=8)
+
+    await stream.write(b"1234")
+    await stream.write(b"5678")
+    assert writer.written == []
+    assert stream.queue_size == 2
+    await asyncio.sleep(0)
+    assert writer.written == [b"1234", b"5678"]
+    assert stream.queue_size == 0
+    DummyWriter.drain.assert_not_called()
+
+    await stream.write(b"9")
+    await asyncio.sleep(0)
+    DummyWriter.drain.assert_called_once()
+
+    await stream.write(b"closing")
+    await stream.close()
+    assert writer.written[-1] == b"closing"
+    assert writer.closed
+    await asyncio.sleep(0)
+    with pytest.raises(ConnectionResetError):
+        await stream.write(b"closed")
+
+
+@pytest.mark.parametrize(
+    "policy, expected, closed",
+    [
+        ("block", [b"1", b"2", b"3"], False),
+        ("drop_oldest", [b"2", b"3"], False),
+        ("disconnect", [b"1", b"2"], True),
+    ],
+)
+async def test_write_full_queue(monkeypatch, reader, policy, expected, closed):
+    monkeypatch.setattr(settings, "send_queue_policy", policy)
+    writer = DummyWriter()
+    stream = IOStream(reader, writer, queue_size=2)
+
+    await stream.write(b"1")
+    await stream.write(b"2")
+    # The sender task has not run yet so the queue is full
+    await stream.write(b"3")
+    await asyncio.sleep(0)
+    assert writer.written == expected
+    assert writer.closed == closed
+    await stream.close()
+
+
+async def test_run_large_frames(mocker, monkeypatch, reader, stream):
+    mocker.patch("wdb_server.utils.streams.assign_stream")
+    read_frame = mocker.patch("wdb_server.utils.streams.read_frame")
+    send = mocker.patch("wdb_server.utils.state.WebSockets.send")
+    monkeypatch.setattr(settings, "stream_threshold", 8)
+    monkeypatch.setattr(settings, "max_frame_size", 100)
+    monkeypatch.setattr(streams, "STREAM_CHUNK_SIZE", 4)
+    large = "Dump|éé".encode("utf-8")
+
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_data(make_frame(b"PING"))
+    reader.feed_data(make_frame(large))
+    reader.feed_data(make_frame(b"x" * 101))
+    reader.feed_data(make_frame(b"end"))
+    reader.feed_eof()
+
+    await FrameReader(stream).run()
+    assert [c.args[2] for c in read_frame.mock_calls] == [b"PING", b"end"]
+    assert send.mock_calls[:-1] == [
+        call(TEST_UUID, "Chunk|Dump"),
+        call(TEST_UUID, "Chunk||é"),
+        call(TEST_UUID, "Chunk|é"),
+        call(TEST_UUID, "ChunkEnd"),
+    ]
+    rejected = send.mock_calls[-1]
+    assert rejected.args[:2] == (TEST_UUID, "Echo")
+    assert rejected.args[2]["for"] == "Frame rejected"
+
+
+def make_compressed_frame(data: bytes) -> bytes:
+    payload = zlib.compress(data)
+    return pack("!i", len(payload) | COMPRESSED_FLAG) + payload
+
+
+@pytest.mark.parametrize(
+    "level, algorithms, enabled",
+    [
+        (6, "zlib", True),
+        (6, "lz4,zlib", True),
+        (6, "lz4", False),
+        (0, "zlib", False),
+    ],
+)
+async def test_enable_compression(
+    mocker, monkeypatch, stream, level, algorithms, enabled
+):
+    send = mocker.patch("wdb_server.utils.state.Sockets.send")
+    monkeypatch.setattr(settings, "compression_level", level)
+
+    await streams.read_frame(
+        stream, TEST_UUID, f"ENABLE_COMPRESSION|{algorithms}".encode("utf-8")
+    )
+    send.assert_called_once_with(
+        TEST_UUID,
+        "COMPRESSION",
+        {
+            "algorithm": "zlib" if enabled else None,
+            "threshold": settings.compression_threshold,
+        },
+    )
+    assert stream.compression == enabled
+
+
+async def test_run_compressed_frames(mocker, monkeypatch, reader, stream):
+    mocker.patch("wdb_server.utils.streams.assign_stream")
+    read_frame = mocker.patch("wdb_server.utils.streams.read_frame")
+    send = mocker.patch("wdb_server.utils.state.WebSockets.send")
+    monkeypatch.setattr(settings, "stream_threshold", 64)
+    monkeypatch.setattr(streams, "STREAM_CHUNK_SIZE", 8)
+    dump = ("Dump|" + "é" * 20).encode("utf-8")
+    large = ("Dump|" + "".join(map(str, range(100)))).encode("utf-8")
+    # Small on the wire, but over the stream threshold once inflated
+    inflating = ("Dump|" + "é" * 500).encode("utf-8")
+    stream.compression = True
+
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_data(make_compressed_frame(dump))
+    reader.feed_data(make_frame(b"PING"))
+    reader.feed_data(make_compressed_frame(large))
+    reader.feed_data(make_compressed_frame(inflating))
+    reader.feed_data(pack("!i", 7 | COMPRESSED_FLAG) + b"garbage")
+    reader.feed_data(make_frame(b"ignored"))
+    reader.feed_eof()
+
+    assert len(make_compressed_frame(inflating)) < 64
+    await FrameReader(stream).run()
+    assert [c.args[2] for c in read_frame.mock_calls] == [dump, b"PING"]
+    messages = [c.args[1] for c in send.mock_calls]
+    assert messages.count("ChunkEnd") == 2
+    end = messages.index("ChunkEnd")
+    for relayed, chunks in (
+        (large, messages[:end]),
+        (inflating, messages[end + 1 : -1]),
+    ):
+        # Inflated 8 bytes at a time
+        assert all(len(chunk[6:].encode("utf-8")) <= 8 for chunk in chunks)
+        assert "".join(chunk[6:] for chunk in chunks) == relayed.decode(
+            "utf-8"
+        )
+    assert messages[-1] == "ChunkEnd"
+
+
+async def test_run_compressed_over_max_frame_size(
+    mocker, monkeypatch, reader, stream
+):
+    mocker.patch("wdb_server.utils.streams.assign_stream")
+    read_frame = mocker.patch("wdb_server.utils.streams.read_frame")
+    send = mocker.patch("wdb_server.utils.state.WebSockets.send")
+    monkeypatch.setattr(settings, "stream_threshold", 64)
+    monkeypatch.setattr(settings, "max_frame_size", 1000)
+    monkeypatch.setattr(streams, "STREAM_CHUNK_SIZE", 256)
+    stream.compression = True
+
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_data(make_compressed_frame(b"x" * 10**6))
+    reader.feed_data(make_frame(b"ignored"))
+    reader.feed_eof()
+
+    await FrameReader(stream).run()
+    read_frame.assert_not_called()
+    # Given up with the 4th piece inflated, not the whole MB
+    assert len(send.mock_calls) == 3
+    assert "ChunkEnd" not in [c.args[1] for c in send.mock_calls]
+
+
+async def test_run_flag_without_compression(mocker, reader, stream):
+    mocker.patch("wdb_server.utils.streams.assign_stream")
+    read_frame = mocker.patch("wdb_server.utils.streams.read_frame")
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_data(pack("!i", 4 | COMPRESSED_FLAG) + b"PING")
+    reader.feed_eof()
+
+    # Unmodified clients never get their frames decompressed
+    await FrameReader(stream).run()
+    read_frame.assert_not_called()
+
+
+async def test_handle_unix_connection(mocker, tmp_path):
+    assign_stream = mocker.patch("wdb_server.utils.streams.assign_stream")
+    read_frame = mocker.patch("wdb_server.utils.streams.read_frame")
+    mocker.patch("wdb_server.utils.streams.IOStream.on_close")
+    path = str(tmp_path / "wdb.sock")
+    handled = asyncio.Event()
+
+    async def handler(reader, writer):
+        await streams.handle_tcp_connection(reader, writer)
+        handled.set()
+
+    server = await asyncio.start_unix_server(handler, path=path)
+    _, writer = await asyncio.open_unix_connection(path)
+    writer.write(make_frame(TEST_UUID.encode("utf-8")) + make_frame(b"PING"))
+    writer.close()
+    await writer.wait_closed()
+    await asyncio.wait_for(handled.wait(), 5)
+    server.close()
+    await server.wait_closed()
+
+    assert assign_stream.call_args.args[1] == TEST_UUID
+    assert read_frame.call_args.args[1:] == (TEST_UUID, b"PING")
+
+
+async def test_handle_rejected_connection(mocker, reader):
+    assign_stream = mocker.patch("wdb_server.utils.streams.assign_stream")
+    error = streams.AdmissionError("admission queue full")
+    mocker.patch(
+        "wdb_server.utils.admission.Admission.admit", side_effect=error
+    )
+    release = mocker.patch("wdb_server.utils.admission.Admission.release")
+    writer = DummyWriter()
+    writer.get_extra_info = lambda name: ("127.0.0.1", 4242)
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    reader.feed_eof()
+
+    await streams.handle_tcp_connection(reader, writer)
+    # Told why before being disconnected
+    assert writer.written == [error.frame()]
+    assert writer.closed
+    assign_stream.assert_not_called()
+    release.assert_not_called()
+
+
+async def test_handle_connection_lost_waiting(mocker, monkeypatch, reader):
+    monkeypatch.setattr(settings, "max_sessions", 1)
+    monkeypatch.setattr(settings, "admission_timeout", 5)
+    assign_stream = mocker.patch("wdb_server.utils.streams.assign_stream")
+    mocker.patch("wdb_server.utils.streams.admission", Admission())
+    await streams.admission.acquire()
+    writer = DummyWriter()
+    writer.get_extra_info = lambda name: ("127.0.0.1", 4242)
+
+    handled = asyncio.create_task(
+        streams.handle_tcp_connection(reader, writer)
+    )
+    await asyncio.sleep(0.01)
+    assert streams.admission.waiting == 1
+    reader.feed_data(make_frame(TEST_UUID.encode("utf-8")))
+    await asyncio.sleep(0.01)
+    assert streams.admission.waiting == 1
+
+    # Its place in the queue is given up as soon as the peer leaves
+    reader.feed_eof()
+    await asyncio.wait_for(handled, 1)
+    assert streams.admission.waiting == 0
+    assert streams.admission.active == 1
+    assert writer.closed
+    assign_stream.assert_not_called()
+
+
+async def test_wait_lost(reader, stream):
+    reader.feed_data(b"0123456789")
+    # Then waits for the writer to be closed
+    await stream.wait_lost(8)
+    assert stream._read_ahead == b"01234567"
+
+    # What was read ahead is still read in order
+    assert await stream.readexactly(4) == b"0123"
+    assert await stream.readexactly(6) == b"456789"
+    reader.feed_data(b"abc")
+    reader.feed_eof()
+    await stream.wait_lost()
+    assert await stream.readexactly(3) == b"abc"
+
+
+async def test_read_frame_server_breaks(mocker, stream):
+    send = mocker.patch("wdb_server.utils.state.Sockets.send")
+    mocker.patch(
+        "wdb_server.utils.state.Breakpoints.encoded", return_value="[]"
+    )
+    encoded_since = mocker.patch(
+        "wdb_server.utils.state.Breakpoints.encoded_since",
+        return_value='{"version": 2}',
+    )
+
+    await streams.read_frame(stream, TEST_UUID, b"ServerBreaks")
+    await streams.read_frame(stream, TEST_UUID, b"ServerBreaksSince|1")
+    await streams.read_frame(stream, TEST_UUID, b"ServerBreaksSince|x")
+    assert send.mock_calls == [
+        call(TEST_UUID, "[]"),
+        call(TEST_UUID, '{"version": 2}'),
+        call(TEST_UUID, '{"version": 2}'),
+    ]
+    assert encoded_since.mock_calls == [call(1), call(-1)]
@@ -2,13 +2,47 @@
 # pylint: disable=protected-access,no-member,missing-class-docstring
 # pylint: disable=too-few-public-methods,too-many-instance-attributes
 # pylint: disable=too-many-arguments
+# Stdlib:
+import asyncio
+import importlib.util
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+
 # Thirdparty:
 import psutil
+import pytest
 from mock import call
 
 # Firstparty:
-from wdb_server.utils.state import SyncWebSockets
-from wdb_server.utils.technical import refresh_process
+from wdb_server.utils import technical
+from wdb_server.utils.procfs import ProcfsScanner
+from wdb_server.utils.state import SyncWebSockets, syncwebsockets
+from wdb_server.utils.technical import (
+    LibPythonCache,
+    ProcessScanner,
+    outdated,
+    refresh_metrics,
+    refresh_process,
+    refresh_threads,
+    scan_pids,
+    search_libpython,
+    start_process_monitor,
+)
+
+
+@pytest.fixture(autouse=True)
+def psutil_scanner(mocker):
+    mocker.patch("wdb_server.utils.technical.procfs_scanner", None)
+
+
+@pytest.fixture(autouse=True)
+def process_scanner(mocker):
+    return mocker.patch(
+        "wdb_server.utils.technical.process_scanner", ProcessScanner()
+    )
 
 
 class PsutilProcessThreadMock:
@@ -59,8 +93,12 @@ class PsutilProcessMock:
             raise self._cmdline
         return self._cmdline
 
-    # pylint: disable=unused-argument
+    @contextmanager
+    def oneshot(self):
+        yield
+
     def cpu_percent(self, interval=0.01):
+        assert interval is None
         if isinstance(self._cpu_percent, psutil.Error):
             raise self._cpu_percent
         return self._cpu_percent
@@ -193,86 +231,56 @@ unknown_error_process = PsutilProcessMock(
     memory_percent=1.1,
 )
 
-expected_calls = [
-    (
-        "AddProcess",
-        {
-            "pid": python_process_without_threads.pid,
-            "user": python_process_without_threads._username,
-            "cmd": " ".join(python_process_without_threads._cmdline),
-            "threads": len(python_process_without_threads._threads),
-            "time": python_process_without_threads._create_time,
-            "mem": python_process_without_threads._memory_percent,
-            "cpu": python_process_without_threads._cpu_percent,
-        },
-    ),
-    (
-        "AddProcess",
-        {
-            "pid": python_process_with_threads.pid,
-            "user": python_process_with_threads._username,
-            "cmd": " ".join(python_process_with_threads._cmdline),
-            "threads": len(python_process_with_threads._threads),
-            "time": python_process_with_threads._create_time,
-            "mem": python_process_with_threads._memory_percent,
-            "cpu": python_process_with_threads._cpu_percent,
-        },
-    ),
-    (
-        "AddThread",
-        {
-            "id": python_process_with_threads._threads[0].id,
-            "of": python_process_with_threads.pid,
-        },
-    ),
-    (
-        "AddThread",
-        {
-            "id": python_process_with_threads._threads[1].id,
-            "of": python_process_with_threads.pid,
-        },
-    ),
-    (
-        "KeepProcess",
-        [
-            python_process_without_threads.pid,
-            python_process_with_threads.pid,
-        ],
-    ),
-    (
-        "KeepThreads",
-        [
-            python_process_with_threads._threads[0].id,
-            python_process_with_threads._threads[1].id,
-        ],
-    ),
+python_process_info = {
+    "pid": python_process_without_threads.pid,
+    "user": python_process_without_threads._username,
+    "cmd": " ".join(python_process_without_threads._cmdline),
+    "threads": len(python_process_without_threads._threads),
+    "time": python_process_without_threads._create_time,
+    "mem": python_process_without_threads._memory_percent,
+    "cpu": python_process_without_threads._cpu_percent,
+}
+python_process_with_threads_info = {
+    "pid": python_process_with_threads.pid,
+    "user": python_process_with_threads._username,
+    "cmd": " ".join(python_process_with_threads._cmdline),
+    "threads": len(python_process_with_threads._threads),
+    "time": python_process_with_threads._create_time,
+    "mem": python_process_with_threads._memory_percent,
+    "cpu": python_process_with_threads._cpu_percent,
+}
+expected_table = {
+    "full": True,
+    "processes": [python_process_info, python_process_with_threads_info],
+    "removed": [],
+}
+mock_processes = [
+    empty_process,
+    not_python_process,
+    python_process_without_threads,
+    python_process_with_threads,
+    zombie_process,
+    access_denied_process,
+    no_such_process,
+    zombie_process2,
+    access_denied_process2,
+    no_such_process2,
+    unknown_error_process,
 ]
 
 
 async def test_refresh_process_without_uuid(mocker):
     mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
     mocker.patch("wdb_server.utils.state.SyncWebSockets.send")
-    mock_processes = [
-        empty_process,
-        not_python_process,
-        python_process_without_threads,
-        python_process_with_threads,
-        zombie_process,
-        access_denied_process,
-        no_such_process,
-        zombie_process2,
-        access_denied_process2,
-        no_such_process2,
-        unknown_error_process,
-    ]
+    mocker.patch.object(syncwebsockets, "_sockets", {"uuid1": 1, "uuid2": 2})
     mocker.patch(
         "psutil.process_iter", return_value=mock_process_iter(mock_processes)
     )
     await refresh_process()
-    SyncWebSockets.send.assert_not_called()
-    assert SyncWebSockets.broadcast.call_count == 6
-    assert SyncWebSockets.broadcast.mock_calls == [
-        call(*x) for x in expected_calls
+    SyncWebSockets.broadcast.assert_not_called()
+    assert sorted(SyncWebSockets.send.mock_calls) == [
+        call("uuid1", "Processes", expected_table),
+        call("uuid2", "Processes", expected_table),
     ]
 
 
@@ -280,25 +288,353 @@ async def test_refresh_process_with_uuid(mocker):
     test_uuid = "test_uuid"
     mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
     mocker.patch("wdb_server.utils.state.SyncWebSockets.send")
-    mock_processes = [
-        empty_process,
-        not_python_process,
-        python_process_without_threads,
-        python_process_with_threads,
-        zombie_process,
-        access_denied_process,
-        no_such_process,
-        zombie_process2,
-        access_denied_process2,
-        no_such_process2,
-        unknown_error_process,
-    ]
     mocker.patch(
         "psutil.process_iter", return_value=mock_process_iter(mock_processes)
     )
     await refresh_process(test_uuid)
     SyncWebSockets.broadcast.assert_not_called()
-    assert SyncWebSockets.send.call_count == 6
     assert SyncWebSockets.send.mock_calls == [
-        call(test_uuid, *x) for x in expected_calls
+        call(test_uuid, "Processes", expected_table)
+    ]
+
+
+async def test_refresh_process_scans_off_the_loop(mocker):
+    mocker.patch("wdb_server.utils.state.SyncWebSockets.send")
+    scanned_in = []
+
+    def process_iter():
+        scanned_in.append(threading.current_thread())
+        return mock_process_iter([python_process_with_threads])
+
+    mocker.patch("psutil.process_iter", side_effect=process_iter)
+    await refresh_process("test_uuid")
+    assert scanned_in
+    assert scanned_in[0] is not threading.current_thread()
+    SyncWebSockets.send.assert_called_once()
+
+
+async def test_process_scanner_reuses_table(mocker):
+    mocker.patch("wdb_server.utils.state.SyncWebSockets.send")
+    process_iter = mocker.patch(
+        "psutil.process_iter",
+        side_effect=lambda: mock_process_iter([python_process_with_threads]),
+    )
+    await asyncio.gather(*(refresh_process(f"uuid{i}") for i in range(10)))
+    await refresh_process("uuid10")
+    assert process_iter.call_count == 1
+    assert SyncWebSockets.send.call_count == 11
+
+    await refresh_process()
+    assert process_iter.call_count == 2
+
+
+async def test_process_scanner_interval(mocker, process_scanner):
+    mocker.patch(
+        "wdb_server.utils.technical.settings.process_scan_interval", 0
+    )
+    process_iter = mocker.patch(
+        "psutil.process_iter", side_effect=lambda: mock_process_iter([])
+    )
+    assert await process_scanner.get() == []
+    assert await process_scanner.get() == []
+    assert process_iter.call_count == 2
+
+
+def test_process_scanner_changes(mocker, process_scanner):
+    mocker.patch(
+        "wdb_server.utils.technical.settings.process_change_threshold", 0.5
+    )
+    info = dict(python_process_with_threads_info)
+    table = [dict(python_process_info), info]
+    assert process_scanner.changes("uuid", table) == expected_table
+    assert process_scanner.changes("uuid", table) is None
+
+    info["cpu"] += 0.25
+    info["mem"] -= 0.25
+    assert process_scanner.changes("uuid", table) is None
+    info["cpu"] += 0.5
+    info["threads"] = 3
+    table = [info]
+    assert process_scanner.changes("uuid", table) == {
+        "full": False,
+        "processes": [{"pid": info["pid"], "cpu": info["cpu"], "threads": 3}],
+        "removed": [python_process_info["pid"]],
+    }
+
+    assert process_scanner.changes("uuid", table, full=True) == {
+        "full": True,
+        "processes": [info],
+        "removed": [],
+    }
+    process_scanner.forget("uuid")
+    assert process_scanner.changes("uuid", table)["full"]
+
+    # A Snapshot sent the whole table, only its changes come next
+    process_scanner.forget("uuid")
+    process_scanner.mark_sent("uuid", table)
+    assert process_scanner.changes("uuid", table) is None
+    info["threads"] = 4
+    assert process_scanner.changes("uuid", table)["processes"] == [
+        {"pid": info["pid"], "threads": 4}
+    ]
+
+
+async def test_refresh_metrics(mocker):
+    mocker.patch(
+        "wdb_server.utils.technical.settings.process_scan_interval", 0.01
+    )
+    refresh = mocker.patch(
+        "wdb_server.utils.technical.refresh_process",
+        side_effect=[OSError, None, None],
+    )
+    mocker.patch.object(syncwebsockets, "_sockets", {})
+    refresher = asyncio.ensure_future(refresh_metrics())
+    await asyncio.sleep(0.05)
+    # Nothing to refresh without status pages
+    refresh.assert_not_called()
+
+    # Failures only are logged
+    syncwebsockets._sockets["uuid1"] = 1
+    for _ in range(100):
+        if refresh.call_count >= 2:
+            break
+        await asyncio.sleep(0.01)
+    refresher.cancel()
+    assert refresh.mock_calls[:2] == [call(), call()]
+
+
+async def test_refresh_threads(mocker):
+    mocker.patch("wdb_server.utils.state.SyncWebSockets.send")
+    process = mocker.patch(
+        "psutil.Process", return_value=python_process_with_threads
+    )
+    await refresh_threads("test_uuid", python_process_with_threads.pid)
+    process.assert_called_once_with(python_process_with_threads.pid)
+    SyncWebSockets.send.assert_called_once_with(
+        "test_uuid",
+        "Threads",
+        {"pid": python_process_with_threads.pid, "threads": [1, 2]},
+    )
+
+    SyncWebSockets.send.reset_mock()
+    process.side_effect = psutil.NoSuchProcess(42)
+    await refresh_threads("test_uuid", 42)
+    SyncWebSockets.send.assert_called_once_with(
+        "test_uuid", "Threads", {"pid": 42, "threads": []}
+    )
+
+
+async def test_process_scanner_notify(mocker, process_scanner):
+    mocker.patch("wdb_server.utils.state.SyncWebSockets.send")
+    mocker.patch.object(syncwebsockets, "_sockets", {"uuid1": 1})
+    mocker.patch("wdb_server.utils.technical.settings.status_window", 0)
+    mocker.patch(
+        "psutil.process_iter",
+        side_effect=lambda: mock_process_iter(
+            [python_process_without_threads, python_process_with_threads]
+        ),
+    )
+    await refresh_process()
+    SyncWebSockets.send.reset_mock()
+
+    # Started then exited within the window
+    process_scanner.notify(42, True)
+    process_scanner.notify(42, False)
+    # Python process which exec'd something else
+    process_scanner.notify(python_process_without_threads.pid, True)
+    process_scanner.notify(python_process_with_threads.pid, False)
+    scan_pids = mocker.patch(
+        "wdb_server.utils.technical.scan_pids",
+        return_value=[],
+    )
+    await process_scanner._updater
+    scan_pids.assert_called_once_with({python_process_without_threads.pid})
+    SyncWebSockets.send.assert_called_once_with(
+        "uuid1",
+        "Processes",
+        {
+            "full": False,
+            "processes": [],
+            "removed": [
+                python_process_without_threads.pid,
+                python_process_with_threads.pid,
+            ],
+        },
+    )
+
+    SyncWebSockets.send.reset_mock()
+    scan_pids.return_value = [python_process_info]
+    process_scanner.notify(python_process_info["pid"], True)
+    await process_scanner._updater
+    SyncWebSockets.send.assert_called_once_with(
+        "uuid1",
+        "Processes",
+        {"full": False, "processes": [python_process_info], "removed": []},
+    )
+    assert await process_scanner.get() == [python_process_info]
+
+
+def test_scan_pids(mocker):
+    mocker.patch(
+        "psutil.process_iter", return_value=mock_process_iter(mock_processes)
+    )
+    assert scan_pids({python_process_info["pid"], 42}) == [python_process_info]
+
+
+async def test_start_process_monitor(mocker, process_scanner):
+    connector = mocker.patch(
+        "wdb_server.utils.technical.ProcConnector", side_effect=OSError
+    )
+    mocker.patch("wdb_server.utils.technical.LibPythonWatcher", None)
+    mocker.patch("wdb_server.utils.technical.procfs_scanner", ProcfsScanner())
+    assert start_process_monitor("poll") is None
+    connector.assert_not_called()
+    assert not process_scanner.monitored
+
+    # Falls back to polling
+    assert start_process_monitor("netlink") is None
+    connector.assert_called_once_with(
+        process_scanner.notify, process_scanner.rescan
+    )
+    assert not process_scanner.monitored
+
+    connector.side_effect = None
+    assert start_process_monitor("netlink") is connector.return_value
+    assert process_scanner.monitored
+
+
+async def test_process_scanner_rescan(mocker, process_scanner):
+    mocker.patch("wdb_server.utils.technical.settings.rescan_window", 0.05)
+    send_changes = mocker.patch("wdb_server.utils.technical.send_changes")
+    scans = []
+
+    async def refresh():
+        scans.append(time.monotonic())
+        await asyncio.sleep(0.01)
+        return []
+
+    mocker.patch.object(ProcessScanner, "refresh", side_effect=refresh)
+    process_scanner.rescan()
+    rescanner = process_scanner._rescanner
+    for _ in range(99):
+        process_scanner.rescan()
+        await asyncio.sleep(0.001)
+    await rescanner
+    assert process_scanner._rescanner is None
+    assert process_scanner.notifications == 100
+    assert process_scanner.suppressed == 99
+    assert 2 <= len(scans) <= 4
+    assert send_changes.call_count == len(scans)
+    assert all(
+        later - earlier >= 0.05 for earlier, later in zip(scans, scans[1:])
+    )
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+async def test_search_libpython(mocker, tmp_path):
+    root = tmp_path / "prefix"
+    (root / "lib" / "python3.9").mkdir(parents=True)
+    (root / "lib" / "libpython3.9.so").touch()
+    (root / "lib" / "libc.so").touch()
+    mocker.patch(
+        "wdb_server.utils.technical.settings.cache_dir",
+        str(tmp_path / "cache"),
+    )
+    library = str((root / "lib" / "libpython3.9.so").resolve())
+    find_libpython = mocker.patch(
+        "wdb_server.utils.technical.find_libpython",
+        side_effect=technical.find_libpython,
+    )
+
+    # Nothing cached yet
+    assert await collect(search_libpython(str(root))) == [[library]]
+    assert find_libpython.call_count == 1
+    assert LibPythonCache(str(tmp_path / "cache")).load(str(root))[0] == [
+        library
+    ]
+
+    # Cached and up to date
+    assert await collect(search_libpython(str(root))) == [[library]]
+    assert find_libpython.call_count == 1
+
+    # Cached but outdated
+    (root / "lib" / "python3.9" / "libpython3.9d.so").touch()
+    assert await collect(search_libpython(str(root))) == [
+        [library],
+        [library, str((root / "lib" / "python3.9" / "libpython3.9d.so"))],
     ]
+    assert find_libpython.call_count == 2
+
+
+def test_libpython_cache(tmp_path):
+    cache = LibPythonCache(str(tmp_path / "cache"))
+    assert cache.load("/usr") == ([], {})
+    cache.save("/usr", ["/usr/lib/libpython3.so"], {"/usr/lib": 1.0})
+    cache.save("/opt", [], {"/opt": 2.0})
+    assert cache.load("/usr") == (
+        ["/usr/lib/libpython3.so"],
+        {"/usr/lib": 1.0},
+    )
+    assert cache.load("/opt") == ([], {"/opt": 2.0})
+
+    (tmp_path / "cache" / "libpython.json").write_text("{")
+    assert cache.load("/usr") == ([], {})
+
+    # Not writable
+    (tmp_path / "cache" / "libpython.json").unlink()
+    (tmp_path / "cache").rmdir()
+    (tmp_path / "cache").touch()
+    cache.save("/usr", [], {})
+    assert cache.load("/usr") == ([], {})
+
+
+def test_outdated(tmp_path):
+    assert outdated({})
+    assert not outdated({str(tmp_path): tmp_path.stat().st_mtime})
+    assert outdated({str(tmp_path): tmp_path.stat().st_mtime - 1})
+    assert outdated({str(tmp_path / "gone"): 0})
+
+
+class AsyncioNotifierMock:
+    def __init__(self, watch_manager, loop, callback, default_proc_fun):
+        self.handle_read_callback = callback
+
+    def handle_read(self):
+        # As pyinotify does, once the events are read and processed
+        self.handle_read_callback(self)
+
+    def stop(self):
+        pass
+
+
+@pytest.fixture
+def inotify_technical(mocker):
+    """
+    A copy of the technical module, importing a fake pyinotify.
+    """
+    pyinotify = types.ModuleType("pyinotify")
+    pyinotify.WatchManager = mocker.Mock
+    pyinotify.AsyncioNotifier = AsyncioNotifierMock
+    pyinotify.ProcessEvent = mocker.Mock
+    pyinotify.EventsCodes = types.SimpleNamespace(
+        ALL_FLAGS={"IN_OPEN": 0x20, "IN_CLOSE_NOWRITE": 0x10}
+    )
+    mocker.patch.dict(sys.modules, {"pyinotify": pyinotify})
+    spec = importlib.util.spec_from_file_location(
+        "technical_with_inotify", technical.__file__
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def test_libpython_watcher_notified(mocker, inotify_technical):
+    scanner = mocker.patch.object(inotify_technical, "process_scanner")
+    watcher = inotify_technical.LibPythonWatcher()
+    watcher.notifier.handle_read()
+    watcher.notifier.handle_read()
+    assert scanner.rescan.call_count == 2
+    watcher.close()
@@ -0,0 +1,135 @@
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# Stdlib:
+import gzip
+
+# Aiohttp:
+import aiohttp
+
+# Thirdparty:
+import pytest
+
+# Firstparty:
+from wdb_server.constants import IMMUTABLE
+from wdb_server.utils.assets import Manifest, content_hash, hashed_name
+
+CSS = b".mdl-button { color: red; }\n" * 64
+
+
+@pytest.fixture
+def static(tmp_path, client):
+    (tmp_path / "theme.css").write_bytes(CSS)
+    (tmp_path / "theme.css.gz").write_bytes(gzip.compress(CSS))
+    (tmp_path / "secret.txt").write_bytes(b"secret")
+    root = tmp_path / "static"
+    root.mkdir()
+    (root / "libs").mkdir()
+    for name in ("theme.css", "theme.css.gz"):
+        (root / "libs" / name).write_bytes((tmp_path / name).read_bytes())
+    client.app["assets"] = Manifest(root)
+    client.app["assets"].refresh()
+    return root
+
+
+async def test_static_gzip(client, static):
+    resp = await client.get(
+        "/static/libs/theme.css", headers={"Accept-Encoding": "gzip, br"}
+    )
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "text/css"
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert await resp.read() == CSS
+
+
+async def test_static_brotli(client, static):
+    (static / "libs" / "theme.css.br").write_bytes(b"brotli")
+    async with aiohttp.ClientSession(auto_decompress=False) as session:
+        async with session.get(
+            client.make_url("/static/libs/theme.css"),
+            headers={"Accept-Encoding": "gzip, br"},
+        ) as resp:
+            assert resp.status == 200
+            assert resp.headers["Content-Type"] == "text/css"
+            assert resp.headers["Content-Encoding"] == "br"
+            assert await resp.read() == b"brotli"
+
+
+async def test_static_identity(client, static):
+    resp = await client.get(
+        "/static/libs/theme.css", headers={"Accept-Encoding": "identity"}
+    )
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "text/css"
+    assert "Content-Encoding" not in resp.headers
+    assert resp.headers["Vary"] == "Accept-Encoding"
+    assert await resp.read() == CSS
+
+    resp = await client.head(
+        "/static/libs/theme.css", headers={"Accept-Encoding": "identity"}
+    )
+    assert resp.status == 200
+    assert int(resp.headers["Content-Length"]) == len(CSS)
+
+
+async def test_static_refused(client, static):
+    for accept_encoding in ("gzip;q=0, identity", "br, gzip;q=0"):
+        resp = await client.get(
+            "/static/libs/theme.css",
+            headers={"Accept-Encoding": accept_encoding},
+        )
+        assert resp.status == 200
+        assert "Content-Encoding" not in resp.headers
+        assert int(resp.headers["Content-Length"]) == len(CSS)
+        assert await resp.read() == CSS
+
+    # Conditional requests still apply
+    resp = await client.get(
+        "/static/libs/theme.css",
+        headers={
+            "Accept-Encoding": "gzip;q=0",
+            "If-None-Match": resp.headers["ETag"],
+        },
+    )
+    assert resp.status == 304
+
+
+async def test_static_not_found(client, static):
+    for path in ("missing.css", "libs", "../secret.txt", "libs/../../x"):
+        resp = await client.get(f"/static/{path}")
+        assert resp.status == 404
+
+
+async def test_static_hashed(client, static):
+    name = hashed_name(
+        "libs/theme.css", content_hash(static / "libs" / "theme.css")
+    )
+    resp = await client.get(f"/static/{name}")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "text/css"
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.headers["Cache-Control"] == IMMUTABLE
+    assert not resp.headers["ETag"].startswith("W/")
+    assert await resp.read() == CSS
+
+    # Not cached for good by an outdated hash
+    (static / "libs" / "theme.css").write_bytes(CSS * 2)
+    resp = await client.get(f"/static/{name}")
+    assert resp.status == 200
+    assert "Cache-Control" not in resp.headers
+
+    # Nor by its plain name
+    resp = await client.get("/static/libs/theme.css")
+    assert resp.status == 200
+    assert "Cache-Control" not in resp.headers
+
+    resp = await client.get("/static/libs/missing.0123456789abcdef.css")
+    assert resp.status == 404
+
+
+async def test_static_favicon(client):
+    resp = await client.get("/static/images/favicon.ico")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] in (
+        "image/vnd.microsoft.icon",
+        "image/x-icon",
+    )
@@ -14,15 +14,18 @@ from mock import call
 # Firstparty:
 import wdb_server
 from wdb_server.utils.state import (
+    Message,
     Sockets,
+    StatusBus,
     SyncWebSockets,
     WebSockets,
+    breakpoint_key,
     breakpoints,
     settings,
     sockets,
+    status_bus,
     websockets,
 )
-from wdb_server.utils.technical import LibPythonWatcher
 from wdb_server.views import (
     BaseWebSocketHandler,
     run_file,
@@ -33,6 +36,14 @@ from wdb_server.views import (
 TEST_UUID = "TEST_UUID"
 
 
+@pytest.fixture()
+def refresh_threads():
+    with mock.patch.object(
+        wdb_server.views, "refresh_threads", return_value=None
+    ) as mock_method:
+        yield mock_method
+
+
 @pytest.fixture()
 def refresh_process():
     with mock.patch.object(
@@ -57,8 +68,7 @@ async def test_open_close(mocker, client):
         SyncWebSockets.add.assert_called_once()
         uuid = SyncWebSockets.add.call_args[0][0]
         instance = SyncWebSockets.add.call_args[0][1]
-        if not LibPythonWatcher:
-            SyncWebSockets.send.assert_called_with(uuid, "StartLoop")
+        SyncWebSockets.send.assert_called_with(uuid, "StartLoop")
         assert instance.uuid == uuid
     SyncWebSockets.remove.assert_called_with(uuid)
 
@@ -79,6 +89,7 @@ async def test_on_message(
     client,
     dummy_socket,
     refresh_process,
+    refresh_threads,
     Process___init__,
     Process_start,
     create_subprocess_exec,
@@ -131,6 +142,10 @@ async def test_on_message(
         call(uuid, "AddSocket", {"uuid": "socket2", "filename": "filename2"})
         in SyncWebSockets.send.mock_calls
     )
+    # Their removal is notified, whenever they were added
+    assert {("Socket", "socket1"), ("Socket", "socket2")} <= (
+        status_bus._announced
+    )
 
     # ListWebsockets
     websockets._sockets = {
@@ -149,9 +164,46 @@ async def test_on_message(
         call(uuid, "AddWebSocket", "websocket2")
         in SyncWebSockets.send.mock_calls
     )
+    assert ("WebSocket", "websocket1") in status_bus._announced
+
+    # Snapshot
+    snapshot = mocker.patch(
+        "wdb_server.utils.state.StatusBus.snapshot",
+        return_value=Message("Snapshot", {"sockets": []}),
+    )
+    processes = [{"pid": 42}]
+    mocker.patch(
+        "wdb_server.utils.technical.ProcessScanner.get",
+        return_value=processes,
+    )
+    mark_sent = mocker.patch(
+        "wdb_server.utils.technical.ProcessScanner.mark_sent"
+    )
+
+    uuid = await send_to_websocket("Snapshot")
+
+    SyncWebSockets.send.assert_called_once_with(
+        uuid, Message("Snapshot", {"sockets": []})
+    )
+    snapshot.assert_called_once_with(processes)
+    mark_sent.assert_called_once_with(uuid, processes)
+
+    # ListQueues
+    mocker.patch(
+        "wdb_server.utils.state.Sockets.queue_sizes",
+        return_value={"socket1": 0, "socket2": 3},
+    )
+
+    uuid = await send_to_websocket("ListQueues")
+
+    SyncWebSockets.send.assert_called_once_with(
+        uuid, "QueueSizes", {"socket1": 0, "socket2": 3}
+    )
 
     # ListBreaks
-    breakpoints._breakpoints = ["breakpoint1", "breakpoint2"]
+    breakpoints._breakpoints = {
+        breakpoint_key(brk): brk for brk in ("breakpoint1", "breakpoint2")
+    }
 
     uuid = await send_to_websocket("ListBreaks")
 
@@ -164,16 +216,19 @@ async def test_on_message(
     )
 
     # RemoveBreak
-    mocker.patch("wdb_server.utils.state.SyncWebSockets.broadcast")
+    mocker.patch("wdb_server.utils.state.StatusBus.publish")
     mocker.patch("wdb_server.utils.state.Sockets.broadcast")
     breakpoint1 = {"data": "breakpoint1", "temporary": None}
     breakpoint2 = {"data": "breakpoint2", "temporary": None}
-    breakpoints._breakpoints = [breakpoint1, breakpoint2]
+    breakpoints._breakpoints = {
+        breakpoint_key(brk): brk for brk in (breakpoint1, breakpoint2)
+    }
 
     uuid = await send_to_websocket("RemoveBreak", json.dumps(breakpoint1))
 
-    SyncWebSockets.broadcast.assert_called_with(
-        f"RemoveBreak|{json.dumps(breakpoint1)}"
+    # The view then marks the very same breakpoint as not temporary
+    StatusBus.publish.assert_called_with(
+        "RemoveBreak", breakpoint1 | {"temporary": False}
     )
     Sockets.broadcast.assert_called_with(
         "Unbreak", breakpoint1 | {"temporary": False}
@@ -196,7 +251,14 @@ async def test_on_message(
 
     # ListProcesses
     uuid = await send_to_websocket("ListProcesses")
-    refresh_process.assert_called_once_with(uuid)
+    refresh_process.assert_called_once_with(uuid, full=False)
+    refresh_process.reset_mock()
+    uuid = await send_to_websocket("ListProcesses", "full")
+    refresh_process.assert_called_once_with(uuid, full=True)
+
+    # ListThreads
+    uuid = await send_to_websocket("ListThreads", 42)
+    refresh_threads.assert_called_once_with(uuid, 42)
 
     # Pause
     uuid = await send_to_websocket("Pause", os.getpid())
@@ -2,6 +2,10 @@
 
 # Stdlib:
 import argparse
+import os
+import socket
+from contextlib import suppress
+from functools import partial
 from logging import DEBUG, INFO, WARNING, getLogger
 
 # Thirdparty:
@@ -9,7 +13,13 @@ import uvloop
 from aiomisc import entrypoint
 
 # Firstparty:
-from wdb_server.__main__ import WDBService, WDBTCPService
+from wdb_server.__main__ import (
+    WDBBufferedTCPService,
+    WDBService,
+    WDBTCPService,
+    bind_unix_socket,
+)
+from wdb_server.constants import CACHE_DIR, OFFLINE_ENV
 
 
 # pylint: disable=missing-function-docstring
@@ -22,8 +32,8 @@ def main() -> None:
         "--extra-search-path",
         action="store_true",
         help=(
-            "Try harder to find the 'libpython*' shared library at the cost "
-            "of a slower server startup. (default False)"
+            "Also search sys.base_prefix for 'libpython*' shared libraries, "
+            "in the background and cached in --cache-dir. (default False)"
         ),
     )
     parser.add_argument(
@@ -63,7 +73,241 @@ def main() -> None:
         "--socket-port",
         type=int,
         default=19840,
-        help="Port used to communicate with wdb instances (default 19840)",
+        help=(
+            "Port used to communicate with wdb instances, 0 to only listen "
+            "on --socket-path (default 19840)"
+        ),
+    )
+    parser.add_argument(
+        "--socket-path",
+        type=str,
+        default=None,
+        help=(
+            "Unix domain socket also used to communicate with wdb instances "
+            "running on the same host (default None)"
+        ),
+    )
+    parser.add_argument(
+        "--buffered-protocol",
+        action="store_true",
+        help=(
+            "Parse wdb instances frames with a zero-copy buffered protocol "
+            "instead of asyncio streams (default False)"
+        ),
+    )
+    parser.add_argument(
+        "--socket-buffer-size",
+        type=int,
+        default=65536,
+        help=(
+            "Size of the receive buffer of the buffered protocol "
+            "(default 65536)"
+        ),
+    )
+    parser.add_argument(
+        "--socket-rcvbuf",
+        type=int,
+        default=0,
+        help=(
+            "SO_RCVBUF of the socket used to communicate with wdb instances "
+            "(default 0, system default)"
+        ),
+    )
+    parser.add_argument(
+        "--write-high-water",
+        type=int,
+        default=65536,
+        help=(
+            "Bytes buffered for a wdb instance before waiting for them to "
+            "be sent (default 65536)"
+        ),
+    )
+    parser.add_argument(
+        "--max-frame-size",
+        type=int,
+        default=2**28,
+        help=(
+            "Frames sent by wdb instances over this size in bytes are "
+            "rejected (default 268435456)"
+        ),
+    )
+    parser.add_argument(
+        "--stream-threshold",
+        type=int,
+        default=2**20,
+        help=(
+            "Frames over this size in bytes are relayed to the browser in "
+            "chunks as they arrive (default 1048576)"
+        ),
+    )
+    parser.add_argument(
+        "--send-queue-size",
+        type=int,
+        default=1024,
+        help=(
+            "Messages queued for a wdb instance before applying the "
+            "overflow policy (default 1024)"
+        ),
+    )
+    parser.add_argument(
+        "--send-queue-policy",
+        choices=("block", "drop_oldest", "disconnect"),
+        default="block",
+        help=(
+            "What to do when the queue of a wdb instance is full: wait for "
+            "room, drop the oldest message or disconnect (default block)"
+        ),
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(10),
+        default=6,
+        help=(
+            "zlib level of the frames exchanged with wdb instances which "
+            "ask for compression, 0 to refuse it (default 6)"
+        ),
+    )
+    parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        default=1024,
+        help="Frames over this size in bytes get compressed (default 1024)",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=256,
+        help=(
+            "Concurrent wdb instances sessions, further connections wait "
+            "in the admission queue, 0 for no limit (default 256)"
+        ),
+    )
+    parser.add_argument(
+        "--accept-rate",
+        type=float,
+        default=50,
+        help=(
+            "New wdb instances sessions admitted per second, 0 for no limit "
+            "(default 50)"
+        ),
+    )
+    parser.add_argument(
+        "--admission-queue-size",
+        type=int,
+        default=512,
+        help=(
+            "Connections waiting for admission before new ones are "
+            "rejected (default 512)"
+        ),
+    )
+    parser.add_argument(
+        "--admission-timeout",
+        type=float,
+        default=30,
+        help=(
+            "Seconds a connection may wait for admission before being "
+            "rejected (default 30)"
+        ),
+    )
+    parser.add_argument(
+        "--broadcast-concurrency",
+        type=int,
+        default=64,
+        help=(
+            "Sockets a broadcast message is sent to concurrently "
+            "(default 64)"
+        ),
+    )
+    parser.add_argument(
+        "--broadcast-timeout",
+        type=float,
+        default=5,
+        help=(
+            "Seconds a socket has to take a broadcast message before being "
+            "closed (default 5)"
+        ),
+    )
+    parser.add_argument(
+        "--status-window",
+        type=float,
+        default=0.05,
+        help=(
+            "Seconds the notifications of status pages are gathered for "
+            "before being sent in a single batch (default 0.05)"
+        ),
+    )
+    parser.add_argument(
+        "--process-scan-interval",
+        type=float,
+        default=1,
+        help=(
+            "Seconds the table of python processes shown on status pages "
+            "is reused for before being scanned again (default 1)"
+        ),
+    )
+    parser.add_argument(
+        "--process-change-threshold",
+        type=float,
+        default=0.5,
+        help=(
+            "Points of cpu or mem percentage a process must move by to be "
+            "sent again to status pages (default 0.5)"
+        ),
+    )
+    parser.add_argument(
+        "--process-monitor",
+        choices=["netlink", "inotify", "poll"],
+        default="netlink",
+        help=(
+            "How python processes being started are noticed: netlink proc "
+            "connector events (needs CAP_NET_ADMIN), inotify on libpython "
+            "(needs pyinotify) or polling from status pages. Unavailable "
+            "monitors fall back to the next ones (default netlink)"
+        ),
+    )
+    parser.add_argument(
+        "--rescan-window",
+        type=float,
+        default=1,
+        help=(
+            "Minimum seconds between two full process rescans asked by the "
+            "inotify monitor, requests in between are merged (default 1)"
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        help=(
+            "Directory where the libpython files found and the last PyPI "
+            f"version are cached between restarts (default {CACHE_DIR})"
+        ),
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help=(
+            "Never check PyPI for a new version, also set by the "
+            f"{OFFLINE_ENV} environment variable (default False)"
+        ),
+    )
+    parser.add_argument(
+        "--version-check-ttl",
+        type=float,
+        default=86400,
+        help=(
+            "Seconds the last version found on PyPI is cached in "
+            "--cache-dir before checking again (default 86400)"
+        ),
+    )
+    parser.add_argument(
+        "--precompress",
+        action="store_true",
+        help=(
+            "Generate the missing gzip and brotli variants of the static "
+            "assets on startup, in a writable checkout. Packages built with "
+            "setup.py ship them already (default False)"
+        ),
     )
     args = parser.parse_args()
 
@@ -78,20 +322,49 @@ def main() -> None:
 
     uvloop.install()
 
-    services = (
+    options = ()
+    if args.socket_rcvbuf:
+        options = ((socket.SOL_SOCKET, socket.SO_RCVBUF, args.socket_rcvbuf),)
+
+    if args.buffered_protocol:
+        socket_service = partial(
+            WDBBufferedTCPService, buffer_size=args.socket_buffer_size
+        )
+    else:
+        socket_service = WDBTCPService
+
+    services = [
         WDBService(
             address=args.server_host,
             port=args.server_port,
             **vars(args),
-        ),
-        WDBTCPService(address=args.socket_host, port=args.socket_port),
-    )
+        )
+    ]
+    if args.socket_port:
+        services.append(
+            socket_service(
+                address=args.socket_host,
+                port=args.socket_port,
+                options=options,
+            )
+        )
+    if args.socket_path:
+        services.append(
+            socket_service(sock=bind_unix_socket(args.socket_path, options))
+        )
+    if len(services) == 1:
+        parser.error("--socket-port 0 requires a --socket-path")
 
-    with entrypoint(*services) as loop:
-        try:
-            loop.run_forever()
-        except KeyboardInterrupt:
-            print("Received exit, exiting")
+    try:
+        with entrypoint(*services) as loop:
+            try:
+                loop.run_forever()
+            except KeyboardInterrupt:
+                print("Received exit, exiting")
+    finally:
+        if args.socket_path:
+            with suppress(FileNotFoundError):
+                os.unlink(args.socket_path)
 
 
 if __name__ == "__main__":
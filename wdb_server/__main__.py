@@ -1,5 +1,10 @@
 # Stdlib:
 import asyncio
+import os
+import socket
+import stat
+from contextlib import suppress
+from functools import partial
 
 # Aiohttp:
 from aiohttp import web
@@ -7,12 +12,39 @@ from aiohttp import web
 # Thirdparty:
 from aiomisc.service import TCPServer
 from aiomisc.service.aiohttp import AIOHTTPService
+from aiomisc.utils import OptionsType
 
 # Firstparty:
 from wdb_server.app import init_app
+from wdb_server.utils.protocol import WDBProtocol
 from wdb_server.utils.streams import handle_tcp_connection
 
 
+def bind_unix_socket(path: str, options: OptionsType = ()) -> socket.socket:
+    """
+    Bind a Unix domain socket for wdb instances on the same host.
+
+    A socket file left over by a server which did not exit cleanly is
+    replaced, one still accepting connections is not.
+    """
+    with suppress(FileNotFoundError):
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                except ConnectionRefusedError:
+                    os.unlink(path)
+                else:
+                    raise RuntimeError(f"{path} is already in use")
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    for level, option, value in options:
+        sock.setsockopt(level, option, value)
+    sock.bind(path)
+    sock.setblocking(False)
+    return sock
+
+
 # pylint: disable=too-few-public-methods
 class WDBService(AIOHTTPService):
     """
@@ -25,6 +57,28 @@ class WDBService(AIOHTTPService):
         "more",
         "detached_session",
         "show_filename",
+        "write_high_water",
+        "max_frame_size",
+        "stream_threshold",
+        "send_queue_size",
+        "send_queue_policy",
+        "compression_level",
+        "compression_threshold",
+        "max_sessions",
+        "accept_rate",
+        "admission_queue_size",
+        "admission_timeout",
+        "broadcast_concurrency",
+        "broadcast_timeout",
+        "status_window",
+        "process_scan_interval",
+        "process_change_threshold",
+        "process_monitor",
+        "rescan_window",
+        "cache_dir",
+        "offline",
+        "version_check_ttl",
+        "precompress",
     )
 
     # pylint: disable=missing-function-docstring
@@ -45,3 +99,20 @@ class WDBTCPService(TCPServer):
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ) -> None:
         await handle_tcp_connection(reader, writer)
+
+
+# pylint: disable=too-few-public-methods
+class WDBBufferedTCPService(WDBTCPService):
+    """
+    WDB tcp service parsing frames with a zero-copy buffered protocol
+    """
+
+    __required__ = ("buffer_size",)
+
+    buffer_size: int
+
+    async def start(self) -> None:
+        self.socket = self.make_socket()
+        self.server = await self.loop.create_server(
+            partial(WDBProtocol, self.buffer_size), sock=self.socket
+        )
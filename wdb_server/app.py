@@ -1,9 +1,12 @@
 # Stdlib:
+import asyncio
 import logging
+import os
 import sys
+import time
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Optional
 
 # Aiohttp:
 from aiohttp import ClientSession, ServerTimeoutError, web
@@ -14,10 +17,23 @@ import jinja2
 
 # Firstparty:
 import wdb_server
-from wdb_server.constants import MDL_THEMES_DIR, PROJECT_DIR
+from wdb_server.constants import (
+    ASSETS_REFRESH,
+    MDL_THEMES_DIR,
+    OFFLINE_ENV,
+    PROJECT_DIR,
+    SOURCE_CHECKOUT,
+)
 from wdb_server.routes import init_routes
+from wdb_server.utils.assets import Manifest, precompress
+from wdb_server.utils.cache import read_json, write_json
 from wdb_server.utils.state import settings as settings_store
-from wdb_server.utils.technical import LibPythonWatcher
+from wdb_server.utils.technical import refresh_metrics, start_process_monitor
+
+log = logging.getLogger("wdb_server")
+
+# What is set instead of the version from PYPI when checking it failed
+PYPI_ERRORS = ("pypi_error", "parsing_error", "unknown_error")
 
 
 def get_mdl_themes() -> Dict[str, Path]:
@@ -57,9 +73,23 @@ def init_themes(app: web.Application) -> None:
     }
 
 
+def set_versions(app: web.Application, pypi_version: Any) -> None:
+    """
+    Set the current version and the one from PYPI, telling if it is new
+    """
+    app["version"] = wdb_server.__version__
+    app["pypi_version"] = pypi_version
+    new_version = False
+    if app["pypi_version"] not in (None, *PYPI_ERRORS, app["version"]):
+        new_version = app["pypi_version"]
+    app["new_version"] = new_version
+
+
 async def init_versions(app: web.Application) -> None:
     """
     Initialize current version and version from PYPI
+
+    A failed check keeps the version found by the last successful one.
     """
     async with ClientSession(timeout=1) as session:
         try:
@@ -68,23 +98,63 @@ async def init_versions(app: web.Application) -> None:
             ) as resp:
                 info = await resp.json()
                 pypi_version = info["info"]["version"]
-                app["pypi_version"] = pypi_version
         except ServerTimeoutError:
-            app["pypi_version"] = "pypi_error"
+            pypi_version = "pypi_error"
         except JSONDecodeError:
-            app["pypi_version"] = "parsing_error"
+            pypi_version = "parsing_error"
         except Exception:  # pylint: disable=broad-except
-            app["pypi_version"] = "unknown_error"
-    app["version"] = wdb_server.__version__
-    new_version = False
-    if app["pypi_version"] not in (
-        "pypi_error",
-        "parsing_error",
-        "unknown_error",
-        app["version"],
+            pypi_version = "unknown_error"
+    if pypi_version in PYPI_ERRORS:
+        if app.get("pypi_version") not in (None, *PYPI_ERRORS):
+            log.info("Checking PYPI failed: %s", pypi_version)
+            return
+    else:
+        await asyncio.get_running_loop().run_in_executor(
+            None,
+            write_json,
+            pypi_cache_path(),
+            {"version": pypi_version, "checked": time.time()},
+        )
+    set_versions(app, pypi_version)
+
+
+def pypi_cache_path() -> str:
+    """
+    Path of the cache of the last version found on PYPI
+    """
+    return os.path.join(settings_store.cache_dir, "pypi.json")
+
+
+def load_versions(app: web.Application) -> Optional[float]:
+    """
+    Initialize the versions from the last PYPI check, and return when it
+    was made, without waiting on the network
+    """
+    cached = read_json(pypi_cache_path())
+    if not isinstance(cached, dict) or "version" not in cached:
+        set_versions(app, None)
+        return None
+    set_versions(app, cached["version"])
+    return cached.get("checked")
+
+
+async def version_check(app: web.Application) -> AsyncIterator[None]:
+    """
+    Check PYPI for a new version in the background while the application
+    runs, unless offline or checked less than version_check_ttl ago
+    """
+    checked = load_versions(app)
+    task = None
+    if settings_store.offline or os.environ.get(OFFLINE_ENV):
+        log.debug("Offline, not checking PYPI for a new version")
+    elif (
+        checked is None
+        or time.time() - checked >= settings_store.version_check_ttl
     ):
-        new_version = app["pypi_version"]
-    app["new_version"] = new_version
+        task = asyncio.ensure_future(init_versions(app))
+    yield
+    if task is not None:
+        task.cancel()
 
 
 def init_jinja2(app: web.Application) -> None:
@@ -101,26 +171,123 @@ def init_jinja2(app: web.Application) -> None:
         default_helpers=True,
     )
     app["static_root_url"] = "/static"
+    app["assets"] = Manifest(
+        PROJECT_DIR / "static", packaged=not SOURCE_CHECKOUT
+    )
     env = aiohttp_jinja2.get_env(app)
-    env.globals.update(themes=app["themes"].keys())
+    env.globals.update(themes=app["themes"].keys(), asset=asset)
 
 
-async def init_app(settings: Dict[str, Any]) -> web.Application:
+@jinja2.pass_context
+def asset(context: Dict[str, Any], filename: str) -> str:
     """
-    This function will create an application instance
+    URL of a static asset, which changes with its content
     """
-    if LibPythonWatcher:  # pragma: no cover
-        LibPythonWatcher(
-            sys.base_prefix if settings["extra_search_path"] else None
+    app = context["app"]
+    return str(
+        app.router["static"].url_for(filename=app["assets"].hashed(filename))
+    )
+
+
+async def hash_assets(app: web.Application) -> AsyncIterator[None]:
+    """
+    Hash the static assets of a checkout in the background while the
+    application runs, and again as they are rebuilt.
+    """
+    task = None
+    if not app["assets"].packaged:
+        task = asyncio.ensure_future(refresh_assets(app["assets"]))
+    yield
+    if task is not None:
+        task.cancel()
+
+
+async def refresh_assets(assets: Manifest) -> None:
+    """
+    Hash the added or changed static assets every ASSETS_REFRESH seconds.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            hashed = await loop.run_in_executor(None, assets.refresh)
+        except OSError:
+            log.warning("Cannot hash the static assets", exc_info=True)
+        else:
+            if hashed:
+                log.debug("Hashed %d static assets", hashed)
+        await asyncio.sleep(ASSETS_REFRESH)
+
+
+async def precompress_static(app: web.Application) -> AsyncIterator[None]:
+    """
+    Generate the missing precompressed variants of the static assets in the
+    background, when asked to. Packages get them at build time, in their
+    build_py step, rather than writing to an installed package.
+    """
+    task = None
+    if app["settings"].precompress:
+        task = asyncio.ensure_future(
+            asyncio.get_running_loop().run_in_executor(
+                None, precompress, app["assets"].root
+            )
         )
+        task.add_done_callback(precompressed)
+    yield
+    if task is not None:
+        task.cancel()
 
+
+def precompressed(task: "asyncio.Future[int]") -> None:
+    """
+    Log the outcome of precompress_static.
+    """
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        log.warning(
+            "Cannot precompress the static assets", exc_info=task.exception()
+        )
+    else:
+        log.debug("Precompressed %d static assets", task.result())
+
+
+async def process_monitor(app: web.Application) -> AsyncIterator[None]:
+    """
+    Watch python processes being started while the application runs.
+
+    Status pages do not poll the process table then, it is refreshed for
+    them in the background.
+    """
+    app["process_monitor"] = start_process_monitor(
+        app["settings"].process_monitor,
+        sys.base_prefix if app["settings"].extra_search_path else None,
+    )
+    refresher = None
+    if app["process_monitor"]:
+        refresher = asyncio.ensure_future(refresh_metrics())
+    yield
+    if refresher is not None:
+        refresher.cancel()
+    if app["process_monitor"]:
+        app["process_monitor"].close()
+
+
+async def init_app(settings: Dict[str, Any]) -> web.Application:
+    """
+    This function will create an application instance
+    """
     app = web.Application()
 
     settings_store.update(**settings)
     app["settings"] = settings_store
+    app.cleanup_ctx.append(process_monitor)
+
+    app.cleanup_ctx.append(version_check)
+    app.cleanup_ctx.append(precompress_static)
+    app.cleanup_ctx.append(hash_assets)
 
     logging.basicConfig(level=logging.DEBUG)
-    await init_versions(app)
+    load_versions(app)
     init_themes(app)
     init_jinja2(app)
     init_routes(app)
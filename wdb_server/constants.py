@@ -1,4 +1,5 @@
 # Stdlib:
+import os
 import pathlib
 
 PROJECT_DIR = pathlib.Path(__file__).parent
@@ -8,3 +9,27 @@ UUID_REGEXP = (
     "[a-f0-9]{8}-[a-f0-9]{4}-[1-5][a-f0-9]{3}-[89ab][a-f0-9]{3}-[a-f0-9]{12}"
 )
 UNKNOWN_UUID = "UNKNOWN_UUID"
+# Size of the chunks large frames are relayed to the browser in
+STREAM_CHUNK_SIZE = 2**16
+# Length header bit set on zlib compressed frames, once negotiated
+COMPRESSED_FLAG = 1 << 30
+# Seconds a refused connection is kept open for its peer to read why
+REJECTION_LINGER = 5
+# Fields identifying a wdb breakpoint
+BREAKPOINT_IDENTITY = ("fn", "lno", "cond", "fun")
+# Breakpoints changes kept to answer "changes since version" requests
+BREAKPOINTS_HISTORY = 1024
+# Where the server caches what it found between restarts
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "wdb_server",
+)
+# Set to skip every network access, such as the check for a new version
+OFFLINE_ENV = "WDB_SERVER_OFFLINE"
+# Cache-Control of the static assets requested by their hashed name
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Running from a source checkout, where the static assets are rebuilt
+# without reinstalling, rather than from a package
+SOURCE_CHECKOUT = (PROJECT_DIR.parent / "setup.py").exists()
+# Seconds between the checks for rebuilt static assets in a checkout
+ASSETS_REFRESH = 2
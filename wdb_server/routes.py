@@ -2,11 +2,12 @@
 from aiohttp import web
 
 # Firstparty:
-from wdb_server.constants import PROJECT_DIR, UUID_REGEXP
+from wdb_server.constants import UUID_REGEXP
 from wdb_server.views import (
     DebugHandler,
     HomeHandler,
     MainHandler,
+    StaticHandler,
     SyncWebSocketHandler,
     WebSocketHandler,
 )
@@ -31,9 +32,4 @@ def init_routes(app: web.Application) -> None:
     )
     add_route("*", r"/status", SyncWebSocketHandler, name="status")
 
-    # added static dir
-    app.router.add_static(
-        "/static/",
-        path=(PROJECT_DIR / "static"),
-        name="static",
-    )
+    add_route("*", r"/static/{filename:(.+)}", StaticHandler, name="static")
@@ -0,0 +1,171 @@
+# Stdlib:
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional
+
+# Firstparty:
+from wdb_server.utils.state import Message, settings
+
+
+class AdmissionError(ConnectionRefusedError):
+    """
+    A wdb instance was refused a debugging session.
+    """
+
+    def frame(self) -> bytes:
+        """
+        Frame telling the wdb instance why it was refused, sent before its
+        connection is closed.
+        """
+        return Message("Die", {"reason": f"wdb server busy: {self}"}).frame()
+
+
+class Admission:
+    """
+    Admission control of the wdb instances connecting to the server.
+
+    Sessions are admitted while fewer than settings.max_sessions are active
+    and at most settings.accept_rate per second, with bursts of as many.
+    Connections over these limits wait their turn in a FIFO queue of
+    settings.admission_queue_size places for settings.admission_timeout
+    seconds at most, so a storm of crashing processes is spread over time
+    instead of hitting the server all at once. A limit of 0 disables it.
+    """
+
+    __slots__ = ["_active", "_waiting", "_tokens", "_updated"]
+
+    def __init__(self) -> None:
+        self._active: int = 0
+        # One event per waiting connection, set when it may be admitted
+        self._waiting: Deque[asyncio.Event] = deque()
+        self._tokens: float = 0
+        self._updated: Optional[float] = None
+
+    @property
+    def active(self) -> int:
+        """Number of admitted sessions."""
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        """Number of connections waiting for admission."""
+        return len(self._waiting)
+
+    def _full(self) -> bool:
+        return 0 < settings.max_sessions <= self._active
+
+    def _admit_now(self) -> bool:
+        """
+        Admit a session right away if nobody waits and the limits allow it.
+        """
+        if self._waiting or self._full() or self._take_token():
+            return False
+        self._active += 1
+        return True
+
+    def _take_token(self) -> float:
+        """
+        Take an accept token, or tell how long until the next one.
+        """
+        rate = settings.accept_rate
+        if not rate:
+            return 0
+        burst = max(rate, 1)
+        now = time.monotonic()
+        if self._updated is None:
+            self._tokens = burst
+        else:
+            self._tokens = min(
+                burst, self._tokens + (now - self._updated) * rate
+            )
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / rate
+
+    async def acquire(self) -> None:
+        """
+        Wait until a new session is admitted.
+
+        Raise AdmissionError when the admission queue is full or when the
+        connection waited too long in it.
+        """
+        if self._admit_now():
+            return
+        if len(self._waiting) >= settings.admission_queue_size:
+            raise AdmissionError(
+                f"{self._active} sessions active and {len(self._waiting)} "
+                "waiting, admission queue full"
+            )
+
+        turn = asyncio.Event()
+        self._waiting.append(turn)
+        deadline = time.monotonic() + settings.admission_timeout
+        try:
+            while True:
+                delay = None
+                if self._waiting[0] is turn and not self._full():
+                    delay = self._take_token()
+                    if not delay:
+                        break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise AdmissionError(
+                        f"not admitted within {settings.admission_timeout}s "
+                        f"with {self._active} sessions active"
+                    )
+                turn.clear()
+                try:
+                    await asyncio.wait_for(
+                        turn.wait(), min(timeout, delay or timeout)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiting.remove(turn)
+            self._wake_next()
+        self._active += 1
+
+    async def admit(self, lost: Callable[[], Awaitable[None]]) -> bool:
+        """
+        Wait until a new session is admitted, like acquire, or until lost()
+        is done, when the connection waiting for it is lost.
+
+        A connection lost meanwhile gives its place in the queue up at once
+        instead of at its timeout. Return whether the session was admitted.
+        """
+        if self._admit_now():
+            return True
+        acquire = asyncio.ensure_future(self.acquire())
+        watcher = asyncio.ensure_future(lost())
+        try:
+            await asyncio.wait(
+                (acquire, watcher), return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            watcher.cancel()
+            if not acquire.done():
+                acquire.cancel()
+                # Out of the queue before returning
+                await asyncio.wait((acquire,))
+        if acquire.cancelled():
+            return False
+        # Raises AdmissionError when refused
+        acquire.result()
+        return True
+
+    def release(self) -> None:
+        """
+        End an admitted session, letting the next connection in.
+        """
+        self._active -= 1
+        self._wake_next()
+
+    def _wake_next(self) -> None:
+        if self._waiting:
+            self._waiting[0].set()
+
+
+admission = Admission()
@@ -0,0 +1,281 @@
+"""
+Precompressed variants and content hashes of the static assets.
+
+The text assets get .gz and, when the brotli module is installed, .br
+siblings ahead of time, so that they are served compressed without any
+compression work at request time. The content hash of every asset is
+written to a manifest, so that their URLs change with their content and
+can be cached forever. Both are generated by the build_py step of
+setup.py, which runs:
+
+    python -m wdb_server.utils.assets [static directory]
+"""
+# Stdlib:
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+# Firstparty:
+from wdb_server.utils.cache import read_json
+
+log = logging.getLogger("wdb_server")
+
+try:
+    # Thirdparty:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Extensions of the assets worth compressing
+COMPRESSIBLE = (".css", ".js", ".map", ".svg", ".json", ".txt", ".ico")
+# Smaller assets are not worth a variant, nor the extra stat to find it
+MIN_SIZE = 256
+# Encodings of the variants, by suffix, in the order they are preferred
+ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+# Content hashes of the assets, by name relative to the static directory
+MANIFEST = "manifest.json"
+HASH_LENGTH = 16
+# Hashed asset name: the content hash goes before the extension
+HASHED = re.compile(rf"^(.+)\.([0-9a-f]{{{HASH_LENGTH}}})(\.[^.]+)?$")
+
+
+def compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """
+    Compression of the variants which can be generated, by suffix.
+    """
+    found: Dict[str, Callable[[bytes], bytes]] = {
+        # No timestamp in the header, so variants are reproducible
+        ".gz": lambda data: gzip.compress(data, 9, mtime=0),
+    }
+    if brotli is not None:  # pragma: no cover
+        found[".br"] = lambda data: brotli.compress(data, quality=11)
+    return found
+
+
+def write_asset(path: Path, data: bytes, mode: int) -> None:
+    """
+    Write an asset at once, so that it is never served half written.
+    """
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        file.write(data)
+    # Readable by whoever can read the asset, not only by its writer
+    os.chmod(file.name, mode)
+    os.replace(file.name, path)
+
+
+def precompress(root: Path) -> int:
+    """
+    Generate the missing or outdated variants of the assets under root.
+
+    A variant only is kept when it is smaller than its asset. Return the
+    number of variants written.
+    """
+    written = 0
+    compress = compressors()
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = Path(directory, name)
+            stat = path.stat()
+            if stat.st_size < MIN_SIZE:
+                continue
+            data = None
+            for suffix, compressor in compress.items():
+                variant = path.with_name(name + suffix)
+                try:
+                    if variant.stat().st_mtime >= stat.st_mtime:
+                        continue
+                except FileNotFoundError:
+                    pass
+                if data is None:
+                    data = path.read_bytes()
+                compressed = compressor(data)
+                if len(compressed) < len(data):
+                    write_asset(variant, compressed, stat.st_mode & 0o777)
+                    written += 1
+    return written
+
+
+def accepted_encodings(header: str) -> Set[str]:
+    """
+    Content codings of an Accept-Encoding header, without refused ones.
+    """
+    accepted = set()
+    for coding in header.split(","):
+        name, _, params = coding.partition(";")
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def negotiate(path: Path, accept_encoding: str) -> Tuple[Path, Optional[str]]:
+    """
+    Variant of the asset at path to serve for an Accept-Encoding header.
+
+    Return the path of the best precompressed variant the client accepts
+    along with its content coding, or the asset itself and None.
+    """
+    accepted = accepted_encodings(accept_encoding)
+    for suffix, encoding in ENCODINGS:
+        if encoding in accepted or "*" in accepted:
+            variant = path.with_name(path.name + suffix)
+            if variant.is_file():
+                return variant, encoding
+    return path, None
+
+
+def content_hash(path: Path) -> str:
+    """
+    Hash of the content of the asset at path.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as asset:
+        for chunk in iter(lambda: asset.read(65536), b""):
+            sha.update(chunk)
+    return sha.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(name: str, hash_: str) -> str:
+    """
+    Name of an asset with its content hash, before its extension.
+    """
+    directory, slash, base = name.rpartition("/")
+    stem, dot, extension = base.rpartition(".")
+    if dot and stem:
+        base = f"{stem}.{hash_}.{extension}"
+    else:
+        base = f"{base}.{hash_}"
+    return f"{directory}{slash}{base}"
+
+
+def walk_assets(root: Path) -> Iterator[Tuple[str, Path]]:
+    """
+    Assets under root, by name relative to it, without their variants.
+    """
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name == MANIFEST or name.endswith((".gz", ".br")):
+                continue
+            path = Path(directory, name)
+            yield path.relative_to(root).as_posix(), path
+
+
+def build_manifest(root: Path) -> Dict[str, str]:
+    """
+    Content hashes of the assets under root, by name relative to it.
+    """
+    return {name: content_hash(path) for name, path in walk_assets(root)}
+
+
+class Manifest:
+    """
+    Content hashed names of the assets under root.
+
+    A packaged install has the manifest written by its build, and its
+    assets only change along with it. Otherwise, as in a checkout where
+    the bundles are rebuilt, the manifest is ignored and the assets are
+    hashed by refresh, outside of the requests: those changed since are
+    never served as immutable under their former hashed name.
+    """
+
+    __slots__ = ["root", "packaged", "_hashes", "_versions"]
+
+    def __init__(self, root: Path, packaged: bool = True) -> None:
+        self.root = root
+        hashes = read_json(str(root / MANIFEST)) if packaged else None
+        self.packaged = isinstance(hashes, dict)
+        self._hashes: Dict[str, str] = (
+            hashes if isinstance(hashes, dict) else {}
+        )
+        # Modification time and size of the assets when refresh hashed them
+        self._versions: Dict[str, Tuple[int, int]] = {}
+
+    def refresh(self) -> int:
+        """
+        Hash the assets added or changed since the last refresh, unless
+        packaged. Return the number of assets hashed.
+        """
+        if self.packaged:
+            return 0
+        hashes, versions = {}, {}
+        for name, path in walk_assets(self.root):
+            try:
+                stat = path.stat()
+                version = stat.st_mtime_ns, stat.st_size
+                if self._versions.get(name) == version:
+                    hashes[name] = self._hashes[name]
+                else:
+                    hashes[name] = content_hash(path)
+            except OSError:
+                # Removed meanwhile
+                continue
+            versions[name] = version
+        hashed = sum(
+            self._versions.get(name) != version
+            for name, version in versions.items()
+        )
+        # Replaced at once, as they are read from the event loop
+        self._hashes, self._versions = hashes, versions
+        return hashed
+
+    def hash(self, name: str) -> Optional[str]:
+        """
+        Content hash of the asset name, None if it is not known.
+        """
+        return self._hashes.get(name)
+
+    def hashed(self, name: str) -> str:
+        """
+        Hashed name of the asset name, or name if it is not known.
+        """
+        hash_ = self.hash(name)
+        return name if hash_ is None else hashed_name(name, hash_)
+
+    def resolve(self, name: str) -> Tuple[str, bool]:
+        """
+        Asset requested with name and whether name is its current hashed
+        name, which never serves another content.
+        """
+        directory, slash, base = name.rpartition("/")
+        match = HASHED.match(base)
+        if match is None or (self.root / name).exists():
+            return name, False
+        stem, hash_, extension = match.groups()
+        name = f"{directory}{slash}{stem}{extension or ''}"
+        if self.hash(name) != hash_:
+            return name, False
+        if self.packaged:
+            return name, True
+        try:
+            stat = (self.root / name).stat()
+        except OSError:
+            return name, False
+        # Changed since hashed, and not hashed again yet
+        return name, self._versions[name] == (stat.st_mtime_ns, stat.st_size)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    from wdb_server.constants import PROJECT_DIR  # isort:skip
+
+    logging.basicConfig(level=logging.INFO)
+    static = Path(sys.argv[1]) if len(sys.argv) > 1 else PROJECT_DIR / "static"
+    log.info("Wrote %d variants in %s", precompress(static), static)
+    manifest = build_manifest(static)
+    write_asset(
+        static / MANIFEST, json.dumps(manifest, sort_keys=True).encode(), 0o644
+    )
+    log.info("Wrote the hashes of %d assets in %s", len(manifest), static)
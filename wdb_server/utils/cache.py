@@ -0,0 +1,36 @@
+# Stdlib:
+import json
+import logging
+import os
+import tempfile
+from typing import Any
+
+log = logging.getLogger("wdb_server")
+
+
+def read_json(path: str) -> Any:
+    """
+    Read a json cache file, None when it is missing or corrupted.
+    """
+    try:
+        with open(path, encoding="utf-8") as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: str, content: Any) -> None:
+    """
+    Write a json cache file, logging rather than raising on failure.
+    """
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Replaced at once, so that a concurrent read never sees half
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=directory, delete=False
+        ) as cache:
+            json.dump(content, cache)
+        os.replace(cache.name, path)
+    except OSError:
+        log.warning("Cannot write %s", path, exc_info=True)
@@ -0,0 +1,308 @@
+# Stdlib:
+import asyncio
+import errno
+import logging
+import os
+import pwd
+import socket
+import sys
+import time
+from struct import Struct
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+log = logging.getLogger("wdb_server")
+
+# Fields of /proc/<pid>/stat, counted from the state which follows the
+# parenthesized command name
+STAT_STATE = 0
+STAT_UTIME = 11
+STAT_STIME = 12
+STAT_NUM_THREADS = 17
+STAT_STARTTIME = 19
+STAT_RSS = 21
+
+# Netlink proc connector, see linux/connector.h and linux/cn_proc.h
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+# struct nlmsghdr, struct cn_msg and the head of struct proc_event
+NLMSGHDR = Struct("=IHHII")
+CN_MSG = Struct("=IIIIHH")
+PROC_EVENT = Struct("=IIQ")
+# Pids of the fork (parent pid and tgid, child pid and tgid), exec and exit
+# events (pid and tgid)
+PROC_EVENT_PIDS = Struct("=IIII")
+PROC_EVENT_PID = Struct("=II")
+
+
+def read(path: str) -> bytes:
+    """
+    Read a whole /proc file, without the cost of a python file object.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks: List[bytes] = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+
+class ProcfsScanner:
+    """
+    Linux scanner of the running python processes reading /proc directly.
+
+    It gives the same process information as technical.scan_processes,
+    which relies on psutil, for a fraction of the cost: the command line of
+    every process is read first, and only the python ones get their stat
+    and status read. User names are looked up once per uid.
+    """
+
+    __slots__ = [
+        "root",
+        "_clock_ticks",
+        "_page_size",
+        "_boot_time",
+        "_memory",
+        "_users",
+        "_samples",
+    ]
+
+    def __init__(self, root: str = "/proc") -> None:
+        self.root = root
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._boot_time: Optional[float] = None
+        self._memory: Optional[int] = None
+        self._users: Dict[int, str] = {}
+        # Cpu time and wall time by pid and start time, for cpu usage
+        self._samples: Dict[Tuple[int, int], Tuple[float, float]] = {}
+
+    @classmethod
+    def available(cls) -> bool:
+        """Tell if /proc can be scanned on this platform."""
+        return sys.platform.startswith("linux") and os.path.exists(
+            "/proc/self/stat"
+        )
+
+    def boot_time(self) -> float:
+        """Time the system booted at, as a timestamp."""
+        if self._boot_time is None:
+            with open(os.path.join(self.root, "stat"), "rb") as stat:
+                for line in stat:
+                    if line.startswith(b"btime"):
+                        self._boot_time = float(line.split()[1])
+                        break
+                else:
+                    raise OSError(f"No btime in {self.root}/stat")
+        return self._boot_time
+
+    def memory(self) -> int:
+        """Total memory in bytes."""
+        if self._memory is None:
+            with open(os.path.join(self.root, "meminfo"), "rb") as meminfo:
+                for line in meminfo:
+                    if line.startswith(b"MemTotal:"):
+                        self._memory = int(line.split()[1]) * 1024
+                        break
+                else:
+                    raise OSError(f"No MemTotal in {self.root}/meminfo")
+        return self._memory
+
+    def username(self, uid: int) -> str:
+        """Name of the user uid, or the uid if it has none."""
+        if uid not in self._users:
+            try:
+                self._users[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self._users[uid] = str(uid)
+        return self._users[uid]
+
+    def scan(
+        self, pids: Optional[Iterable[int]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Scan the running python processes, or only those among pids.
+        """
+        processes = []
+        if pids is None:
+            entries = os.listdir(self.root)
+            samples: Dict[Tuple[int, int], Tuple[float, float]] = {}
+        else:
+            entries = [str(pid) for pid in pids]
+            samples = self._samples
+        now = time.monotonic()
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            path = f"{self.root}/{entry}"
+            try:
+                cl = read(f"{path}/cmdline").rstrip(b"\0").split(b"\0")
+                binary = cl[0].rsplit(b"/", 1)[-1]
+                if b"python" not in binary and b"pypy" not in binary:
+                    continue
+                fields = read(f"{path}/stat").rsplit(b")", 1)[1].split()
+                if fields[STAT_STATE] == b"Z":
+                    continue
+                status = read(f"{path}/status")
+                uid = int(status[status.index(b"\nUid:") + 5 :].split()[0])
+            except (OSError, ValueError):
+                # Gone, not ours to read or not a process
+                continue
+
+            pid = int(entry)
+            start = int(fields[STAT_STARTTIME])
+            cpu_time = (
+                int(fields[STAT_UTIME]) + int(fields[STAT_STIME])
+            ) / self._clock_ticks
+            cpu = 0.0
+            if (pid, start) in self._samples:
+                last_cpu_time, last_now = self._samples[pid, start]
+                if now > last_now:
+                    cpu = (cpu_time - last_cpu_time) / (now - last_now) * 100
+            samples[pid, start] = cpu_time, now
+            processes.append(
+                {
+                    "pid": pid,
+                    "user": self.username(uid),
+                    "cmd": " ".join(
+                        part.decode("utf-8", "replace") for part in cl
+                    ),
+                    "threads": int(fields[STAT_NUM_THREADS]),
+                    "time": self.boot_time() + start / self._clock_ticks,
+                    "mem": int(fields[STAT_RSS])
+                    * self._page_size
+                    / self.memory()
+                    * 100,
+                    "cpu": cpu,
+                }
+            )
+        # After a full scan, only keep the samples of processes still running
+        self._samples = samples
+        return processes
+
+
+def parse_proc_events(data: bytes) -> Iterator[Tuple[int, bool]]:
+    """
+    Processes started or exited in a datagram of the proc connector.
+
+    Yield the pid and whether the process started, from the new processes
+    of fork events and from exec events, or exited, from exit events.
+    Threads are ignored.
+    """
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, kind = NLMSGHDR.unpack_from(data, offset)[:2]
+        if length < NLMSGHDR.size:
+            break
+        if kind == NLMSG_DONE:
+            event = offset + NLMSGHDR.size + CN_MSG.size
+            what = PROC_EVENT.unpack_from(data, event)[0]
+            event += PROC_EVENT.size
+            if what == PROC_EVENT_FORK:
+                pid, tgid = PROC_EVENT_PIDS.unpack_from(data, event)[2:]
+                if pid == tgid:
+                    yield pid, True
+            elif what in (PROC_EVENT_EXEC, PROC_EVENT_EXIT):
+                pid, tgid = PROC_EVENT_PID.unpack_from(data, event)
+                if pid == tgid:
+                    yield pid, what == PROC_EVENT_EXEC
+        # Netlink messages are 4 bytes aligned
+        offset += (length + 3) & ~3
+
+
+class ProcConnector:
+    """
+    Listener of the processes started and exited on the system.
+
+    It subscribes to the proc connector of the linux kernel through netlink,
+    which requires CAP_NET_ADMIN: OSError is raised when it cannot. The
+    callback is called on the event loop with the pid of each process
+    started or exited, and whether it started. The overrun callback is
+    called instead when events were lost, so that they can be recovered
+    by a full scan.
+    """
+
+    __slots__ = ["_socket", "_callback", "_overrun"]
+
+    def __init__(
+        self,
+        callback: Callable[[int, bool], None],
+        overrun: Callable[[], None],
+    ) -> None:
+        self._callback = callback
+        self._overrun = overrun
+        self._socket = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR
+        )
+        try:
+            self._socket.bind((os.getpid(), CN_IDX_PROC))
+            self._subscribe(PROC_CN_MCAST_LISTEN)
+        except OSError:
+            self._socket.close()
+            raise
+        self._socket.setblocking(False)
+        asyncio.get_running_loop().add_reader(
+            self._socket.fileno(), self._read
+        )
+        log.debug("Listening to the proc connector")
+
+    def _subscribe(self, operation: int) -> None:
+        payload = operation.to_bytes(4, sys.byteorder)
+        message = (
+            CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0)
+            + payload
+        )
+        self._socket.send(
+            NLMSGHDR.pack(
+                NLMSGHDR.size + len(message), NLMSG_DONE, 0, 0, os.getpid()
+            )
+            + message
+        )
+
+    def _read(self) -> None:
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except BlockingIOError:
+                return
+            except OSError as error:
+                if error.errno != errno.ENOBUFS:
+                    log.warning("Proc connector failed", exc_info=True)
+                    return
+                # Events were dropped while the server was too busy to
+                # keep up, the next ones will still be received
+                log.warning("Proc connector overrun, events were lost")
+                self._overrun()
+                continue
+            for pid, started in parse_proc_events(data):
+                self._callback(pid, started)
+
+    def close(self) -> None:
+        """
+        Stop listening to the proc connector.
+        """
+        asyncio.get_running_loop().remove_reader(self._socket.fileno())
+        try:
+            self._subscribe(PROC_CN_MCAST_IGNORE)
+        except OSError:
+            pass
+        self._socket.close()
@@ -0,0 +1,277 @@
+# Stdlib:
+import asyncio
+import logging
+from typing import Any, Optional, Tuple
+
+# Firstparty:
+from wdb_server.constants import REJECTION_LINGER
+from wdb_server.utils.admission import AdmissionError, admission
+from wdb_server.utils.state import settings
+from wdb_server.utils.streams import (
+    HEADER,
+    FrameRelay,
+    IOStream,
+    TransportWriter,
+    assign_stream,
+    decompress,
+    is_large_frame,
+    parse_header,
+    peer_name,
+    read_frame,
+    relay_compressed,
+)
+
+log = logging.getLogger("wdb_server")
+
+
+class WDBProtocol(asyncio.BufferedProtocol):
+    """
+    Zero-copy protocol for debuggee connections.
+
+    Incoming data is received straight into a reusable buffer and frames are
+    handed to read_frame as memoryview slices of it. Reading is paused while
+    frames are dispatched, so the buffer is never overwritten under them.
+    Large frames are relayed in buffer sized chunks instead of growing it.
+    Invalid frames close the connection.
+    """
+
+    def __init__(self, buffer_size: int) -> None:
+        self._buffer_size: int = buffer_size
+        self._buffer: bytearray = bytearray(buffer_size)
+        self._view: memoryview = memoryview(self._buffer)
+        # Unprocessed data lives in self._buffer[self._start:self._end]
+        self._start: int = 0
+        self._end: int = 0
+        self._ready: asyncio.Event = asyncio.Event()
+        self._eof: bool = False
+        self._transport: Optional[asyncio.Transport] = None
+        self._writer: Optional[TransportWriter] = None
+        self._stream: Optional[IOStream] = None
+        self._uuid: Optional[str] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._relay: Optional[FrameRelay] = None
+        self._admitted: bool = False
+        # Set once refused, what is received is then dropped
+        self._rejected: bool = False
+
+    def connection_made(self, transport: Any) -> None:
+        self._transport = transport
+        self._writer = TransportWriter(transport)
+        self._stream = IOStream(None, self._writer)
+        self._task = asyncio.get_running_loop().create_task(self._process())
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._eof = True
+        self._ready.set()
+        if self._writer is not None:
+            self._writer.connection_lost()
+
+    def pause_writing(self) -> None:
+        if self._writer is not None:
+            self._writer.pause_writing()
+
+    def resume_writing(self) -> None:
+        if self._writer is not None:
+            self._writer.resume_writing()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._end == len(self._buffer):
+            self._grow()
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        assert self._transport is not None
+        if self._rejected:
+            self._end = 0
+            return
+        self._end += nbytes
+        try:
+            dispatchable = self._dispatchable()
+        except ValueError:
+            # Raised here, it would only reach the fatal error handler of
+            # the transport. Nothing before the invalid header is left to
+            # dispatch.
+            log.warning("Invalid frame for %s", self._uuid, exc_info=True)
+            self._start = self._end = 0
+            self._transport.close()
+            return
+        if dispatchable:
+            self._ready.set()
+        if self._admitted:
+            pause = dispatchable
+        else:
+            # Until the session is admitted, reading only stops once the
+            # buffer is full, so that the peer closing it is noticed
+            pause = self._end == len(self._buffer)
+        if pause:
+            self._transport.pause_reading()
+
+    def _header(self) -> Optional[Tuple[int, bool]]:
+        """
+        Length and compressed flag of the next frame if its header has been
+        received.
+        """
+        if self._end - self._start < HEADER.size:
+            return None
+        assert self._stream is not None
+        (header,) = HEADER.unpack_from(self._buffer, self._start)
+        if header < 0:
+            raise ValueError(f"Invalid frame length {header}")
+        if self._uuid is None and header != 36:
+            # Checked before anything is buffered for it
+            raise ValueError(f"Wrong uuid length {header}")
+        return parse_header(self._stream, header)
+
+    def _dispatchable(self) -> bool:
+        """
+        Whether enough data has been received to be dispatched.
+        """
+        available = self._end - self._start
+        if self._relay is not None:
+            # Relay chunks as big as the buffer allows
+            return available >= min(
+                self._relay.remaining, len(self._buffer) - self._start
+            )
+        header = self._header()
+        if header is None:
+            return False
+        length = header[0]
+        if self._uuid is not None and is_large_frame(length):
+            return True
+        return available >= HEADER.size + length
+
+    async def _dispatch(self) -> None:
+        """
+        Dispatch received frames as slices of the receive buffer.
+        """
+        assert self._stream is not None
+        while True:
+            if self._relay is not None:
+                size = min(self._end - self._start, self._relay.remaining)
+                if not size:
+                    return
+                self._start += size
+                await self._relay.feed(
+                    self._view[self._start - size : self._start]
+                )
+                if not self._relay.remaining:
+                    self._relay = None
+                continue
+
+            header = self._header()
+            if header is None:
+                return
+            length, compressed = header
+            if self._uuid is not None and is_large_frame(length):
+                self._start += HEADER.size
+                self._relay = FrameRelay(self._uuid, length, compressed)
+                await self._relay.start()
+                continue
+            start = self._start + HEADER.size
+            if self._end - start < length:
+                return
+            self._start = start + length
+            frame = self._view[start : self._start]
+            if self._uuid is None:
+                self._uuid = str(frame, "utf-8")
+                await assign_stream(self._stream, self._uuid)
+            elif compressed:
+                data = decompress(frame)
+                if data is None:
+                    await relay_compressed(self._uuid, frame)
+                else:
+                    await read_frame(self._stream, self._uuid, data)
+            else:
+                await read_frame(self._stream, self._uuid, frame)
+
+    def _grow(self) -> None:
+        """
+        Enlarge the buffer to hold a frame bigger than its current size.
+        """
+        # Larger frames are relayed rather than buffered whole
+        size = min(
+            2 * len(self._buffer),
+            HEADER.size
+            + min(settings.stream_threshold, settings.max_frame_size),
+        )
+        try:
+            header = self._header()
+        except ValueError:
+            # Closes the connection once received
+            header = None
+        if header is not None and not is_large_frame(header[0]):
+            size = max(size, self._start + HEADER.size + header[0])
+        buffer = bytearray(size)
+        buffer[: self._end] = self._view[: self._end]
+        self._buffer, self._view = buffer, memoryview(buffer)
+
+    def _compact(self) -> None:
+        """
+        Move the partially received frame to the start of the buffer.
+        """
+        pending = self._end - self._start
+        if len(self._buffer) > self._buffer_size >= pending:
+            # Shrink back after a frame which needed a bigger buffer
+            buffer = bytearray(self._buffer_size)
+            buffer[:pending] = self._view[self._start : self._end]
+            self._buffer, self._view = buffer, memoryview(buffer)
+        elif pending and self._start:
+            self._buffer[:pending] = bytes(self._view[self._start : self._end])
+        self._start, self._end = 0, pending
+
+    def _reject(self, error: AdmissionError) -> None:
+        """
+        Tell a refused wdb instance why, then close its connection.
+        """
+        assert self._transport is not None
+        self._transport.write(error.frame())
+        if self._transport.can_write_eof():
+            self._transport.write_eof()
+        # Closed with unread data, the connection would be reset and the
+        # frame possibly lost: what the peer sends is dropped until it
+        # closes it, the transport then closes too
+        self._rejected = True
+        self._start = self._end = 0
+        self._transport.resume_reading()
+        asyncio.get_running_loop().call_later(
+            REJECTION_LINGER, self._transport.close
+        )
+
+    async def _process(self) -> None:
+        """
+        Dispatch received frames until the connection is lost.
+        """
+        assert self._transport is not None and self._writer is not None
+        assert self._stream is not None
+        peer = peer_name(self._transport)
+        try:
+            admitted = await admission.admit(self._writer.wait_closed)
+        except AdmissionError as error:
+            log.warning("Rejected connection from %s: %s", peer, error)
+            self._reject(error)
+            return
+        if not admitted:
+            log.info("Connection from %s lost waiting for admission", peer)
+            return
+
+        log.info("Connection received from %s", peer)
+        self._admitted = True
+        # What was received meanwhile is dispatched first, with reading
+        # paused as for any frame
+        self._transport.pause_reading()
+        self._ready.set()
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                await self._dispatch()
+                if self._eof:
+                    break
+                self._compact()
+                self._transport.resume_reading()
+        except ValueError:
+            log.warning("Invalid frame for %s", self._uuid, exc_info=True)
+        finally:
+            log.warning("Closed stream for %s", self._uuid)
+            await self._stream.close()
+            admission.release()
@@ -1,11 +1,93 @@
 # Stdlib:
+import asyncio
 import json
 import logging
+import time
+import zlib
+from collections import deque
+from itertools import islice
 from struct import pack
-from typing import Any, Dict, List, Optional, Set, Union
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+# Firstparty:
+from wdb_server.constants import (
+    BREAKPOINT_IDENTITY,
+    BREAKPOINTS_HISTORY,
+    CACHE_DIR,
+    COMPRESSED_FLAG,
+)
 
 log = logging.getLogger("wdb_server")
 
+MessageData = Optional[Union[Dict[str, Any], List[Any], str]]
+
+
+class Message:
+    """
+    Message encoded once, however many sockets it is sent to.
+
+    The text is built on creation, the frames sent to TCP Sockets only when
+    first needed.
+    """
+
+    __slots__ = ["_text", "_frame", "_compressed_frame"]
+
+    def __init__(self, cmd: str, message: MessageData = None) -> None:
+        self._text: str = cmd + "|" + json.dumps(message) if message else cmd
+        self._frame: Optional[bytes] = None
+        self._compressed_frame: Optional[bytes] = None
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Message) and self._text == other.text
+
+    def __hash__(self) -> int:
+        return hash(self._text)
+
+    def __repr__(self) -> str:
+        return f"Message({self._text!r})"
+
+    @property
+    def text(self) -> str:
+        """Text of the message, as sent to WebSockets."""
+        return self._text
+
+    def frame(self, compression: bool = False) -> bytes:
+        """
+        Length-prefixed frame of the message, as sent to TCP Sockets.
+
+        With compression, messages over the threshold are zlib compressed
+        when it makes them smaller.
+        """
+        if self._frame is None:
+            encoded = self._text.encode("utf-8")
+            # Header and payload go out in a single write
+            self._frame = pack("!i", len(encoded)) + encoded
+        if not compression:
+            return self._frame
+        if self._compressed_frame is None:
+            self._compressed_frame = self._frame
+            size = len(self._frame) - 4
+            if size > settings.compression_threshold:
+                compressed = zlib.compress(
+                    memoryview(self._frame)[4:], settings.compression_level
+                )
+                if len(compressed) < size:
+                    self._compressed_frame = (
+                        pack("!i", len(compressed) | COMPRESSED_FLAG)
+                        + compressed
+                    )
+        return self._compressed_frame
+
 
 class BaseSockets:
     """
@@ -20,21 +102,21 @@ class BaseSockets:
     async def send(
         self,
         uuid: str,
-        data: str,
-        message: Optional[Union[Dict[str, Any], List[int], str]] = None,
+        data: Union[str, Message],
+        message: MessageData = None,
     ) -> None:
         """
         Send messsage to TCP/Web Socket by uuid.
         """
-        if message:
-            data = data + "|" + json.dumps(message)
+        if not isinstance(data, Message):
+            data = Message(data, message)
         sck = self.get(uuid)
         if sck is not None:
             await self._send(sck, data)
         else:
             log.warning("No socket found for %s", uuid)
 
-    async def _send(self, sck: Any, data: str) -> None:
+    async def _send(self, sck: Any, message: Message) -> None:
         raise NotImplementedError
 
     def get(self, uuid: str) -> Any:
@@ -43,23 +125,44 @@ class BaseSockets:
         """
         return self._sockets.get(uuid)
 
-    async def broadcast(
-        self,
-        cmd: str,
-        message: Optional[Union[Dict[str, Any], List[int], str]] = None,
-    ) -> None:
+    async def broadcast(self, cmd: str, message: MessageData = None) -> float:
         """
         Broadcast message to TCP/Web Socket.
+
+        The message is sent to at most settings.broadcast_concurrency
+        sockets at a time, and the ones failing or not done within
+        settings.broadcast_timeout seconds are evicted. Return how long
+        the broadcast took. The message is encoded once for all of them.
         """
-        for uuid in list(self._sockets.keys()):
-            try:
-                log.debug("Broadcast to socket %s", uuid)
-                await self.send(uuid, cmd, message)
-            except Exception:  # pylint: disable=broad-except
-                log.warning("Failed broadcast to socket %s", uuid)
+        start = time.monotonic()
+        encoded = Message(cmd, message)
+        uuids = list(self._sockets.keys())
+        semaphore = asyncio.Semaphore(settings.broadcast_concurrency)
+
+        async def deliver(uuid: str) -> None:
+            async with semaphore:
+                try:
+                    log.debug("Broadcast to socket %s", uuid)
+                    await asyncio.wait_for(
+                        self.send(uuid, encoded),
+                        settings.broadcast_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    log.warning("Timed out broadcast to socket %s", uuid)
+                except Exception:  # pylint: disable=broad-except
+                    log.warning("Failed broadcast to socket %s", uuid)
+                else:
+                    return
                 await self.close(uuid)
                 await self.remove(uuid)
 
+        await asyncio.gather(*(deliver(uuid) for uuid in uuids))
+        elapsed = time.monotonic() - start
+        log.debug(
+            "Broadcast %s to %d sockets in %.3fs", cmd, len(uuids), elapsed
+        )
+        return elapsed
+
     async def add(self, uuid: str, sck: Any) -> None:
         """
         Function which add/re-add TCP/Web Socket to store.
@@ -76,7 +179,7 @@ class BaseSockets:
         """
         sck = self._sockets.pop(uuid, None)
         if sck:
-            await syncwebsockets.broadcast(
+            status_bus.publish(
                 "Remove" + self.__class__.__name__.rstrip("s"), uuid
             )
 
@@ -112,7 +215,7 @@ class Sockets(BaseSockets):
 
     async def add(self, uuid: str, sck: Any) -> None:
         await super().add(uuid, sck)
-        await syncwebsockets.broadcast("AddSocket", {"uuid": uuid})
+        status_bus.publish("AddSocket", {"uuid": uuid})
 
     async def remove(self, uuid: str) -> None:
         await super().remove(uuid)
@@ -129,7 +232,7 @@ class Sockets(BaseSockets):
         Simple setter for set filename for uuid.
         """
         self._filenames[uuid] = filename
-        await syncwebsockets.broadcast(
+        status_bus.publish(
             "AddSocket",
             {
                 "uuid": uuid,
@@ -137,9 +240,14 @@ class Sockets(BaseSockets):
             },
         )
 
-    async def _send(self, sck: Any, data: str) -> None:
-        await sck.write(pack("!i", len(data)))
-        await sck.write(data.encode("utf-8"))
+    def queue_sizes(self) -> Dict[str, int]:
+        """
+        Number of messages waiting to be sent to each TCP Socket.
+        """
+        return {uuid: sck.queue_size for uuid, sck in self._sockets.items()}
+
+    async def _send(self, sck: Any, message: Message) -> None:
+        await sck.write(message.frame(sck.compression))
 
 
 class BaseWebSockets(BaseSockets):
@@ -149,9 +257,9 @@ class BaseWebSockets(BaseSockets):
 
     __slots__ = ["_sockets"]
 
-    async def _send(self, sck: Any, data: str) -> None:
+    async def _send(self, sck: Any, message: Message) -> None:
         if hasattr(sck, "ws"):
-            await sck.write_message(data)
+            await sck.write_message(message.text)
         else:
             log.warning("Websocket is closed")
 
@@ -165,7 +273,7 @@ class WebSockets(BaseWebSockets):
 
     async def add(self, uuid: str, sck: Any) -> None:
         await super().add(uuid, sck)
-        await syncwebsockets.broadcast("AddWebSocket", uuid)
+        status_bus.publish("AddWebSocket", uuid)
 
 
 class SyncWebSockets(BaseWebSockets):
@@ -176,37 +284,272 @@ class SyncWebSockets(BaseWebSockets):
     __slots__ = ["_sockets"]
 
 
+def breakpoint_key(brk: Any) -> Hashable:
+    """
+    Canonical, hashable identity of a breakpoint.
+
+    wdb breakpoints are identified by their file, line, condition and
+    function, whatever else they hold. Anything else is identified by its
+    JSON representation.
+    """
+    if isinstance(brk, dict) and "fn" in brk:
+        return tuple(brk.get(name) for name in BREAKPOINT_IDENTITY)
+    return json.dumps(brk, sort_keys=True)
+
+
 class Breakpoints:
     """
     General store for active breakpoints.
+
+    Breakpoints are kept in insertion order by identity, and indexed by
+    file, so adding, removing and looking them up do not depend on their
+    number.
+
+    Every change bumps the store version. The encoded snapshot of the store
+    and the changes since recent versions are cached, so that connecting
+    wdb instances do not serialize the whole store each time.
     """
 
-    __slots__ = ["_breakpoints"]
+    __slots__ = [
+        "_breakpoints",
+        "_files",
+        "_version",
+        "_oldest",
+        "_changes",
+        "_encoded",
+    ]
 
     def __init__(self) -> None:
-        self._breakpoints: List[Any] = []
+        self._breakpoints: Dict[Hashable, Any] = {}
+        self._files: Dict[str, Dict[Hashable, Any]] = {}
+        # Versions start from the server start time so that the versions
+        # known by wdb instances from a previous server are never reused
+        self._version: int = time.time_ns() // 1000
+        # Oldest version the changes can be computed from
+        self._oldest: int = self._version
+        self._changes: Deque[Tuple[int, Hashable, Any]] = deque()
+        # Encoded snapshot and changes, by version they were asked from
+        self._encoded: Dict[Optional[int], Message] = {}
+
+    @property
+    def version(self) -> int:
+        """Version of the store, bumped by every change."""
+        return self._version
+
+    def _changed(self, key: Hashable, brk: Any) -> None:
+        self._version += 1
+        self._changes.append((self._version, key, brk))
+        if len(self._changes) > BREAKPOINTS_HISTORY:
+            self._oldest = self._changes.popleft()[0]
+        self._encoded.clear()
 
     async def add(self, brk: Any) -> None:
         """
         Add breakpoint to store and broadcast messaage about it.
         """
-        if brk not in self._breakpoints:
-            self._breakpoints.append(brk)
-            await syncwebsockets.broadcast("AddBreak|" + json.dumps(brk))
+        key = breakpoint_key(brk)
+        if key not in self._breakpoints:
+            self._breakpoints[key] = brk
+            if isinstance(key, tuple):
+                self._files.setdefault(brk["fn"], {})[key] = brk
+            self._changed(key, brk)
+            status_bus.publish("AddBreak", brk)
 
     async def remove(self, brk: Any) -> None:
         """
         Remove breakpoint from store and broadcast messaage about it.
         """
-        if brk in self._breakpoints:
-            self._breakpoints.remove(brk)
-            await syncwebsockets.broadcast("RemoveBreak|" + json.dumps(brk))
+        key = breakpoint_key(brk)
+        if key in self._breakpoints:
+            del self._breakpoints[key]
+            if isinstance(key, tuple):
+                in_file = self._files[brk["fn"]]
+                del in_file[key]
+                if not in_file:
+                    del self._files[brk["fn"]]
+            self._changed(key, brk)
+            status_bus.publish("RemoveBreak", brk)
 
     def get(self) -> List[Any]:
         """
         Simple getter for access to breakpoints store.
         """
-        return self._breakpoints
+        return list(self._breakpoints.values())
+
+    def get_file(self, filename: str) -> List[Any]:
+        """
+        Breakpoints set in a file.
+        """
+        return list(self._files.get(filename, {}).values())
+
+    def encoded(self) -> Message:
+        """
+        JSON list of the breakpoints, as answered to ServerBreaks.
+        """
+        if None not in self._encoded:
+            self._encoded[None] = Message(json.dumps(self.get()))
+        return self._encoded[None]
+
+    def encoded_since(self, version: int) -> Message:
+        """
+        JSON changes since a version, as answered to ServerBreaksSince.
+
+        When the changes since the version are not known anymore, the whole
+        store is sent instead, as "breakpoints".
+        """
+        if not self._oldest <= version <= self._version:
+            version = -1
+        if version not in self._encoded:
+            if version == -1:
+                self._encoded[version] = Message(
+                    json.dumps(
+                        {"version": self._version, "breakpoints": self.get()}
+                    )
+                )
+            else:
+                changed: Dict[Hashable, Any] = {}
+                # Versions of the changes are consecutive
+                first = version - self._oldest
+                for _, key, brk in islice(self._changes, first, None):
+                    changed.pop(key, None)
+                    changed[key] = brk
+                self._encoded[version] = Message(
+                    json.dumps(
+                        {
+                            "version": self._version,
+                            "since": version,
+                            "added": [
+                                self._breakpoints[key]
+                                for key in changed
+                                if key in self._breakpoints
+                            ],
+                            "removed": [
+                                brk
+                                for key, brk in changed.items()
+                                if key not in self._breakpoints
+                            ],
+                        }
+                    )
+                )
+        return self._encoded[version]
+
+
+class StatusBus:
+    """
+    Coalescing bus of the notifications of status pages.
+
+    State changes are published to the bus rather than broadcast right
+    away. The ones published within settings.status_window seconds are
+    merged in a single Batch message, keeping only the last change of each
+    item: an item added and removed within the window is not notified at
+    all.
+
+    The bus also serves the Snapshot of the whole state to status pages,
+    built once until the next change or the next process table. Items
+    sent to a page outside of the bus, by a Snapshot or a List* reply,
+    count as notified: their removal always is, even within the window
+    they were added in.
+    """
+
+    __slots__ = [
+        "_events",
+        "_announced",
+        "_flusher",
+        "_snapshot",
+        "_processes",
+    ]
+
+    def __init__(self) -> None:
+        # Last change of each item: whether it is an addition, and message
+        self._events: Dict[Hashable, Tuple[bool, Message]] = {}
+        # Items whose addition has been notified, and not their removal
+        self._announced: Set[Hashable] = set()
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._snapshot: Optional[Message] = None
+        # Process table of the snapshot, a new one is scanned on changes
+        self._processes: Optional[List[Any]] = None
+
+    @staticmethod
+    def _item(cmd: str, data: Any) -> Tuple[bool, Hashable]:
+        """
+        Whether an AddX or RemoveX change is an addition, and its item.
+        """
+        adding = cmd.startswith("Add")
+        kind = cmd[len("Add") :] if adding else cmd[len("Remove") :]
+        if kind == "Break":
+            return adding, (kind, breakpoint_key(data))
+        if isinstance(data, dict):
+            return adding, (kind, data.get("uuid"))
+        return adding, (kind, data)
+
+    def publish(self, cmd: str, data: Any) -> None:
+        """
+        Publish an AddX or RemoveX change of an item.
+        """
+        adding, item = self._item(cmd, data)
+        self._snapshot = None
+        self._events.pop(item, None)
+        self._events[item] = adding, Message(cmd, data)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+
+    def delivered(self, cmd: str, data: Any) -> None:
+        """
+        Record the AddX of an item sent to a status page outside of the bus.
+        """
+        self._announced.add(self._item(cmd, data)[1])
+
+    async def _flush(self) -> None:
+        """
+        Broadcast the changes published during the window.
+        """
+        await asyncio.sleep(settings.status_window)
+        events, self._events = self._events, {}
+        self._flusher = None
+
+        messages = []
+        for item, (adding, message) in events.items():
+            if adding:
+                self._announced.add(item)
+            elif item in self._announced:
+                self._announced.remove(item)
+            else:
+                continue
+            messages.append(message.text)
+        if len(messages) == 1:
+            await syncwebsockets.broadcast(messages[0])
+        elif messages:
+            await syncwebsockets.broadcast("Batch", messages)
+
+    def snapshot(self, processes: List[Any]) -> Message:
+        """
+        Sockets, websockets, breakpoints and processes, in a single message.
+        """
+        if self._snapshot is None or self._processes is not processes:
+            snapshot: Dict[str, List[Any]] = {
+                "sockets": [
+                    {
+                        "uuid": uuid,
+                        "filename": sockets.get_filename(uuid)
+                        if settings.show_filename
+                        else "",
+                    }
+                    for uuid in sockets.uuids
+                ],
+                "websockets": list(websockets.uuids),
+                "breaks": breakpoints.get(),
+                "processes": processes,
+            }
+            # Until the next change, which builds a new one
+            for socket in snapshot["sockets"]:
+                self.delivered("AddSocket", socket)
+            for uuid in snapshot["websockets"]:
+                self.delivered("AddWebSocket", uuid)
+            for brk in snapshot["breaks"]:
+                self.delivered("AddBreak", brk)
+            self._snapshot = Message("Snapshot", snapshot)
+            self._processes = processes
+        return self._snapshot
 
 
 # pylint: disable=too-few-public-methods
@@ -221,6 +564,28 @@ class Settings:
         "more",
         "detached_session",
         "show_filename",
+        "write_high_water",
+        "max_frame_size",
+        "stream_threshold",
+        "send_queue_size",
+        "send_queue_policy",
+        "compression_level",
+        "compression_threshold",
+        "max_sessions",
+        "accept_rate",
+        "admission_queue_size",
+        "admission_timeout",
+        "broadcast_concurrency",
+        "broadcast_timeout",
+        "status_window",
+        "process_scan_interval",
+        "process_change_threshold",
+        "process_monitor",
+        "rescan_window",
+        "cache_dir",
+        "offline",
+        "version_check_ttl",
+        "precompress",
     ]
 
     def __init__(self, **kwargs: Any) -> None:
@@ -229,6 +594,28 @@ class Settings:
         self.more: bool = False
         self.detached_session: bool = False
         self.show_filename: bool = False
+        self.write_high_water: int = 65536
+        self.max_frame_size: int = 2**28
+        self.stream_threshold: int = 2**20
+        self.send_queue_size: int = 1024
+        self.send_queue_policy: str = "block"
+        self.compression_level: int = 6
+        self.compression_threshold: int = 1024
+        self.max_sessions: int = 256
+        self.accept_rate: float = 50
+        self.admission_queue_size: int = 512
+        self.admission_timeout: float = 30
+        self.broadcast_concurrency: int = 64
+        self.broadcast_timeout: float = 5
+        self.status_window: float = 0.05
+        self.process_scan_interval: float = 1
+        self.process_change_threshold: float = 0.5
+        self.process_monitor: str = "netlink"
+        self.rescan_window: float = 1
+        self.cache_dir: str = CACHE_DIR
+        self.offline: bool = False
+        self.version_check_ttl: float = 86400
+        self.precompress: bool = False
         self._set_params(**kwargs)
 
     def update(self, **kwargs: Any) -> None:
@@ -246,4 +633,5 @@ sockets = Sockets()
 websockets = WebSockets()
 syncwebsockets = SyncWebSockets()
 breakpoints = Breakpoints()
+status_bus = StatusBus()
 settings = Settings()
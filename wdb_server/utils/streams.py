@@ -1,30 +1,126 @@
 # Stdlib:
 import asyncio
-import json
+import codecs
 import logging
+import zlib
 from asyncio.exceptions import IncompleteReadError
-from struct import unpack
+from struct import Struct
+from typing import Any, Iterable, Optional, Tuple, Union
 
 # Firstparty:
-from wdb_server.constants import UNKNOWN_UUID
-from wdb_server.utils.state import breakpoints, sockets, websockets
+from wdb_server.constants import (
+    COMPRESSED_FLAG,
+    REJECTION_LINGER,
+    STREAM_CHUNK_SIZE,
+    UNKNOWN_UUID,
+)
+from wdb_server.utils.admission import AdmissionError, admission
+from wdb_server.utils.state import breakpoints, settings, sockets, websockets
 
 log = logging.getLogger("wdb_server")
 
+# Every frame is prefixed by its length as a big-endian signed int.
+# Once a debuggee enabled compression, COMPRESSED_FLAG is set in the
+# length of frames whose payload is zlib compressed.
+HEADER = Struct("!i")
+
+
+class TransportWriter:
+    """
+    Writer of the connections parsed by WDBProtocol.
+
+    It offers the part of the asyncio.StreamWriter interface IOStream
+    relies on, built on the public transport API: the protocol forwards
+    its pause_writing, resume_writing and connection_lost callbacks.
+    """
+
+    __slots__ = ["transport", "_writable", "_closed", "_lost"]
+
+    def __init__(self, transport: asyncio.WriteTransport) -> None:
+        self.transport = transport
+        self._writable: asyncio.Event = asyncio.Event()
+        self._writable.set()
+        self._closed: asyncio.Event = asyncio.Event()
+        self._lost: bool = False
+
+    def write(self, data: bytes) -> None:
+        """Write data to the transport."""
+        self.transport.write(data)
+
+    def writelines(self, data: Iterable[bytes]) -> None:
+        """Write a list of buffers to the transport."""
+        self.transport.writelines(data)
+
+    async def drain(self) -> None:
+        """
+        Wait until the transport buffer is below its high-water mark.
+        """
+        if not self._lost:
+            await self._writable.wait()
+        if self._lost:
+            raise ConnectionResetError("Connection lost")
+
+    def close(self) -> None:
+        """Close the transport once its buffer is flushed."""
+        self.transport.close()
+
+    async def wait_closed(self) -> None:
+        """Wait until the connection is lost."""
+        await self._closed.wait()
+
+    def pause_writing(self) -> None:
+        """The transport buffer went over its high-water mark."""
+        self._writable.clear()
+
+    def resume_writing(self) -> None:
+        """The transport buffer drained under its low-water mark."""
+        self._writable.set()
+
+    def connection_lost(self) -> None:
+        """The connection was lost or closed."""
+        self._lost = True
+        self._writable.set()
+        self._closed.set()
+
 
 class IOStream:
     """
     Base class for interacting with reader/writer
     """
 
-    __slots__ = ["_reader", "_writer", "_uuid"]
+    __slots__ = [
+        "_reader",
+        "_read_ahead",
+        "_writer",
+        "_uuid",
+        "_high_water",
+        "_queue",
+        "_sender",
+        "_compression",
+    ]
 
     def __init__(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        self,
+        reader: Optional[asyncio.StreamReader],
+        writer: Union[asyncio.StreamWriter, TransportWriter],
+        high_water: Optional[int] = None,
+        queue_size: Optional[int] = None,
     ) -> None:
-        self._reader: asyncio.StreamReader = reader
-        self._writer: asyncio.StreamWriter = writer
+        # reader is None when frames are parsed by WDBProtocol
+        self._reader: Optional[asyncio.StreamReader] = reader
+        # Data read by wait_lost, returned first by readexactly
+        self._read_ahead: bytes = b""
+        self._writer: Union[asyncio.StreamWriter, TransportWriter] = writer
         self._uuid: str = UNKNOWN_UUID
+        self._high_water: int = (
+            settings.write_high_water if high_water is None else high_water
+        )
+        writer.transport.set_write_buffer_limits(high=self._high_water)
+        self._queue: "asyncio.Queue[bytes]" = asyncio.Queue(
+            settings.send_queue_size if queue_size is None else queue_size
+        )
+        self._sender: Optional["asyncio.Task[None]"] = None
+        self._compression: bool = False
 
     @property
     def uuid(self) -> str:
@@ -35,23 +131,98 @@ class IOStream:
     def uuid(self, uuid: str) -> None:
         self._uuid = uuid
 
+    @property
+    def compression(self) -> bool:
+        """Whether frames over the threshold are compressed."""
+        return self._compression
+
+    @compression.setter
+    def compression(self, compression: bool) -> None:
+        self._compression = compression
+
     async def readexactly(self, num_bytes: int) -> bytes:
         """
         Alias to asyncio.StreamReader.readexactly
         """
+        assert self._reader is not None, "Stream has no reader"
+        if self._read_ahead:
+            data = self._read_ahead[:num_bytes]
+            self._read_ahead = self._read_ahead[num_bytes:]
+            if len(data) < num_bytes:
+                data += await self._reader.readexactly(num_bytes - len(data))
+            return data
         return await self._reader.readexactly(num_bytes)
 
+    async def wait_lost(self, limit: int = STREAM_CHUNK_SIZE) -> None:
+        """
+        Wait until the peer closes the connection, reading at most limit
+        bytes ahead of readexactly to notice it.
+        """
+        assert self._reader is not None, "Stream has no reader"
+        try:
+            while len(self._read_ahead) < limit:
+                data = await self._reader.read(limit - len(self._read_ahead))
+                if not data:
+                    return
+                self._read_ahead += data
+            # Nothing more is read, only a reset connection is noticed
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    @property
+    def queue_size(self) -> int:
+        """Number of messages waiting to be sent."""
+        return self._queue.qsize()
+
     async def write(self, data: bytes) -> None:
         """
-        Alias to asyncio.StreamWriter.write with drain after
+        Queue data to be sent by the stream sender task.
+
+        When the queue is full, settings.send_queue_policy decides whether
+        to wait for room, drop the oldest message or disconnect.
         """
-        self._writer.write(data)
-        await self._writer.drain()
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send())
+        elif self._sender.done():
+            raise ConnectionResetError(f"Stream closed for {self.uuid}")
+
+        if self._queue.full():
+            if settings.send_queue_policy == "drop_oldest":
+                log.warning("Send queue full for %s, dropping", self.uuid)
+                self._queue.get_nowait()
+            elif settings.send_queue_policy == "disconnect":
+                log.warning("Send queue full for %s, closing", self.uuid)
+                self._writer.close()
+                return
+        await self._queue.put(data)
+
+    async def _send(self) -> None:
+        """
+        Write queued data, draining only once the transport buffer goes
+        past the high-water mark.
+        """
+        try:
+            while True:
+                data = [await self._queue.get()]
+                while not self._queue.empty():
+                    data.append(self._queue.get_nowait())
+                self._writer.writelines(data)
+                transport = self._writer.transport
+                if transport.get_write_buffer_size() > self._high_water:
+                    await self._writer.drain()
+        except ConnectionError:
+            log.warning("Closed stream for %s", self.uuid)
 
     async def close(self) -> None:
         """
         Close active socket
         """
+        if self._sender is not None:
+            self._sender.cancel()
+            # The transport sends what it buffered before closing
+            while not self._queue.empty():
+                self._writer.write(self._queue.get_nowait())
         self._writer.close()
         try:
             await self._writer.wait_closed()
@@ -76,61 +247,335 @@ class IOStream:
         await sockets.remove(self.uuid)
 
 
-async def read_frame(stream: IOStream, uuid: str, frame: bytes) -> None:
+async def read_frame(
+    stream: IOStream, uuid: str, frame: Union[bytes, memoryview]
+) -> None:
     """
     Decode frame and process.
     """
-    decoded_frame = frame.decode("utf-8")
+    decoded_frame = str(frame, "utf-8")
     if decoded_frame == "ServerBreaks":
-        await sockets.send(uuid, json.dumps(breakpoints.get()))
+        await sockets.send(uuid, breakpoints.encoded())
+    elif decoded_frame.startswith("ServerBreaksSince|"):
+        try:
+            version = int(decoded_frame.split("|", 1)[1])
+        except ValueError:
+            # Unknown versions are answered with all the breakpoints
+            version = -1
+        await sockets.send(uuid, breakpoints.encoded_since(version))
     elif decoded_frame == "PING":
         log.info("%s PONG", uuid)
     elif decoded_frame.startswith("UPDATE_FILENAME"):
         filename = decoded_frame.split("|", 1)[1]
         await sockets.set_filename(uuid, filename)
+    elif decoded_frame.startswith("ENABLE_COMPRESSION"):
+        algorithms = decoded_frame.split("|", 1)[1]
+        await enable_compression(stream, uuid, algorithms)
     else:
-        await websockets.send(uuid, frame.decode("utf-8"))
-    try:
-        await read_header(stream, uuid, await stream.readexactly(4))
-    except IncompleteReadError:
-        log.warning("Closed stream for %s", uuid)
+        await websockets.send(uuid, decoded_frame)
+
+
+async def enable_compression(
+    stream: IOStream, uuid: str, algorithms: str
+) -> None:
+    """
+    Answer the compression request of a debuggee.
+
+    The answer itself is never compressed: the debuggee may only compress
+    its frames, and expect compressed ones, once it has received it.
+    """
+    enabled = settings.compression_level > 0 and "zlib" in algorithms.split(
+        ","
+    )
+    log.debug(
+        "Compression %s for %s", "enabled" if enabled else "refused", uuid
+    )
+    await sockets.send(
+        uuid,
+        "COMPRESSION",
+        {
+            "algorithm": "zlib" if enabled else None,
+            "threshold": settings.compression_threshold,
+        },
+    )
+    stream.compression = enabled
 
 
-async def read_header(stream: IOStream, uuid: str, _length: bytes) -> None:
+def parse_header(stream: IOStream, header: int) -> Tuple[int, bool]:
+    """
+    Split a frame header in payload length and compressed flag.
     """
-    Read header data and process frame.
+    if stream.compression and header > 0 and header & COMPRESSED_FLAG:
+        return header & ~COMPRESSED_FLAG, True
+    return header, False
+
+
+def decompress(frame: Union[bytes, memoryview]) -> Optional[bytes]:
     """
-    (length,) = unpack("!i", _length)
+    Decompress a frame received whole.
+
+    Return None, without inflating more than the stream threshold, when
+    the frame is too large to be buffered whole once inflated: it is to
+    be relayed with relay_compressed instead.
+    """
+    limit = min(settings.stream_threshold, settings.max_frame_size)
+    decompressor = zlib.decompressobj()
     try:
-        await read_frame(stream, uuid, await stream.readexactly(length))
-    except IncompleteReadError:
-        log.warning("Closed stream for %s", uuid)
+        data = decompressor.decompress(frame, limit + 1)
+    except zlib.error as error:
+        raise ValueError(f"Invalid compressed frame: {error}") from error
+    if len(data) > limit:
+        return None
+    if not decompressor.eof:
+        raise ValueError("Truncated compressed frame")
+    return data
+
+
+def is_large_frame(length: int) -> bool:
+    """
+    Whether a frame is too large to be buffered whole before processing.
+    """
+    return length > min(settings.stream_threshold, settings.max_frame_size)
+
+
+async def relay_compressed(uuid: str, frame: Union[bytes, memoryview]) -> None:
+    """
+    Relay a compressed frame received whole which inflates too large to be
+    buffered whole.
+    """
+    relay = FrameRelay(uuid, len(frame), compressed=True)
+    await relay.start()
+    await relay.feed(frame)
 
 
-async def assign_stream(stream: IOStream, _uuid: bytes) -> None:
+class FrameRelay:
+    """
+    Relay a large frame to the browser chunk by chunk as it is received.
+
+    Frames over the max frame size are rejected: their payload is discarded
+    as it arrives and the browser is told why. Compressed frames are
+    inflated chunk by chunk as well, never more than STREAM_CHUNK_SIZE
+    bytes at once, and rejected as soon as they inflate over the max
+    frame size.
+    """
+
+    __slots__ = [
+        "_uuid",
+        "_length",
+        "_remaining",
+        "_decoder",
+        "_decompressor",
+        "_inflated",
+    ]
+
+    def __init__(
+        self, uuid: str, length: int, compressed: bool = False
+    ) -> None:
+        self._uuid: str = uuid
+        self._length: int = length
+        self._remaining: int = length
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+        self._decompressor: Optional["zlib._Decompress"] = None
+        self._inflated: int = 0
+        if length <= settings.max_frame_size:
+            self._decoder = codecs.getincrementaldecoder("utf-8")()
+            if compressed:
+                self._decompressor = zlib.decompressobj()
+
+    @property
+    def remaining(self) -> int:
+        """Bytes of the frame not received yet."""
+        return self._remaining
+
+    async def start(self) -> None:
+        """
+        Announce the frame to the browser.
+        """
+        if self._decoder is None:
+            log.warning(
+                "Rejected frame of %d bytes for %s", self._length, self._uuid
+            )
+            await websockets.send(
+                self._uuid,
+                "Echo",
+                {
+                    "for": "Frame rejected",
+                    "val": f"The debugger sent {self._length} bytes, "
+                    f"over the {settings.max_frame_size} bytes limit",
+                },
+            )
+
+    async def feed(self, chunk: Union[bytes, memoryview]) -> None:
+        """
+        Relay the next received chunk of the frame.
+        """
+        self._remaining -= len(chunk)
+        if self._decoder is None:
+            return
+        if self._decompressor is None:
+            await self._send(chunk)
+        else:
+            await self._inflate(chunk)
+        if not self._remaining:
+            await websockets.send(self._uuid, "ChunkEnd")
+
+    async def _inflate(self, chunk: Union[bytes, memoryview]) -> None:
+        """
+        Inflate a compressed chunk and relay it, piece by piece.
+        """
+        assert self._decompressor is not None
+        while True:
+            try:
+                data = self._decompressor.decompress(chunk, STREAM_CHUNK_SIZE)
+            except zlib.error as error:
+                raise ValueError(
+                    f"Invalid compressed frame: {error}"
+                ) from error
+            self._inflated += len(data)
+            if self._inflated > settings.max_frame_size:
+                raise ValueError("Compressed frame over max frame size")
+            chunk = self._decompressor.unconsumed_tail
+            # A full piece may leave inflated data pending, even once the
+            # whole chunk is consumed
+            last = not chunk and len(data) < STREAM_CHUNK_SIZE
+            await self._send(data, last)
+            if last:
+                break
+        if not self._remaining and not self._decompressor.eof:
+            raise ValueError("Truncated compressed frame")
+
+    async def _send(
+        self, data: Union[bytes, memoryview], last: bool = True
+    ) -> None:
+        assert self._decoder is not None
+        text = self._decoder.decode(data, last and not self._remaining)
+        if text:
+            await websockets.send(self._uuid, "Chunk|" + text)
+
+
+async def assign_stream(stream: IOStream, uuid: str) -> None:
     """
     Assign IOStream and socket.
     """
-    uuid = _uuid.decode("utf-8")
     log.debug("Assigning stream to %s", uuid)
     await sockets.add(uuid, stream)
     stream.uuid = uuid
-    try:
-        await read_header(stream, uuid, await stream.readexactly(4))
-    except IncompleteReadError:
-        log.warning("Closed stream for %s", uuid)
 
 
-async def read_uuid_size(stream: IOStream, _length: bytes) -> None:
+class FrameReader:
     """
-    Read UUID and go ahead.
+    Per-connection reader of length-prefixed frames.
+
+    Frames are read in a flat loop, so a session keeps a constant stack
+    depth whatever the number of frames it exchanges.
     """
-    (length,) = unpack("!i", _length)
-    assert length == 36, "Wrong uuid"
+
+    __slots__ = ["_stream"]
+
+    def __init__(self, stream: IOStream) -> None:
+        self._stream: IOStream = stream
+
+    async def read_header(self) -> int:
+        """
+        Read the length prefix of the next frame.
+        """
+        (length,) = HEADER.unpack(await self._stream.readexactly(HEADER.size))
+        return length
+
+    async def read_uuid(self) -> str:
+        """
+        Read the UUID sent by the debuggee right after connecting.
+        """
+        length = await self.read_header()
+        if length != 36:
+            raise ValueError(f"Wrong uuid length {length}")
+        return (await self._stream.readexactly(length)).decode("utf-8")
+
+    async def relay(self, relay: FrameRelay) -> None:
+        """
+        Read a large frame chunk by chunk and relay it.
+        """
+        await relay.start()
+        while relay.remaining:
+            await relay.feed(
+                await self._stream.readexactly(
+                    min(relay.remaining, STREAM_CHUNK_SIZE)
+                )
+            )
+
+    async def run(self) -> None:
+        """
+        Assign the stream and process its frames until it is closed.
+        """
+        try:
+            uuid = await self.read_uuid()
+        except IncompleteReadError:
+            log.warning("Closed stream for getting uuid")
+            return
+        except ValueError:
+            log.warning("Invalid uuid frame", exc_info=True)
+            return
+
+        await assign_stream(self._stream, uuid)
+        try:
+            while True:
+                length, compressed = parse_header(
+                    self._stream, await self.read_header()
+                )
+                if is_large_frame(length):
+                    await self.relay(FrameRelay(uuid, length, compressed))
+                    continue
+                frame = await self._stream.readexactly(length)
+                if compressed:
+                    data = decompress(frame)
+                    if data is None:
+                        await relay_compressed(uuid, frame)
+                        continue
+                    frame = data
+                await read_frame(self._stream, uuid, frame)
+        except IncompleteReadError:
+            log.warning("Closed stream for %s", uuid)
+        except ValueError:
+            log.warning("Invalid frame for %s", uuid, exc_info=True)
+
+
+def peer_name(connection: Any) -> str:
+    """
+    Describe the origin of a connection, over TCP or a Unix domain socket.
+    """
+    address = connection.get_extra_info("peername")
+    if isinstance(address, (tuple, list)):
+        return str(address[0])
+    # Unix domain socket clients are usually unnamed
+    return f"unix:{connection.get_extra_info('sockname')}"
+
+
+async def reject(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    error: AdmissionError,
+) -> None:
+    """
+    Tell a refused wdb instance why, then close its connection.
+    """
+    writer.write(error.frame())
+    if writer.can_write_eof():
+        writer.write_eof()
+    # Closed with unread data, the connection would be reset and the frame
+    # possibly lost: what the peer sends is discarded until it closes it
     try:
-        await assign_stream(stream, await stream.readexactly(length))
-    except IncompleteReadError:
-        log.warning("Closed stream for getting uuid")
+        await asyncio.wait_for(discard(reader), REJECTION_LINGER)
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    writer.close()
+
+
+async def discard(reader: asyncio.StreamReader) -> None:
+    """
+    Read and drop what is received until the end of the stream.
+    """
+    while await reader.read(STREAM_CHUNK_SIZE):
+        pass
 
 
 async def handle_tcp_connection(
@@ -139,13 +584,23 @@ async def handle_tcp_connection(
     """
     General handler function to handle input TCP connections.
     """
-    address = writer.get_extra_info("peername")[0]
-    log.info("Connection received from %s", str(address))
+    peer = peer_name(writer)
     stream = IOStream(reader, writer)
     try:
-        await read_uuid_size(stream, await stream.readexactly(4))
-    except IncompleteReadError:
-        log.warning("Closed stream for getting uuid length")
+        admitted = await admission.admit(stream.wait_lost)
+    except AdmissionError as error:
+        log.warning("Rejected connection from %s: %s", peer, error)
+        await reject(reader, writer, error)
+        return
+    if not admitted:
+        log.info("Connection from %s lost waiting for admission", peer)
+        writer.close()
+        return
+
+    log.info("Connection received from %s", peer)
+    try:
+        await FrameReader(stream).run()
     finally:
         await stream.close()
+        admission.release()
         del stream
@@ -4,16 +4,21 @@
 # Stdlib:
 import asyncio
 import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 
 # Thirdparty:
 import psutil
 
 # Firstparty:
 from wdb_server.constants import UNKNOWN_UUID
-from wdb_server.utils.state import syncwebsockets
+from wdb_server.utils.cache import read_json, write_json
+from wdb_server.utils.procfs import ProcConnector, ProcfsScanner
+from wdb_server.utils.state import settings, syncwebsockets
 
 log = logging.getLogger("wdb_server")
 
@@ -26,60 +31,162 @@ else:
 
     class LibPythonWatcher:  # type: ignore # pragma: no cover
         def __init__(self, extra_search_path: Optional[str] = None) -> None:
-            inotify = pyinotify.WatchManager()
+            self.inotify = pyinotify.WatchManager()
             self.files = glob("/usr/lib/libpython*")
             if not self.files:
                 self.files = glob("/lib/libpython*")
 
-            if extra_search_path is not None:
-                # Handle custom installation paths
-                for file in Path(extra_search_path).rglob("libpython*"):
-                    self.files.append(str(file.resolve()))
-
             log.debug("Watching for %s", self.files)
             self.notifier = pyinotify.AsyncioNotifier(
-                inotify,
+                self.inotify,
                 asyncio.get_event_loop(),
                 self.notified,
                 pyinotify.ProcessEvent(),
             )
-            inotify.add_watch(
-                self.files,
-                pyinotify.EventsCodes.ALL_FLAGS["IN_OPEN"]
-                | pyinotify.EventsCodes.ALL_FLAGS["IN_CLOSE_NOWRITE"],
-            )
+            self.watch(self.files)
+
+            self.search: Optional["asyncio.Task[None]"] = None
+            if extra_search_path is not None:
+                # Handle custom installation paths, without delaying startup
+                self.search = asyncio.ensure_future(
+                    self.search_extra(extra_search_path)
+                )
+
+        def watch(self, files: List[str]) -> None:
+            if files:
+                self.inotify.add_watch(
+                    files,
+                    pyinotify.EventsCodes.ALL_FLAGS["IN_OPEN"]
+                    | pyinotify.EventsCodes.ALL_FLAGS["IN_CLOSE_NOWRITE"],
+                )
 
+        async def search_extra(self, root: str) -> None:
+            async for files in search_libpython(root):
+                new_files = [file for file in files if file not in self.files]
+                log.debug("Watching for %s", new_files)
+                self.files.extend(new_files)
+                self.watch(new_files)
+
+        # Called by the notifier as it reads the events, not awaited
         # pylint: disable=unused-argument
-        async def notified(self, notifier: Any) -> None:
+        def notified(self, notifier: Any) -> None:
             log.debug("Got notified for %s", self.files)
-            await refresh_process()
-            log.debug("Process refreshed")
+            process_scanner.rescan()
 
         def close(self) -> None:
             log.debug("Closing for %s", self.files)
+            if self.search is not None:
+                self.search.cancel()
             self.notifier.stop()
 
 
-async def refresh_process(uuid: str = UNKNOWN_UUID) -> None:
+def find_libpython(root: str) -> Tuple[List[str], Dict[str, float]]:
+    """
+    Find the libpython* files under root.
 
-    if uuid != UNKNOWN_UUID:
+    Return them along with the mtimes of the directories searched, which
+    tell whether the search is still valid.
+    """
+    files: List[str] = []
+    mtimes = {}
+    for directory, _, filenames in os.walk(root):
+        try:
+            mtimes[directory] = os.stat(directory).st_mtime
+        except OSError:
+            continue
+        files.extend(
+            str(Path(directory, filename).resolve())
+            for filename in filenames
+            if filename.startswith("libpython")
+        )
+    return files, mtimes
 
-        async def send(
-            data: str,
-            message: Optional[Union[Dict[str, Any], List[int], str]] = None,
-        ) -> None:
-            await syncwebsockets.send(uuid, data, message)
 
-    else:
+def outdated(mtimes: Dict[str, float]) -> bool:
+    """
+    Tell if a directory changed since its mtime was recorded.
+    """
+    for directory, mtime in mtimes.items():
+        try:
+            if os.stat(directory).st_mtime != mtime:
+                return True
+        except OSError:
+            return True
+    return not mtimes
+
+
+class LibPythonCache:
+    """
+    On-disk cache of the libpython files found under search paths.
+    """
+
+    __slots__ = ["path"]
+
+    def __init__(self, directory: str) -> None:
+        self.path = os.path.join(directory, "libpython.json")
+
+    def _read(self) -> Dict[str, Any]:
+        entries = read_json(self.path)
+        return entries if isinstance(entries, dict) else {}
+
+    def load(self, root: str) -> Tuple[List[str], Dict[str, float]]:
+        """
+        Return the files and directory mtimes last found under root.
+        """
+        entry = self._read().get(root) or {}
+        return entry.get("files", []), entry.get("mtimes", {})
+
+    def save(
+        self, root: str, files: List[str], mtimes: Dict[str, float]
+    ) -> None:
+        """
+        Store the files and directory mtimes found under root.
+        """
+        entries = self._read()
+        entries[root] = {"files": files, "mtimes": mtimes}
+        write_json(self.path, entries)
+
+
+async def search_libpython(root: str) -> AsyncIterator[List[str]]:
+    """
+    Search the libpython* files under root.
 
-        async def send(
-            data: str,
-            message: Optional[Union[Dict[str, Any], List[int], str]] = None,
-        ) -> None:
-            await syncwebsockets.broadcast(data, message)
+    Yield the files cached by a previous search at once, then, if the
+    directories searched changed since, the files found by a new search
+    run in the background.
+    """
+    loop = asyncio.get_running_loop()
+    cache = LibPythonCache(settings.cache_dir)
+    files, mtimes = await loop.run_in_executor(None, cache.load, root)
+    if files:
+        yield files
+    if not await loop.run_in_executor(None, outdated, mtimes):
+        return
+    log.debug("Searching %s for libpython", root)
+    files, mtimes = await loop.run_in_executor(None, find_libpython, root)
+    await loop.run_in_executor(None, cache.save, root, files, mtimes)
+    yield files
 
-    remaining_pids = []
-    remaining_tids = []
+
+# A single worker keeps scans in order and off the event loop
+scanner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wdb-scan")
+# Linux processes are scanned from /proc, others through psutil
+procfs_scanner = ProcfsScanner() if ProcfsScanner.available() else None
+
+
+ProcessInfo = Dict[str, Any]
+
+
+def scan_processes() -> List[ProcessInfo]:
+    """
+    Scan the running python processes.
+
+    This walks /proc and is meant to run in the scanner executor. CPU usage
+    is sampled without blocking, as the usage since the previous scan:
+    psutil.process_iter keeps the Process instances between calls.
+    Threads are only counted, see list_threads.
+    """
+    processes = []
     for proc in psutil.process_iter():
         try:
             cl = proc.cmdline()  # pylint: disable=invalid-name
@@ -94,39 +201,362 @@ async def refresh_process(uuid: str = UNKNOWN_UUID) -> None:
                 continue
 
         binary = cl[0].split("/")[-1]
+        if "python" not in binary and "pypy" not in binary:
+            continue
+        try:
+            with proc.oneshot():
+                if (
+                    not proc.is_running()
+                    or proc.status() == psutil.STATUS_ZOMBIE
+                ):
+                    continue
+                processes.append(
+                    {
+                        "pid": proc.pid,
+                        "user": proc.username(),
+                        "cmd": " ".join(cl),
+                        "threads": proc.num_threads(),
+                        "time": proc.create_time(),
+                        "mem": proc.memory_percent(),
+                        "cpu": proc.cpu_percent(interval=None),
+                    }
+                )
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        except Exception:  # pylint: disable=broad-except
+            log.warning("", exc_info=True)
+            continue
+    return processes
+
+
+def list_threads(pid: int) -> List[int]:
+    """
+    Ids of the threads of the process pid, none if it is gone.
+    """
+    try:
+        return [thread.id for thread in psutil.Process(pid).threads()]
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return []
+
+
+def changed_fields(
+    sent: Dict[str, Any], info: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Fields of a process which changed since they were sent.
+
+    The cpu and mem percentages are only worth sending again once they
+    moved by settings.process_change_threshold points.
+    """
+    changed = {}
+    for key, value in info.items():
+        previous = sent.get(key)
+        if key in ("cpu", "mem") and previous is not None:
+            if abs(value - previous) < settings.process_change_threshold:
+                continue
+        elif value == previous:
+            continue
+        changed[key] = value
+    return changed
+
+
+class ProcessScanner:
+    """
+    Table of the running python processes, shared by all status pages.
+
+    The table is scanned at most once per settings.process_scan_interval
+    seconds however many pages ask for it, and a single scan is in flight
+    at a time: callers arriving meanwhile wait for its result.
+
+    Once a process monitor runs, the table is also updated with the
+    processes it notifies as started or exited, which are scanned alone,
+    or rescanned in full when it asks for it.
+
+    It also remembers what each status page was last sent, so that only the
+    changes of the table are pushed to it.
+    """
+
+    __slots__ = [
+        "monitored",
+        "_processes",
+        "_scanned",
+        "_scan",
+        "_sent",
+        "_started",
+        "_exited",
+        "_updater",
+        "notifications",
+        "suppressed",
+        "_rescanner",
+        "_rescanned",
+        "_rescan_pending",
+    ]
+
+    def __init__(self) -> None:
+        self._processes: List[ProcessInfo] = []
+        self._scanned: Optional[float] = None
+        self._scan: Optional["asyncio.Future[List[ProcessInfo]]"] = None
+        # Processes by pid last sent to each status page
+        self._sent: Dict[str, Dict[int, ProcessInfo]] = {}
+        # Whether a process monitor notifies processes started and exited
+        self.monitored: bool = False
+        self._started: Set[int] = set()
+        self._exited: Set[int] = set()
+        self._updater: Optional["asyncio.Task[None]"] = None
+        # Rescans asked for, and the ones merged into another rescan
+        self.notifications: int = 0
+        self.suppressed: int = 0
+        self._rescanner: Optional["asyncio.Task[None]"] = None
+        self._rescanned: Optional[float] = None
+        self._rescan_pending: bool = False
+
+    async def get(self) -> List[ProcessInfo]:
+        """
+        Return the process table, scanning it again if it is outdated.
+        """
         if (
-            ("python" in binary or "pypy" in binary)
-            and proc.is_running()
-            and proc.status() != psutil.STATUS_ZOMBIE
+            self._scanned is not None
+            and time.monotonic() - self._scanned
+            < settings.process_scan_interval
         ):
-            try:
-                try:
-                    cpu = proc.cpu_percent(interval=0.01)
-                    await send(
-                        "AddProcess",
-                        {
-                            "pid": proc.pid,
-                            "user": proc.username(),
-                            "cmd": " ".join(proc.cmdline()),
-                            "threads": proc.num_threads(),
-                            "time": proc.create_time(),
-                            "mem": proc.memory_percent(),
-                            "cpu": cpu,
-                        },
+            return self._processes
+        return await self.refresh()
+
+    async def refresh(self) -> List[ProcessInfo]:
+        """
+        Scan the process table now, or join the scan in flight.
+        """
+        if self._scan is None:
+            self._scan = asyncio.ensure_future(self._run())
+        # A cancelled caller must not cancel the scan of the others
+        return await asyncio.shield(self._scan)
+
+    async def _run(self) -> List[ProcessInfo]:
+        try:
+            self._processes = await asyncio.get_running_loop().run_in_executor(
+                scanner,
+                procfs_scanner.scan if procfs_scanner else scan_processes,
+            )
+            self._scanned = time.monotonic()
+        finally:
+            self._scan = None
+        return self._processes
+
+    def notify(self, pid: int, started: bool) -> None:
+        """
+        Record a process started or exited, as told by a process monitor.
+
+        The table is updated with the processes notified within
+        settings.status_window seconds at once.
+        """
+        if started:
+            self._exited.discard(pid)
+            self._started.add(pid)
+        else:
+            self._started.discard(pid)
+            self._exited.add(pid)
+        if self._updater is None:
+            self._updater = asyncio.ensure_future(self._update())
+
+    async def _update(self) -> None:
+        await asyncio.sleep(settings.status_window)
+        self._updater = None
+        started, self._started = self._started, set()
+        exited, self._exited = self._exited, set()
+        found = await asyncio.get_running_loop().run_in_executor(
+            scanner, scan_pids, started
+        )
+        table = {info["pid"]: info for info in self._processes}
+        # Processes which exec'd something else are gone too
+        for pid in exited | started.difference(info["pid"] for info in found):
+            table.pop(pid, None)
+        table.update((info["pid"], info) for info in found)
+        self._processes = list(table.values())
+        await send_changes(list(syncwebsockets.uuids), self._processes)
+
+    def rescan(self) -> None:
+        """
+        Ask for the table to be scanned again and pushed to all status pages.
+
+        Rescans start at most once per settings.rescan_window seconds and
+        only once the previous one finished: the requests made meanwhile
+        are merged into a single next rescan, and counted as suppressed.
+        """
+        self.notifications += 1
+        if self._rescanner is None:
+            self._rescanner = asyncio.ensure_future(self._rescan())
+        else:
+            self._rescan_pending = True
+            self.suppressed += 1
+
+    async def _rescan(self) -> None:
+        try:
+            while True:
+                if self._rescanned is not None:
+                    await asyncio.sleep(
+                        self._rescanned
+                        + settings.rescan_window
+                        - time.monotonic()
                     )
-                    remaining_pids.append(proc.pid)
-                    for thread in proc.threads():
-                        await send(
-                            "AddThread", {"id": thread.id, "of": proc.pid}
-                        )
-                        remaining_tids.append(thread.id)
-                except psutil.NoSuchProcess:
-                    pass
-                except psutil.AccessDenied:
-                    pass
-            except Exception:  # pylint: disable=broad-except
-                log.warning("", exc_info=True)
-                continue
+                # Requests made until now are served by this rescan
+                self._rescan_pending = False
+                self._rescanned = time.monotonic()
+                await send_changes(
+                    list(syncwebsockets.uuids), await self.refresh()
+                )
+                log.debug(
+                    "Processes rescanned, %d of %d requests suppressed",
+                    self.suppressed,
+                    self.notifications,
+                )
+                if not self._rescan_pending:
+                    break
+        finally:
+            self._rescanner = None
+
+    def changes(
+        self, uuid: str, processes: List[ProcessInfo], full: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Changes of the process table since it was last sent to uuid.
+
+        Return None when nothing changed. A full table is returned for a
+        page which was never sent one or which asked for it.
+        """
+        full = full or uuid not in self._sent
+        sent = {} if full else self._sent[uuid]
+        updates = []
+        pids = set()
+        for info in processes:
+            pid = info["pid"]
+            pids.add(pid)
+            if pid in sent:
+                changed = changed_fields(sent[pid], info)
+                if changed:
+                    sent[pid].update(changed)
+                    updates.append({"pid": pid, **changed})
+            else:
+                sent[pid] = dict(info)
+                updates.append(info)
+        removed = [pid for pid in sent if pid not in pids]
+        for pid in removed:
+            del sent[pid]
+        self._sent[uuid] = sent
+        if not (full or updates or removed):
+            return None
+        return {"full": full, "processes": updates, "removed": removed}
+
+    def mark_sent(self, uuid: str, processes: List[ProcessInfo]) -> None:
+        """
+        Record the whole table as sent to uuid, as in a Snapshot.
+        """
+        self._sent[uuid] = {info["pid"]: dict(info) for info in processes}
+
+    def forget(self, uuid: str) -> None:
+        """
+        Forget what was sent to a closed status page.
+        """
+        self._sent.pop(uuid, None)
+
+
+process_scanner = ProcessScanner()
+
+
+def scan_pids(pids: Set[int]) -> List[ProcessInfo]:
+    """
+    Scan the python processes among pids.
+    """
+    if procfs_scanner:
+        return procfs_scanner.scan(pids)
+    return [info for info in scan_processes() if info["pid"] in pids]
+
+
+async def send_changes(
+    uuids: List[str], processes: List[ProcessInfo], full: bool = False
+) -> None:
+    """
+    Send the changes of the process table to the status pages uuids.
+    """
+    for uuid in uuids:
+        changes = process_scanner.changes(uuid, processes, full)
+        if changes is not None:
+            await syncwebsockets.send(uuid, "Processes", changes)
+
+
+def start_process_monitor(
+    monitor: str = "netlink", extra_search_path: Optional[str] = None
+) -> Optional[Any]:
+    """
+    Start watching python processes being started, and return the monitor.
+
+    The proc connector notifies every process started and exited, and a
+    rescan recovers the events it lost, but needs CAP_NET_ADMIN. Otherwise
+    LibPythonWatcher rescans the processes when a libpython is opened, if
+    pyinotify is installed. Otherwise no monitor runs and status pages poll
+    the process table.
+    """
+    if monitor == "netlink" and procfs_scanner:
+        try:
+            connector = ProcConnector(
+                process_scanner.notify, process_scanner.rescan
+            )
+        except OSError as error:
+            log.info("Cannot listen to the proc connector: %s", error)
+        else:
+            process_scanner.monitored = True
+            return connector
+    if (
+        monitor in ("netlink", "inotify") and LibPythonWatcher
+    ):  # pragma: no cover
+        watcher = LibPythonWatcher(extra_search_path)
+        process_scanner.monitored = True
+        return watcher
+    process_scanner.monitored = False
+    return None
+
+
+async def refresh_process(
+    uuid: str = UNKNOWN_UUID, full: bool = False
+) -> None:
+    """
+    Send the changes of the process table to the status page uuid, or to
+    all of them after a new scan when no uuid is given.
+    """
+    if uuid != UNKNOWN_UUID:
+        processes = await process_scanner.get()
+        uuids = [uuid]
+    else:
+        # A python process just started, the table is outdated
+        processes = await process_scanner.refresh()
+        uuids = list(syncwebsockets.uuids)
+    await send_changes(uuids, processes, full)
+
+
+async def refresh_metrics() -> None:
+    """
+    Send the changes of the process table to all status pages once per
+    settings.process_scan_interval, while they do not poll it.
+
+    A process monitor only tells the processes started and exited, the cpu
+    and memory usage of the running ones is refreshed here.
+    """
+    while True:
+        await asyncio.sleep(settings.process_scan_interval)
+        if not syncwebsockets.uuids:
+            continue
+        try:
+            await refresh_process()
+        except Exception:  # pylint: disable=broad-except
+            log.warning("Cannot refresh the process table", exc_info=True)
+
 
-    await send("KeepProcess", remaining_pids)
-    await send("KeepThreads", remaining_tids)
+async def refresh_threads(uuid: str, pid: int) -> None:
+    """
+    Send the threads of the process pid to the status page uuid.
+    """
+    threads = await asyncio.get_running_loop().run_in_executor(
+        scanner, list_threads, pid
+    )
+    await syncwebsockets.send(
+        uuid, "Threads", {"pid": pid, "threads": threads}
+    )
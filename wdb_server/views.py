@@ -4,27 +4,35 @@
 import asyncio
 import json
 import logging
+import mimetypes
 import os
-from typing import Dict
+from typing import Dict, Optional
 from uuid import uuid4
 
 # Aiohttp:
 import aiohttp
-from aiohttp import web
+from aiohttp import hdrs, web
+from aiohttp.abc import AbstractStreamWriter
 
 # Thirdparty:
 import aiohttp_jinja2
 from aiomultiprocess import Process
 
 # Firstparty:
-from wdb_server.constants import UNKNOWN_UUID, WDB_TYPES
+from wdb_server.constants import IMMUTABLE, UNKNOWN_UUID, WDB_TYPES
+from wdb_server.utils.assets import negotiate
 from wdb_server.utils.state import (
     breakpoints,
     sockets,
+    status_bus,
     syncwebsockets,
     websockets,
 )
-from wdb_server.utils.technical import LibPythonWatcher, refresh_process
+from wdb_server.utils.technical import (
+    process_scanner,
+    refresh_process,
+    refresh_threads,
+)
 
 log = logging.getLogger("wdb_server")
 
@@ -105,6 +113,52 @@ class DebugHandler(web.View):
             self._debug(data["debug_file"])
 
 
+class NegotiatedFileResponse(web.FileResponse):
+    """
+    FileResponse of a variant already negotiated, which FileResponse would
+    otherwise swap for its .gz sibling whenever "gzip" appears anywhere in
+    Accept-Encoding, even refused.
+    """
+
+    async def prepare(
+        self, request: web.BaseRequest
+    ) -> Optional[AbstractStreamWriter]:
+        headers = request.headers.copy()
+        headers.popall(hdrs.ACCEPT_ENCODING, None)
+        return await super().prepare(request.clone(headers=headers))
+
+
+class StaticHandler(web.View):
+    """
+    Static assets, served as their best precompressed variant the browser
+    accepts. Those requested by their current hashed name are cached for
+    good.
+    """
+
+    async def get(self) -> NegotiatedFileResponse:
+        assets = self.request.app["assets"]
+        name, immutable = assets.resolve(self.request.match_info["filename"])
+        root = assets.root.resolve()
+        path = (root / name).resolve()
+        if root not in path.parents or not path.is_file():
+            raise web.HTTPNotFound()
+        variant, encoding = negotiate(
+            path, self.request.headers.get(hdrs.ACCEPT_ENCODING, "")
+        )
+        headers: Dict[str, str] = {
+            hdrs.CONTENT_TYPE: mimetypes.guess_type(path.name)[0]
+            or "application/octet-stream",
+            hdrs.VARY: hdrs.ACCEPT_ENCODING,
+        }
+        if encoding is not None:
+            headers[hdrs.CONTENT_ENCODING] = encoding
+        if immutable:
+            headers[hdrs.CACHE_CONTROL] = IMMUTABLE
+        return NegotiatedFileResponse(variant, headers=headers)
+
+    head = get
+
+
 class BaseWebSocketHandler(web.View):
     uuid: str = UNKNOWN_UUID
 
@@ -153,7 +207,7 @@ class SyncWebSocketHandler(BaseWebSocketHandler):
     async def on_open(self) -> None:
         self.uuid = str(uuid4())
         await syncwebsockets.add(self.uuid, self)
-        if not LibPythonWatcher:
+        if not process_scanner.monitored:
             await syncwebsockets.send(self.uuid, "StartLoop")
 
     # pylint: disable=too-many-branches
@@ -164,22 +218,25 @@ class SyncWebSocketHandler(BaseWebSocketHandler):
             cmd, data = message, ""
 
         if cmd == "ListSockets":
-            for uuid in sockets.uuids:
-                await syncwebsockets.send(
-                    self.uuid,
-                    "AddSocket",
-                    {
-                        "uuid": uuid,
-                        "filename": sockets.get_filename(uuid)
-                        if self.request.app["settings"].show_filename
-                        else "",
-                    },
-                )
+            await self.list_sockets()
         elif cmd == "ListWebsockets":
             for uuid in websockets.uuids:
+                status_bus.delivered("AddWebSocket", uuid)
                 await syncwebsockets.send(self.uuid, "AddWebSocket", uuid)
+        elif cmd == "Snapshot":
+            processes = await process_scanner.get()
+            # Later ListProcesses only get the changes of the table
+            process_scanner.mark_sent(self.uuid, processes)
+            await syncwebsockets.send(
+                self.uuid, status_bus.snapshot(processes)
+            )
+        elif cmd == "ListQueues":
+            await syncwebsockets.send(
+                self.uuid, "QueueSizes", sockets.queue_sizes()
+            )
         elif cmd == "ListBreaks":
             for brk in breakpoints.get():
+                status_bus.delivered("AddBreak", brk)
                 await syncwebsockets.send(self.uuid, "AddBreak", brk)
         elif cmd == "RemoveBreak":
             brk = json.loads(data)
@@ -193,37 +250,54 @@ class SyncWebSocketHandler(BaseWebSocketHandler):
             await websockets.close(data)
             await websockets.remove(data)
         elif cmd == "ListProcesses":
-            await refresh_process(self.uuid)
+            await refresh_process(self.uuid, full=data == "full")
+        elif cmd == "ListThreads":
+            await refresh_threads(self.uuid, int(data))
         elif cmd == "Pause":
-            if int(data) == os.getpid():
-                log.debug("Pausing self")
-                Process(target=self_shell).start()
-
-            else:
-                log.debug("Pausing %s", data)
-                command = ["gdb", "-p", data, "-batch"] + [
-                    f"-eval-command=call {hook}"
-                    for hook in [
-                        "PyGILState_Ensure()",
-                        "PyRun_SimpleString("
-                        '"import wdb; wdb.set_trace(skip=1)"'
-                        ")",
-                        "PyGILState_Release($1)",
-                    ]
-                ]
-                await asyncio.create_subprocess_exec(
-                    *command,
-                    stdin=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                )
+            await self.pause(data)
         elif cmd == "RunFile":
             Process(target=run_file, args=(data,)).start()
         elif cmd == "RunShell":
             Process(target=run_shell).start()
 
+    async def list_sockets(self) -> None:
+        for uuid in sockets.uuids:
+            socket = {
+                "uuid": uuid,
+                "filename": sockets.get_filename(uuid)
+                if self.request.app["settings"].show_filename
+                else "",
+            }
+            status_bus.delivered("AddSocket", socket)
+            await syncwebsockets.send(self.uuid, "AddSocket", socket)
+
+    async def pause(self, pid: str) -> None:  # pylint: disable=no-self-use
+        if int(pid) == os.getpid():
+            log.debug("Pausing self")
+            Process(target=self_shell).start()
+
+        else:
+            log.debug("Pausing %s", pid)
+            command = ["gdb", "-p", pid, "-batch"] + [
+                f"-eval-command=call {hook}"
+                for hook in [
+                    "PyGILState_Ensure()",
+                    "PyRun_SimpleString("
+                    '"import wdb; wdb.set_trace(skip=1)"'
+                    ")",
+                    "PyGILState_Release($1)",
+                ]
+            ]
+            await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+
     async def on_close(self) -> None:
         if hasattr(self, "uuid"):
             await syncwebsockets.remove(self.uuid)
+            process_scanner.forget(self.uuid)
 
 
 class WebSocketHandler(BaseWebSocketHandler):